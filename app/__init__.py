@@ -49,6 +49,8 @@ INTERMEDIATE_LANGUAGES = ['', 'ja', 'ru']
 DEFAULT_USER_AGENT = 'AndroidTranslate/4.4.0.RC01.104701208-44000162 5.1 ' \
     'tablet GTR_TRANS_WLOPV1_ANDROID GTR_TRANS_WLOPV1_DE_EN_AR'
 MAX_TEXT_LENGTH = 8000
+# Texts longer than MAX_TEXT_LENGTH are translated in chunks
+MAX_LONG_TEXT_LENGTH = 100000
 
 
 try:
@@ -69,7 +71,10 @@ babel = Babel()
 def create_app(name=__name__, config={}):
     app = Flask(name)
     app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DB_URI')
-    # app.config['SQLALCHEMY_POOL_SIZE'] = 10
+    # With cooperative workers (see gunicorn.conf.py), a worker may need more
+    # database connections than the default pool size of 5
+    if os.environ.get('DB_POOL_SIZE'):
+        app.config['SQLALCHEMY_POOL_SIZE'] = int(os.environ['DB_POOL_SIZE'])
     app.secret_key = config.get('secret_key', '(secret key is not set)')
 
     app.config.update(config)
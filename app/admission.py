@@ -0,0 +1,338 @@
+"""Admission control and scheduling of upstream requests.
+
+At most `limit` upstream requests of a worker process are in flight at a
+time, and a few more may wait for a slot in a short queue. When the queue is
+full, or when a request would wait longer than its deadline, it is rejected
+right away with 503 and Retry-After, rather than piling up in workers until
+everything times out. Cached translations and other endpoints that do not
+go upstream are not affected.
+
+The limit adapts to the observed upstream latency: it grows by one after
+`limit` requests faster than `latency_target` (additive increase) and
+shrinks by a factor when a request is slower or fails (multiplicative
+decrease).
+
+Waiting requests are served in the order of weighted fair queuing. Each
+request belongs to a flow, i.e., a class of callers (interactive web users,
+API clients or bulk jobs) and a client address. Flows get slots in
+proportion to the weights of their classes, so that a single heavy client
+cannot starve the others, and each class may only take up its quota of the
+slots. The flow of the current thread is set by `set_flow()`, and carried
+over to other threads by `bind_flow()`."""
+
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+
+from app import config, logger
+from app.governor import EgressUnavailable
+from app.proxy import is_throttled
+from app.utils import HTTPException
+
+try:
+    from botocore.exceptions import ConnectionError as BotoConnectionError, \
+        HTTPClientError
+    _BOTOCORE_ERRORS = (BotoConnectionError, HTTPClientError)
+except ImportError:
+    _BOTOCORE_ERRORS = ()
+
+
+#: Weights and quotas (shares of the concurrency limit) of classes of callers
+DEFAULT_CLASSES = {
+    'interactive': {'weight': 8, 'quota': 1.0},
+    'api': {'weight': 2, 'quota': 0.75},
+    'bulk': {'weight': 1, 'quota': 0.5},
+}
+
+DEFAULT_FLOW = ('interactive', '')
+
+#: Errors of connections to Google Translate and to AWS Lambda
+TRANSPORT_ERRORS = (requests.ConnectionError, requests.Timeout) + \
+    _BOTOCORE_ERRORS
+
+_local = threading.local()
+
+
+def current_flow():
+    """Returns the flow, a tuple of the class and the client address, of the
+    current thread."""
+    return getattr(_local, 'flow', None) or DEFAULT_FLOW
+
+
+def set_flow(flow):
+    _local.flow = flow
+
+
+def bind_flow(fn):
+    """Returns a function that calls `fn` in the flow of the current thread,
+    to be run by another thread (e.g., of a thread pool)."""
+    flow = current_flow()
+
+    def bound(*args, **kwargs):
+        previous = getattr(_local, 'flow', None)
+        _local.flow = flow
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _local.flow = previous
+
+    return bound
+
+
+class Overloaded(HTTPException):
+
+    def __init__(self, retry_after):
+        retry_after = max(1, int(math.ceil(retry_after)))
+        super(Overloaded, self).__init__(
+            'The server is overloaded. Please try again in {} seconds.'
+            .format(retry_after), 503, {'Retry-After': str(retry_after)})
+        self.retry_after = retry_after
+
+
+def is_overload(error):
+    """Tells whether an exception raised by an upstream request indicates
+    that the upstream server is overloaded (or throttling us). Other errors
+    (e.g., of parsing a response) say nothing about the load, nor do the
+    rejections of this process itself (`Overloaded`, and `EgressUnavailable`
+    of the governor, which paces requests and handles blocks)."""
+    if isinstance(error, (Overloaded, EgressUnavailable)):
+        return False
+    if isinstance(error, HTTPException):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, TRANSPORT_ERRORS) or is_throttled(error)
+
+
+class _Ticket(object):
+    """A request waiting for, or holding, a slot."""
+
+    def __init__(self, cls, finish):
+        self.cls = cls
+        self.finish = finish
+        self.start = None
+
+
+class AdmissionController(object):
+    """
+    :param limit: initial number of concurrent upstream requests
+    :param min_limit: lower bound of the adaptive limit
+    :param max_limit: upper bound of the adaptive limit
+    :param queue_size: number of requests that may wait for a slot
+    :param max_wait: seconds for which a request may wait for a slot
+    :param latency_target: latency (in seconds) above which the limit is
+                           decreased
+    :param decrease: factor by which the limit is multiplied on overload
+    :param alpha: smoothing factor of the moving average of the latency
+    :param classes: weights and quotas of classes of callers (see
+                    `DEFAULT_CLASSES`). Requests of classes that are not
+                    among them fall into the class of `DEFAULT_FLOW` if it
+                    is, or else into the one of the largest weight.
+    """
+
+    def __init__(self, limit=16, min_limit=2, max_limit=64, queue_size=32,
+                 max_wait=2.0, latency_target=3.0, decrease=0.9, alpha=0.2,
+                 classes=DEFAULT_CLASSES, clock=time.time):
+        self.limit = float(limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.latency_target = latency_target
+        self.decrease = decrease
+        self.alpha = alpha
+        self.classes = classes
+        self.clock = clock
+
+        if not classes:
+            raise ValueError('No classes of callers')
+        for cls, params in classes.items():
+            if params.get('weight', 0) <= 0 or \
+                    not 0 < params.get('quota', 0) <= 1:
+                raise ValueError(
+                    "Class '{}' needs a positive weight and a quota in "
+                    "(0, 1]".format(cls))
+        self.default_class = DEFAULT_FLOW[0] if DEFAULT_FLOW[0] in classes \
+            else max(sorted(classes), key=lambda c: classes[c]['weight'])
+
+        self.latency = None
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.class_in_flight = dict((cls, 0) for cls in classes)
+        self._last_decrease = 0
+        self._waiting = []
+        # Finish tags of the last requests of flows and the virtual time of
+        # self-clocked fair queuing
+        self._finish = {}
+        self._virtual_time = 0.0
+        self._cond = threading.Condition()
+
+    def _slots(self):
+        return max(1, int(self.limit))
+
+    def _class(self, cls):
+        return cls if cls in self.classes else self.default_class
+
+    def _quota(self, cls):
+        return max(1, int(self.classes[cls]['quota'] * self._slots()))
+
+    def _expected_wait(self, ahead):
+        latency = self.latency if self.latency is not None \
+            else self.latency_target
+        return (ahead + 1) * latency / self._slots()
+
+    def expected_wait(self):
+        """Seconds for which a new request is expected to wait for a slot,
+        given that a slot frees up every `latency / limit` seconds on
+        average."""
+        if self.in_flight < self._slots():
+            return 0.0
+        return self._expected_wait(len(self._waiting))
+
+    def _dispatch(self):
+        """Gives free slots to waiting requests in the order of their finish
+        tags, skipping classes that have taken up their quotas."""
+        dispatched = False
+        while self.in_flight < self._slots():
+            candidates = [t for t in self._waiting
+                          if self.class_in_flight[t.cls] < self._quota(t.cls)]
+            if not candidates:
+                break
+            ticket = min(candidates, key=lambda t: t.finish)
+            self._waiting.remove(ticket)
+            ticket.start = self.clock()
+            self.in_flight += 1
+            self.class_in_flight[ticket.cls] += 1
+            self.admitted += 1
+            self._virtual_time = max(self._virtual_time, ticket.finish)
+            dispatched = True
+
+        if len(self._finish) > 1024:
+            # Finish tags behind the virtual time have no effect
+            self._finish = dict((k, v) for k, v in self._finish.items()
+                                if v > self._virtual_time)
+        return dispatched
+
+    def acquire(self, max_wait=None, flow=None):
+        """Waits for a slot and returns a ticket, which has to be passed to
+        `release()`.
+
+        :param flow: a tuple of the class and the client address; defaults to
+                     the flow of the current thread
+        :raises Overloaded: when no slot is expected to be free in time
+        """
+        if max_wait is None:
+            max_wait = self.max_wait
+        cls, client = flow or current_flow()
+        cls = self._class(cls)
+
+        with self._cond:
+            key = (cls, client)
+            previous = self._finish.get(key)
+            finish = max(self._virtual_time, previous or 0) + \
+                1.0 / self.classes[cls]['weight']
+            self._finish[key] = finish
+
+            ticket = _Ticket(cls, finish)
+            self._waiting.append(ticket)
+            if self._dispatch():
+                self._cond.notify_all()
+            if ticket.start is not None:
+                return ticket
+
+            ahead = sum(1 for t in self._waiting if t.finish < finish)
+            expected_wait = self._expected_wait(ahead)
+            if len(self._waiting) > self.queue_size or \
+                    expected_wait > max_wait:
+                self._waiting.remove(ticket)
+                if previous is None:
+                    del self._finish[key]
+                else:
+                    self._finish[key] = previous
+                self.rejected += 1
+                raise Overloaded(expected_wait)
+
+            deadline = self.clock() + max_wait
+            while ticket.start is None:
+                remaining = deadline - self.clock()
+                if remaining <= 0:
+                    self._waiting.remove(ticket)
+                    self.rejected += 1
+                    raise Overloaded(self.expected_wait())
+                self._cond.wait(remaining)
+            return ticket
+
+    def release(self, ticket, overloaded=False):
+        """Frees the slot of `ticket` and adapts the limit to the outcome of
+        the request."""
+        now = self.clock()
+        latency = now - ticket.start
+        with self._cond:
+            self.in_flight -= 1
+            self.class_in_flight[ticket.cls] -= 1
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency += self.alpha * (latency - self.latency)
+
+            if overloaded or latency > self.latency_target:
+                # Requests that were already in flight at the last decrease
+                # do not decrease the limit again
+                if ticket.start >= self._last_decrease:
+                    self.limit = max(self.min_limit,
+                                     self.limit * self.decrease)
+                    self._last_decrease = now
+                    logger.warning('Decreased the upstream concurrency limit '
+                                   'to {:.1f}'.format(self.limit))
+            else:
+                self.limit = min(self.max_limit,
+                                 self.limit + 1.0 / self.limit)
+
+            self._dispatch()
+            self._cond.notify_all()
+
+    @contextmanager
+    def admit(self, max_wait=None):
+        ticket = self.acquire(max_wait)
+        overloaded = False
+        try:
+            yield
+        except Exception as e:
+            overloaded = is_overload(e)
+            raise
+        finally:
+            self.release(ticket, overloaded)
+
+    def stats(self):
+        waiting = dict((cls, 0) for cls in self.classes)
+        for ticket in self._waiting:
+            waiting[ticket.cls] += 1
+        return {
+            'limit': self.limit,
+            'latency': self.latency,
+            'in_flight': self.in_flight,
+            'waiting': len(self._waiting),
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+            'classes': dict((cls, {'in_flight': self.class_in_flight[cls],
+                                   'waiting': waiting[cls]})
+                            for cls in self.classes),
+        }
+
+
+def build_admission(admission_config):
+    """Builds a controller as specified in the `admission` section of the
+    config."""
+    return AdmissionController(
+        limit=int(admission_config.get('limit', 16)),
+        min_limit=int(admission_config.get('min_limit', 2)),
+        max_limit=int(admission_config.get('max_limit', 64)),
+        queue_size=int(admission_config.get('queue_size', 32)),
+        max_wait=float(admission_config.get('max_wait', 2.0)),
+        latency_target=float(admission_config.get('latency_target', 3.0)),
+        classes=admission_config.get('classes') or DEFAULT_CLASSES)
+
+
+upstream_admission = build_admission(config.get('admission') or {})
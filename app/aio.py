@@ -0,0 +1,541 @@
+"""Asynchronous serving of the translation endpoints (Python 3.5+, aiohttp).
+
+Each request handled by the WSGI application holds a worker for the whole
+upstream round trip. Here, a request waiting for Google Translate or AWS Lambda
+only holds a coroutine, so a single process keeps thousands of translations
+in flight. Requests are validated, cached and answered the same way as in
+:mod:`app.api`.
+
+Run with ``python -m app.aio``; `HOST` and `PORT` are read from the
+environment as in `application.py`."""
+
+import asyncio
+import io
+import json
+import os
+import random
+
+import aiohttp
+from aiohttp import web
+
+from app import config, logger, INTERMEDIATE_LANGUAGES
+from app.api import DIRECT_EGRESS, MAX_BATCH_CONCURRENCY, MAX_BATCH_ITEMS, \
+    PACK_FAILURES, HTTPException, __cache_entry_v1_3__, __cache_key_v1_3__, \
+    __error_result__, __fields__, __identity_v1_3__, __params__, \
+    __plan_batch__, __translate_request__, __translate_response__, \
+    __unpack__, extract_sentences, lambda_event, read_lambda_response
+from app.cache import make_cache_key, translation_cache
+from app.governor import EgressUnavailable
+from app.langid import source_resolver
+from app.proxy import is_relayed_error, is_throttled, proxy_registry
+from app.transport import create_aws_session
+
+#: Parameters of `/api/v1.3/translate` which are not supported by this server
+UNSUPPORTED_PARAMS_V1_3 = ('session',)
+
+
+class AsyncSingleFlight(object):
+    """Counterpart of :class:`app.singleflight.SingleFlight` for
+    coroutines."""
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._futures = {}
+
+    async def do(self, key, fn, *args):
+        """Awaits `fn(*args)` unless a call with the same `key` is already in
+        flight, in which case its outcome is returned."""
+        future = self._futures.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            self.calls += 1
+            future = self._futures[key] = asyncio.ensure_future(fn(*args))
+            future.add_done_callback(lambda f: self._futures.pop(key, None))
+
+        # A caller that goes away must not cancel the call for the others
+        return await asyncio.shield(future)
+
+    def stats(self):
+        return {
+            'calls': self.calls,
+            'coalesced': self.coalesced,
+            'in_flight': len(self._futures),
+        }
+
+
+class LambdaError(Exception):
+    """Raised when a proxy function could not be invoked. `response`
+    mimics the one of botocore so that `is_throttled()` applies."""
+
+    def __init__(self, status_code, code):
+        super(LambdaError, self).__init__(
+            'Lambda returned HTTP {} ({})'.format(status_code, code))
+        self.response = {'Error': {'Code': code}}
+
+
+async def __parameters__(request):
+    if request.method == 'POST':
+        return await request.post()
+    return request.query
+
+
+def __text_response__(text, status, headers=None):
+    # Flask serves strings as HTML
+    if isinstance(text, bytes):
+        return web.Response(body=text, status=status, headers=headers,
+                            content_type='text/html', charset='utf-8')
+    return web.Response(text=text, status=status, headers=headers,
+                        content_type='text/html')
+
+
+class AsyncTranslator(object):
+    """Upstream clients and request handlers sharing a single event loop.
+
+    :param pool_size: maximum number of upstream connections; requests
+                      beyond it wait for a connection to be freed
+    :param cache: a :class:`app.cache.TieredCache`, of which the disk tier
+                  is accessed from the default executor rather than the
+                  event loop
+    """
+
+    def __init__(self, pool_size=1000, connect_timeout=3.05, read_timeout=10,
+                 max_retries=2, backoff=0.1, registry=proxy_registry,
+                 cache=translation_cache):
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.registry = registry
+        self.cache = cache
+        self.flight = AsyncSingleFlight()
+        self.session = None
+        self._aws_session = None
+
+    async def start(self, app=None):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.pool_size),
+            timeout=aiohttp.ClientTimeout(sock_connect=self.connect_timeout,
+                                          sock_read=self.read_timeout))
+
+    async def close(self, app=None):
+        await self.session.close()
+
+    async def cache_get(self, key):
+        """Counterpart of `TieredCache.get()`."""
+        value = self.cache.memory.get(key)
+        if value is None and self.cache.disk is not None:
+            value = await asyncio.get_event_loop().run_in_executor(
+                None, self.cache.disk.get, key)
+            if value is not None:
+                self.cache.memory.set(key, value)
+        return value
+
+    async def cache_set(self, key, value):
+        """Counterpart of `TieredCache.set()`."""
+        self.cache.memory.set(key, value)
+        if self.cache.disk is not None:
+            await asyncio.get_event_loop().run_in_executor(
+                None, self.cache.disk.set, key, value)
+
+    async def _request(self, method, url, **kwargs):
+        """Returns a tuple of the status code, the headers and the body of a
+        response. Only connection errors and timeouts are retried, as in
+        :class:`app.transport.UpstreamTransport`."""
+        attempt = 0
+        while True:
+            try:
+                async with self.session.request(method, url,
+                                                **kwargs) as resp:
+                    return resp.status, resp.headers, await resp.read()
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt >= self.max_retries:
+                    raise
+                logger.warning('Retrying {} {}: {}'.format(method, url, e))
+                await asyncio.sleep(
+                    random.uniform(0, self.backoff * (2 ** attempt)))
+                attempt += 1
+
+    async def translate_text(self, text, source, target, user_agent):
+        """Counterpart of `app.api.__translate__()` (client 'x')."""
+        if source == target:
+            return text
+
+        governor = self.registry.governor
+        try:
+            if governor is not None:
+                wait = governor.reserve(DIRECT_EGRESS)
+                if wait > 0:
+                    await asyncio.sleep(wait)
+        except EgressUnavailable:
+            return await self.translate_via_proxy(text, source, target,
+                                                  user_agent)
+
+        url, headers, payload = __translate_request__(text, source, target,
+                                                      'x', user_agent)
+        # aiohttp works out the actual length of the body
+        del headers['Content-Length']
+        try:
+            status, _, body = await self._request('POST', url,
+                                                  headers=headers,
+                                                  data=payload)
+        except Exception:
+            if governor is not None:
+                governor.cancel(DIRECT_EGRESS)
+            raise
+        body = body.decode('utf-8')
+        if governor is not None and \
+                governor.record(DIRECT_EGRESS, status, body):
+            return await self.translate_via_proxy(text, source, target,
+                                                  user_agent)
+        return __translate_response__(body, status, 'x')
+
+    async def translate_via_proxy(self, text, source, target, user_agent):
+        """Counterpart of `app.api.__translate_via_proxy__()`."""
+        params = __params__(text, source, target, user_agent=user_agent,
+                            fields=('t',), remote_addr='')
+        resp_text, resp_status_code = await self.lambda_translate(params)
+        if resp_status_code != 200:
+            raise HTTPException(
+                'Google Translate returned HTTP {}'.format(resp_status_code),
+                resp_status_code)
+        if isinstance(resp_text, bytes):
+            resp_text = resp_text.decode('utf-8')
+        return extract_sentences(json.loads(resp_text))
+
+    def _sign(self, function_name, body):
+        """Returns the URL and the headers of a request invoking a Lambda
+        function, signed with AWS Signature Version 4."""
+        from botocore.auth import SigV4Auth
+        from botocore.awsrequest import AWSRequest
+
+        if self._aws_session is None:
+            self._aws_session = create_aws_session()
+        region = self._aws_session.region_name
+        url = 'https://lambda.{}.amazonaws.com/2015-03-31/functions/{}/' \
+            'invocations'.format(region, function_name)
+        aws_request = AWSRequest(method='POST', url=url, data=body, headers={
+            'Content-Type': 'application/json',
+            'X-Amz-Invocation-Type': 'RequestResponse',
+        })
+        SigV4Auth(self._aws_session.get_credentials(), 'lambda',
+                  region).add_auth(aws_request)
+        return url, dict(aws_request.headers.items())
+
+    async def lambda_get(self, url, params={}, data={}, headers={},
+                         passthrough=False, exclude=(), method='get',
+                         encoding=None):
+        """Counterpart of `app.api.lambda_get()`, routed through the same
+        proxy registry. Throttled invocations are retried on another
+        function."""
+        body = json.dumps(lambda_event(url, params, data, headers, passthrough,
+                                       method, encoding)).encode('utf-8')
+        tried = list(exclude)
+        governor = self.registry.governor
+        while True:
+            function = self.registry.acquire(tried)
+            start = self.registry.clock()
+            try:
+                if governor is not None:
+                    wait = governor.reserve(function.name)
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+                    start = self.registry.clock()
+                invoke_url, invoke_headers = self._sign(function.name, body)
+                status, resp_headers, content = await self._request(
+                    'POST', invoke_url, headers=invoke_headers, data=body)
+                if status >= 300:
+                    raise LambdaError(status, resp_headers.get(
+                        'X-Amzn-ErrorType', '').split(':')[0])
+            except Exception as e:
+                self.registry.record_failure(
+                    function.name, self.registry.clock() - start,
+                    throttled=is_throttled(e))
+                if governor is not None:
+                    governor.cancel(function.name)
+                tried.append(function.name)
+                if not is_throttled(e) or \
+                        len(tried) >= len(self.registry.functions):
+                    raise
+                continue
+            finally:
+                self.registry.release(function)
+
+            function_error = resp_headers.get('X-Amz-Function-Error')
+            if function_error and not is_relayed_error(content):
+                self.registry.record_failure(function.name,
+                                             self.registry.clock() - start)
+            else:
+                self.registry.record_success(function.name,
+                                             self.registry.clock() - start)
+            return {'FunctionError': function_error,
+                    'Payload': io.BytesIO(content),
+                    'ProxyFunction': function.name}
+
+    async def lambda_translate(self, params):
+        """Counterpart of `app.api.__lambda_translate__()`."""
+        encoding = self.registry.encoding
+        passthrough = self.registry.passthrough and not encoding
+        tried = []
+        while True:
+            resp = await self.lambda_get(
+                params['url'], params=params['payload'],
+                data=params['data'], headers=params['headers'],
+                passthrough=passthrough, exclude=tried,
+                method=params['method'], encoding=encoding)
+            resp_text, resp_status_code = read_lambda_response(resp,
+                                                               passthrough)
+            function = resp.get('ProxyFunction')
+            if not self.registry.record_response(function, resp_status_code,
+                                                 resp_text):
+                return resp_text, resp_status_code
+
+            tried.append(function)
+            if len(tried) >= len(self.registry.functions):
+                raise EgressUnavailable(
+                    self.registry.governor.retry_after(tried))
+
+    async def translate_v1_3_text(self, text, source, target, fields,
+                                  remote_addr):
+        """Counterpart of `app.api.__translate_v1_3__()`."""
+        cache_key = __cache_key_v1_3__(text, source, target, fields)
+        cached = await self.cache_get(cache_key)
+        if cached is not None:
+            return cached['text'], cached['status_code']
+
+        params = __params__(text, source, target, fields=fields,
+                            remote_addr=remote_addr)
+
+        async def fetch():
+            resp_text, resp_status_code = await self.lambda_translate(params)
+            # Error pages (e.g., captcha) are not cached
+            if resp_status_code == 200:
+                await self.cache_set(cache_key, __cache_entry_v1_3__(
+                    resp_text, resp_status_code))
+            return resp_text, resp_status_code
+
+        return await self.flight.do(cache_key, fetch)
+
+    async def translate_v1_3(self, request):
+        """Serves `/api/v1.3/translate` as `app.api.translate_v1_3()`
+        does, except for sessions (see `UNSUPPORTED_PARAMS_V1_3`)."""
+        request_params = await __parameters__(request)
+        try:
+            text, source, target = \
+                [request_params[k] for k in ('text', 'source', 'target')]
+        except KeyError as e:
+            return __text_response__('Missing parameter: {}'.format(e), 400)
+        for param in UNSUPPORTED_PARAMS_V1_3:
+            if param in request_params:
+                return __text_response__(
+                    'Unsupported parameter: {}'.format(param), 400)
+        intermediate = request_params.get('intermediate', '')
+
+        if intermediate not in INTERMEDIATE_LANGUAGES:
+            return __text_response__('Invalid intermediate language.', 400)
+
+        fields = __fields__(request_params)
+        if fields is None:
+            return __text_response__('Invalid fields.', 400)
+
+        source = source_resolver.resolve(text, source)
+        if source == target:
+            return web.json_response(__identity_v1_3__(text, source))
+
+        try:
+            if not intermediate or intermediate in (source, target):
+                return __text_response__(*await self.translate_v1_3_text(
+                    text, source, target, fields, request.remote))
+
+            # The translated text of the first hop is needed for the second
+            intermediate_fields = fields if 't' in fields else ('t',) + fields
+            resp_text, resp_status_code = await self.translate_v1_3_text(
+                text, source, intermediate, intermediate_fields,
+                request.remote)
+            if resp_status_code != 200:
+                return __text_response__(resp_text, resp_status_code)
+            intermediate_result = json.loads(resp_text)
+
+            resp_text, resp_status_code = await self.translate_v1_3_text(
+                extract_sentences(intermediate_result), intermediate, target,
+                fields, request.remote)
+            if resp_status_code != 200:
+                return __text_response__(resp_text, resp_status_code)
+            result = json.loads(resp_text)
+            result['intermediate'] = intermediate_result
+
+            return web.json_response(result)
+
+        except HTTPException as e:
+            return __text_response__(e.message, e.status_code, e.headers)
+
+    async def translate(self, text, mode, source, target, user_agent):
+        """Counterpart of `app.api.translate()` for validated texts of up to
+        MAX_TEXT_LENGTH characters."""
+        source = source_resolver.resolve(text, source)
+        if source == target:
+            return dict(
+                id=None,
+                id_b62=None,
+                intermediate_text=None,
+                translated_text=text)
+
+        if mode not in ('1', '2'):
+            raise HTTPException('Invalid translation mode.', 400)
+
+        cache_key = make_cache_key(text, source, target, mode, 'x')
+        cached = await self.cache_get(cache_key)
+        if cached is not None:
+            return cached
+
+        async def fetch():
+            intermediate_text = None
+            if mode == '2':
+                intermediate_text = await self.translate_text(
+                    text, source, 'ja', user_agent)
+                translated_text = await self.translate_text(
+                    intermediate_text, 'ja', target, user_agent)
+            else:
+                translated_text = await self.translate_text(
+                    text, source, target, user_agent)
+
+            result = dict(
+                id=None,
+                request_id=None,
+                intermediate_text=intermediate_text,
+                intermediate_raw=None,
+                translated_text=translated_text,
+                translated_raw=None,
+            )
+            await self.cache_set(cache_key, result)
+            return result
+
+        return await self.flight.do(cache_key, fetch)
+
+    async def translate_packed(self, texts, source, target, user_agent):
+        """Counterpart of `app.api.__translate_packed__()`."""
+        try:
+            translated = await self.translate_text('\n'.join(texts), source,
+                                                   target, user_agent)
+            lines = translated.split('\n')
+        except PACK_FAILURES:
+            raise
+        except Exception as e:
+            logger.warning('Packed request failed: {}'.format(e))
+            lines = None
+
+        if lines is None or len(lines) != len(texts):
+            # See `app.api.__translate_packed__()`
+            outcomes = await asyncio.gather(*[
+                self.translate(text, '1', source, target, user_agent)
+                for text in texts], return_exceptions=True)
+            return [__error_result__(outcome)
+                    if isinstance(outcome, Exception) else outcome
+                    for outcome in outcomes]
+        results = __unpack__(texts, lines, source, target, cache=None)
+        for text, result in zip(texts, results):
+            await self.cache_set(
+                make_cache_key(text, source, target, '1', 'x'), result)
+        return results
+
+    async def translate_batch(self, items, user_agent,
+                              concurrency=MAX_BATCH_CONCURRENCY):
+        """Counterpart of `app.api.translate_batch()`."""
+        # Items are looked up in the cache, of which the disk tier must not
+        # block the event loop
+        if self.cache.disk is None:
+            plan = __plan_batch__(items)
+        else:
+            plan = await asyncio.get_event_loop().run_in_executor(
+                None, __plan_batch__, items)
+        results, unique, pending, singles, packs = plan
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(keys, fn, *args):
+            async with semaphore:
+                try:
+                    outcomes = await fn(*args)
+                except Exception as e:
+                    outcomes = __error_result__(e)
+
+            # A single result (or error) applies to all items of the task
+            if isinstance(outcomes, dict):
+                outcomes = [outcomes] * len(keys)
+
+            for key, result in zip(keys, outcomes):
+                for i in unique[key]:
+                    results[i] = result
+
+        tasks = [run([key], self.translate, *(pending[key] + (user_agent,)))
+                 for key in singles]
+        for keys, source, target in packs:
+            tasks.append(run(keys, self.translate_packed,
+                             [pending[key][0] for key in keys], source,
+                             target, user_agent))
+        await asyncio.gather(*tasks)
+
+        return results
+
+    async def translate_batch_v1_3(self, request):
+        """Serves `/api/v1.3/translate/batch` as
+        `app.api.translate_batch_v1_3()` does."""
+        try:
+            body = await request.json()
+        except ValueError:
+            body = None
+        items = body.get('items') if isinstance(body, dict) else None
+
+        if not isinstance(items, list):
+            return __text_response__('A list of items is required.', 400)
+        if len(items) > MAX_BATCH_ITEMS:
+            return __text_response__('Too many items.', 413)
+
+        user_agent = request.headers.get('User-Agent', 'Unknown')
+        return web.json_response(
+            {'results': await self.translate_batch(items, user_agent)})
+
+    async def metrics(self, request):
+        governor = self.registry.governor
+        return web.json_response({'cache': self.cache.stats(),
+                                  'governor': governor and governor.stats(),
+                                  'langid': source_resolver.stats(),
+                                  'proxies': self.registry.stats(),
+                                  'singleflight': self.flight.stats()})
+
+
+def build_translator(upstream_config):
+    """Builds a translator as specified in the `upstream` section of the
+    config."""
+    return AsyncTranslator(
+        pool_size=int(upstream_config.get('async_pool_size', 1000)),
+        connect_timeout=float(upstream_config.get('connect_timeout', 3.05)),
+        read_timeout=float(upstream_config.get('read_timeout', 10)),
+        max_retries=int(upstream_config.get('max_retries', 2)),
+        backoff=float(upstream_config.get('backoff', 0.1)))
+
+
+def create_app(translator=None):
+    if translator is None:
+        translator = build_translator(config.get('upstream') or {})
+
+    app = web.Application()
+    app.on_startup.append(translator.start)
+    app.on_cleanup.append(translator.close)
+
+    app.router.add_route('GET', '/api/v1.3/translate',
+                         translator.translate_v1_3)
+    app.router.add_route('POST', '/api/v1.3/translate',
+                         translator.translate_v1_3)
+    app.router.add_route('POST', '/api/v1.3/translate/batch',
+                         translator.translate_batch_v1_3)
+    app.router.add_route('GET', '/api/v1.3/metrics', translator.metrics)
+
+    return app
+
+
+if __name__ == '__main__':
+    web.run_app(create_app(),
+                host=os.environ.get('HOST', '0.0.0.0'),
+                port=int(os.environ.get('PORT', 8002)))
@@ -1,68 +1,269 @@
 # -*- coding: utf-8 -*-
+import base64
 import json
 import operator
 import os
-import random
 import re
 import sys
 import urllib
 import uuid
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-import requests
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, \
+    stream_with_context
 from flask.ext.babel import gettext as _
 
 from app import config, logger, VALID_LANGUAGES, SOURCE_LANGUAGES, \
     TARGET_LANGUAGES, INTERMEDIATE_LANGUAGES, DEFAULT_USER_AGENT, \
-    MAX_TEXT_LENGTH
-from app.utils import HTTPException, parse_javascript
+    MAX_TEXT_LENGTH, MAX_LONG_TEXT_LENGTH
+from app.admission import Overloaded, bind_flow, set_flow, \
+    upstream_admission
+from app.batcher import build_batcher
+from app.cache import make_cache_key, translation_cache
+from app.governor import EgressUnavailable, upstream_governor
+from app.hedge import lambda_hedger
+from app.langid import source_resolver
+from app.proxy import proxy_registry
+from app.segment import iter_chunks, join_sentences, pack_sentences, \
+    split_chunks, split_sentences
+from app.sessions import MAX_TOKEN_LENGTH, translation_sessions
+from app.singleflight import translation_flight
+from app.transport import get_executor, get_transport
+from app.utils import HTTPException, get_remote_address, parse_javascript
 
 
 api_module = Blueprint('api', __name__)
 
+#: Classes of callers of endpoints, by which upstream requests are scheduled
+#: (see app.admission). Endpoints not listed here serve interactive users.
+ENDPOINT_CLASSES = {
+    'api.translate_v1_0': 'api',
+    'api.translate_1_1': 'api',
+    'api.translate_1_2': 'api',
+    'api.translate_batch_v1_3': 'bulk',
+    'api.translate_multi_v1_3': 'api',
+    'api.translate_pivots_v1_3': 'api',
+    'api.translate_stream': 'bulk',
+}
 
-def get_lambda_client():
-    """First attempt to get AWS configuration from the environment variables;
-    then try to access the config object if environment variables are not
-    available."""
-    from boto3.session import Session
-    access_key = os.environ.get('AWS_ACCESS_KEY_ID',
-                                config['aws']['access_key'])
-    secret_key = os.environ.get('AWS_SECRET_ACCESS_KEY',
-                                config['aws']['secret_key'])
-    region = os.environ.get('AWS_DEFAULT_REGION',
-                            config['aws']['region'])
+#: Upper bound of the length of a text sent in a single upstream request when
+#: translating a batch of sentences
+MAX_BATCH_LENGTH = 4000
 
-    session = Session(aws_access_key_id=access_key,
-                      aws_secret_access_key=secret_key,
-                      region_name=region)
+#: Failures of a packed request that would not be got around by translating
+#: its texts one by one, as they are rejections of this process
+PACK_FAILURES = (Overloaded, EgressUnavailable)
 
-    return session.client('lambda')
+#: Pivot translations of texts longer than this are pipelined chunk by chunk
+PIPELINE_THRESHOLD = 1000
 
-    import boto3
-    client = boto3.client('lambda')
-    return client
+#: Upper bound of the length of a chunk of a pipelined translation
+PIPELINE_CHUNK_LENGTH = 500
 
+#: Upper bound of the number of items in a batch translation request
+MAX_BATCH_ITEMS = 1000
 
-def lambda_get(url, params={}, data={}, headers={}):
-    """Sends an HTTP GET request via AWS Lambda."""
-    lambda_client = get_lambda_client()
+#: Upper bound of the number of concurrent upstream requests of a batch
+MAX_BATCH_CONCURRENCY = 4
 
-    function_names = ['web_proxy', 'web_proxy2']
+#: Upper bound of the number of concurrent upstream requests of a
+#: multi-target translation
+MAX_FANOUT_CONCURRENCY = 8
 
-    payload = {
+#: Texts of a batch shorter than this are packed into combined requests
+MAX_PACKED_TEXT_LENGTH = 200
+
+#: Upper bound of the length of a text of a streaming translation request
+MAX_STREAM_TEXT_LENGTH = 1000000
+
+#: Upper bound of the length of a segment of a streaming translation
+STREAM_CHUNK_LENGTH = 1000
+
+#: Number of segments of a streaming translation being translated ahead of
+#: the one to be sent next
+STREAM_WINDOW = 4
+
+#: Upper bound of the length of a chunk of a text longer than MAX_TEXT_LENGTH
+MAX_CHUNK_LENGTH = 2000
+
+#: Upper bound of the number of chunks of a text translated concurrently
+MAX_CHUNK_CONCURRENCY = 8
+
+#: Response fields ('dt' parameters) of the 'translate_a/single' endpoint:
+#: translation, language detection, query correction, romanization and
+#: dictionary entries
+DT_FIELDS = ('t', 'ld', 'qc', 'rm', 'bd')
+
+#: Name of the egress of requests sent to Google Translate from this worker
+#: rather than through the proxy functions (see app.governor)
+DIRECT_EGRESS = 'direct'
+
+
+@api_module.before_request
+def classify_request():
+    """Sets the flow of upstream requests made while handling the current
+    request."""
+    set_flow((ENDPOINT_CLASSES.get(request.endpoint, 'interactive'),
+              get_remote_address(request)))
+
+
+@api_module.teardown_request
+def unclassify_request(exception=None):
+    set_flow(None)
+
+
+def get_lambda_client():
+    """Returns the Lambda client of the current worker process."""
+    return get_transport().lambda_client
+
+
+def lambda_event(url, params={}, data={}, headers={}, passthrough=False,
+                 method='get', encoding=None):
+    """Returns the event of a Lambda invocation relaying an HTTP request.
+
+    :param passthrough: asks the function to return the response body as
+                        the invocation result (see `read_lambda_response()`)
+    :param encoding: asks the function to return the response body
+                     compressed with the encoding (see `read_lambda_body()`)
+    """
+    event = {
         'url': url,
+        'method': method,
         'params': params,
         'data': data,
         'headers': headers,
     }
-    resp = lambda_client.invoke(
-        FunctionName=random.choice(function_names),
+    if passthrough:
+        event['passthrough'] = True
+    if encoding:
+        event['accept_encoding'] = [encoding]
+    return event
+
+
+def lambda_invoke(event, exclude=()):
+    """Invokes a proxy function with an event.
+
+    :param exclude: names of proxy functions not to send the request through
+    """
+    kwargs = dict(
+        exclude=exclude,
         InvocationType='RequestResponse',
         LogType='Tail',
-        Payload=json.dumps(payload)
+        Payload=json.dumps(event)
     )
-    return resp
+    # Each invocation takes a slot of admission control once the governor
+    # has let it through
+    kwargs['admission'] = upstream_admission
+    if lambda_hedger.enabled:
+        return lambda_hedger.invoke(proxy_registry, get_lambda_client(),
+                                    **kwargs)
+    return proxy_registry.invoke(get_lambda_client(), **kwargs)
+
+
+def lambda_get(url, params={}, data={}, headers={}, passthrough=False,
+               exclude=(), method='get', encoding=None):
+    """Sends an HTTP request (GET unless `method` says otherwise) via AWS
+    Lambda.
+
+    :param exclude: names of proxy functions not to send the request through
+    """
+    return lambda_invoke(
+        lambda_event(url, params, data, headers, passthrough, method,
+                     encoding),
+        exclude)
+
+
+def lambda_get_batch(events):
+    """Sends the requests of events of `lambda_event()` through a single
+    invocation, and returns a list of tuples of the response body, the HTTP
+    status code and the name of the proxy function of each of them."""
+    batch = {'requests': events}
+    if proxy_registry.encoding:
+        batch['accept_encoding'] = [proxy_registry.encoding]
+    resp = lambda_invoke(batch)
+    content = json.loads(resp['Payload'].read().decode('utf-8'))
+    if resp.get('FunctionError'):
+        raise HTTPException('Proxy function failed: {}'.format(
+            content.get('errorMessage')), 502)
+    return [read_lambda_body(r) + (resp.get('ProxyFunction'),)
+            for r in content['responses']]
+
+
+lambda_batcher = build_batcher(lambda_get_batch, config.get('batch') or {})
+
+
+def read_lambda_response(resp, passthrough=False):
+    """Returns a tuple of the response body and the HTTP status code out of
+    the result of `lambda_get()`.
+
+    In the pass-through mode, the body of a successful response is the
+    invocation payload itself, so its bytes are returned as they are instead
+    of being decoded, unwrapped and encoded again. Other responses come back
+    as function errors."""
+    payload = resp['Payload'].read()
+    if not passthrough:
+        content = json.loads(payload.decode('utf-8'))
+    elif resp.get('FunctionError'):
+        error = json.loads(payload.decode('utf-8'))
+        try:
+            content = json.loads(error['errorMessage'])
+        except (KeyError, ValueError):
+            raise HTTPException('Proxy function failed: {}'.format(
+                error.get('errorMessage')), 502)
+    else:
+        return payload, 200
+    return read_lambda_body(content)
+
+
+def read_lambda_body(content):
+    """Returns a tuple of the response body and the HTTP status code out of
+    a response relayed by a proxy function.
+
+    When the function has compressed the body (lambda/lambda_function.py >=
+    0.3.0 does so if asked to), the raw bytes of the body are returned, which
+    go into responses as they are. Otherwise, the body is the text of the
+    response."""
+    encoding = content.get('encoding')
+    if encoding is None:
+        return content['text'], content['status_code']
+    if encoding != 'zlib':
+        raise HTTPException('Unsupported encoding: {}'.format(encoding), 502)
+    return zlib.decompress(base64.b64decode(content['body'])), \
+        content['status_code']
+
+
+def __lambda_translate__(params):
+    """Sends a request built by `__params__()` through the proxy functions
+    and returns a tuple of the response body and the HTTP status code. A
+    request that gets blocked (see `app.governor`) is sent again through
+    another function. Unless it is sent again, it may be batched with other
+    requests (see `app.batcher`)."""
+    # Compressed bodies are relayed as they are as well
+    encoding = proxy_registry.encoding
+    passthrough = proxy_registry.passthrough and not encoding
+    tried = []
+    while True:
+        if lambda_batcher.enabled and not tried:
+            resp_text, resp_status_code, function = lambda_batcher.submit(
+                lambda_event(params['url'], params['payload'], params['data'],
+                             params['headers'], method=params['method']))
+        else:
+            resp = lambda_get(params['url'], params=params['payload'],
+                              data=params['data'], headers=params['headers'],
+                              passthrough=passthrough, exclude=tried,
+                              method=params['method'], encoding=encoding)
+            resp_text, resp_status_code = read_lambda_response(resp,
+                                                               passthrough)
+            function = resp.get('ProxyFunction')
+        if not proxy_registry.record_response(function, resp_status_code,
+                                              resp_text):
+            return resp_text, resp_status_code
+
+        tried.append(function)
+        if len(tried) >= len(proxy_registry.functions):
+            raise EgressUnavailable(upstream_governor.retry_after(tried))
 
 
 def __payload_as_tuples__(payload):
@@ -76,21 +277,30 @@ def __payload_as_tuples__(payload):
 
 
 def __params__(text, source, target, client='at',
-               user_agent=DEFAULT_USER_AGENT):
+               user_agent=DEFAULT_USER_AGENT, fields=DT_FIELDS,
+               remote_addr=None):
     """Returns a dictionary containing all parameters to send a translation
-    request to Google Translate."""
+    request to Google Translate.
+
+    :param fields: response fields to ask for (see `DT_FIELDS`). Fields that
+                   are not asked for are left out of the response.
+    :param remote_addr: address of the client; defaults to the one of the
+                        current request
+    """
 
     headers = {
         'User-Agent': user_agent,
         'Content-Length': str(sys.getsizeof(text))
     }
-    remote_addr = request.remote_addr if request.remote_addr else ''
+    if remote_addr is None:
+        remote_addr = request.remote_addr
+    remote_addr = remote_addr if remote_addr else ''
     payload = {
         'client': client,
         'sl': source,
         'tl': target,
         'q': text,
-        'dt': ['t', 'ld', 'qc', 'rm', 'bd'],
+        'dt': list(fields),
         'dj': 1,
         # Generate a UUID based on the remote client's IP address
         'iid': str(uuid.uuid5(uuid.NAMESPACE_DNS, remote_addr)),
@@ -111,19 +321,35 @@ def __params__(text, source, target, client='at',
     if len(quote(text)) > 1000:
         method = 'post'
         del payload['q']
+        data = {'q': text}
     else:
         method = 'get'
         del headers['Content-Length']
+        data = {}
 
     return {
         'headers': headers,
         'payload': payload,
+        'data': data,
         'method': method,
         'url': url,
         'query': urlencode(list(__payload_as_tuples__(payload)))
     }
 
 
+def __fields__(request_params):
+    """Returns the response fields requested by the `fields` parameter (a
+    comma-separated list), or all of them when it is not given. Returns
+    `None` if it has an unknown field."""
+    value = request_params.get('fields')
+    if not value:
+        return DT_FIELDS
+    fields = set(value.split(','))
+    if not fields <= set(DT_FIELDS):
+        return None
+    return tuple(f for f in DT_FIELDS if f in fields)
+
+
 def get_languages(field):
     """Returns a list of languages.
 
@@ -155,7 +381,10 @@ def params():
     request_params = request.form if request.method == 'POST' else request.args
     text, source, target = \
         [request_params[x] for x in ('text', 'source', 'target')]
-    return jsonify(__params__(text, source, target))
+    fields = __fields__(request_params)
+    if fields is None:
+        return 'Invalid fields.', 400
+    return jsonify(__params__(text, source, target, fields=fields))
 
 
 @api_module.route('/api/v1.3/parse_javascript', methods=['post'])
@@ -168,10 +397,10 @@ def _parse_javascript():
 def parse_result():
     """Parses a translation result."""
     raw = request.form['raw']
-    parsed = parse_javascript(raw)
 
-    # Extract translated sentences
-    translations = [x[0] for x in parsed[0]]
+    # Extract translated sentences, i.e., `[x[0] for x in parsed[0]]`,
+    # without decoding the rest of the result
+    translations = parse_javascript(raw, (0, None, 0))
 
     # Filter out None elements
     translations = filter(None, translations)
@@ -286,7 +515,7 @@ def translate_v1_0():
         return jsonify(translate(text, mode, source, target))
 
     except HTTPException as e:
-        return e.message, e.status_code
+        return e.message, e.status_code, e.headers
 
     except Exception as e:
         logger.exception(e)
@@ -315,7 +544,7 @@ def translate_1_1():
         return jsonify(payload)
 
     except HTTPException as e:
-        return e.message, e.status_code
+        return e.message, e.status_code, e.headers
 
     except Exception as e:
         logger.exception(e)
@@ -345,7 +574,7 @@ def translate_1_2():
         return jsonify(payload)
 
     except HTTPException as e:
-        return e.message, e.status_code
+        return e.message, e.status_code, e.headers
 
     except Exception as e:
         logger.exception(e)
@@ -363,6 +592,63 @@ def __translate__(text, source, target, client='x',
     if source == target:
         return text
 
+    try:
+        return __translate_direct__(text, source, target, client, user_agent)
+    except EgressUnavailable:
+        # The proxy functions only speak the 'translate_a/single' endpoint,
+        # which has the same results as client 'x'
+        if client != 'x':
+            raise
+    return __translate_via_proxy__(text, source, target, user_agent)
+
+
+def __translate_direct__(text, source, target, client, user_agent):
+    """Sends a translation request to Google Translate through the direct
+    egress of this worker, as paced by the governor.
+
+    :raises EgressUnavailable: when the direct egress is (or gets) blocked
+    """
+    url, headers, payload = __translate_request__(text, source, target,
+                                                  client, user_agent)
+    # The turn at the egress comes first, so that a request being paced does
+    # not hold a slot of admission control
+    upstream_governor.acquire(DIRECT_EGRESS)
+    responded = False
+    try:
+        with upstream_admission.admit():
+            req = get_transport().post(url, headers=headers, data=payload)
+            responded = True
+            if upstream_governor.record(DIRECT_EGRESS, req.status_code,
+                                        req.text):
+                raise EgressUnavailable(
+                    upstream_governor.retry_after([DIRECT_EGRESS]))
+            return __translate_response__(req.text, req.status_code, client)
+    except Exception:
+        if not responded:
+            upstream_governor.cancel(DIRECT_EGRESS)
+        raise
+
+
+def __translate_via_proxy__(text, source, target, user_agent):
+    """Translates a text through the proxy functions rather than the direct
+    egress, and returns the translated text as `__translate__()` does with
+    client 'x'."""
+    params = __params__(text, source, target, user_agent=user_agent,
+                        fields=('t',), remote_addr='')
+    resp_text, resp_status_code = __lambda_translate__(params)
+    if resp_status_code != 200:
+        raise HTTPException(
+            ('Google Translate returned HTTP {}'.format(resp_status_code)),
+            resp_status_code)
+    if isinstance(resp_text, bytes):
+        resp_text = resp_text.decode('utf-8')
+    return extract_sentences(json.loads(resp_text))
+
+
+def __translate_request__(text, source, target, client, user_agent):
+    """Returns a tuple of the URL, the headers and the form data of a
+    request to translate a text."""
+
     if not re.match(r'Mozilla/\d+\.\d+ \(.*', user_agent):
         user_agent = 'Mozilla/5.0 (%s)' % user_agent
 
@@ -379,15 +665,20 @@ def __translate__(text, source, target, client='x',
     }
     url = 'http://translate.google.com/translate_a/t'
 
-    req = requests.post(url, headers=headers, data=payload)
+    return url, headers, payload
 
-    if req.status_code != 200:
+
+def __translate_response__(body, status_code, client):
+    """Extracts the translation out of the response of the request built by
+    `__translate_request__()`."""
+
+    if status_code != 200:
         raise HTTPException(
-            ('Google Translate returned HTTP {}'.format(req.status_code)),
-            req.status_code)
+            ('Google Translate returned HTTP {}'.format(status_code)),
+            status_code)
 
     if client == 'x':
-        data = json.loads(req.text)
+        data = json.loads(body)
 
         # It appears in some cases the Google Translate returns a string
         # rather than a dictionary
@@ -409,20 +700,130 @@ def __translate__(text, source, target, client='x',
         return '\n'.join(map(lambda x: x.strip(), result.split('\n')))
 
     elif client == 't':
-        return parse_javascript(req.text)
+        return parse_javascript(body)
 
     else:
         raise Exception("Unsupported client '{}'".format(client))
 
 
-def translate(text, mode, source, target, client='x'):
+def __translate_sentences__(text, source, target, client='x',
+                            user_agent=DEFAULT_USER_AGENT):
+    """Translates a text sentence by sentence. Sentences found in the cache
+    are served locally, and the rest are packed into as few upstream
+    requests as possible. Only the 'x' client is supported as the results
+    are plain texts."""
+
+    if source == target:
+        return text
+
+    segments = split_sentences(text, source)
+    sentences = [sentence for sentence, separator in segments]
+    separators = [separator for sentence, separator in segments]
+    keys = [make_cache_key(sentence, source, target, 'sentence', client)
+            for sentence in sentences]
+
+    translations = list(sentences)
+    missing = []
+    for i, sentence in enumerate(sentences):
+        if not sentence.strip():
+            continue
+        cached = translation_cache.get(keys[i])
+        if cached is None:
+            missing.append(i)
+        else:
+            translations[i] = cached
+
+    batches = pack_sentences([sentences[i] for i in missing],
+                             MAX_BATCH_LENGTH)
+    for batch in batches:
+        indices = [missing[i] for i in batch]
+        result = __translate__('\n'.join(sentences[i] for i in indices),
+                               source, target, client, user_agent)
+        lines = result.split('\n')
+
+        # Google Translate keeps line breaks in most cases, but in case it
+        # does not, we cannot tell which line belongs to which sentence
+        if len(lines) != len(indices):
+            lines = [__translate__(sentences[i], source, target, client,
+                                   user_agent) for i in indices]
+
+        for i, line in zip(indices, lines):
+            translations[i] = line
+            translation_cache.set(keys[i], line)
+
+    return join_sentences(translations, separators, target)
+
+
+def __translate_pipelined__(text, source, intermediate, target, client='x',
+                            user_agent=DEFAULT_USER_AGENT):
+    """Translates a text into the target language via the intermediate
+    language. The text is split into chunks, and the second hop of a chunk
+    starts as soon as its first hop completes, so that both hops run
+    concurrently.
+
+    :return: a tuple of the intermediate text and the translated text
+    """
+    executor = get_executor()
+    chunks = split_chunks(text, source, PIPELINE_CHUNK_LENGTH)
+    separators = [separator for chunk, separator in chunks]
+
+    translate_sentences = bind_flow(__translate_sentences__)
+    first_hops = {executor.submit(translate_sentences, chunk, source,
+                                  intermediate, client, user_agent): i
+                  for i, (chunk, separator) in enumerate(chunks)}
+    second_hops = {}
+    intermediates = [None] * len(chunks)
+    try:
+        for future in as_completed(first_hops):
+            i = first_hops[future]
+            intermediates[i] = future.result()
+            second_hops[i] = executor.submit(
+                translate_sentences, intermediates[i], intermediate,
+                target, client, user_agent)
+        translations = [second_hops[i].result() for i in range(len(chunks))]
+    except Exception:
+        for future in list(first_hops) + list(second_hops.values()):
+            future.cancel()
+        raise
+
+    return (join_sentences(intermediates, separators, intermediate),
+            join_sentences(translations, separators, target))
+
+
+def __validate__(text, source, target, max_length=MAX_TEXT_LENGTH):
+    """Raises an HTTPException if a translation request is invalid. The
+    languages are not validated when they are identical, as there is nothing
+    to translate."""
 
     if len(text) == 0:
         raise HTTPException('Text cannot be empty.', 400)
 
-    if len(text) > MAX_TEXT_LENGTH:
+    if len(text) > max_length:
         raise HTTPException('Text too long.', 413)
 
+    if source == target:
+        return
+
+    if source not in VALID_LANGUAGES.keys():
+        raise HTTPException('Invalid source language.', 400)
+    if target not in VALID_LANGUAGES.keys():
+        raise HTTPException('Invalid target language.', 400)
+
+
+def translate(text, mode, source, target, client='x', user_agent=None):
+    """
+    :param user_agent: User-Agent to send upstream; defaults to the one of
+                       the current request
+    """
+
+    __validate__(text, source, target,
+                 MAX_LONG_TEXT_LENGTH if client == 'x' else MAX_TEXT_LENGTH)
+
+    # A text identified locally needs neither detection upstream nor a
+    # translation into its own language, and shares its cache entries with
+    # requests of the same source language
+    source = source_resolver.resolve(text, source)
+
     if source == target:
         return dict(
             id=None,
@@ -430,12 +831,71 @@ def translate(text, mode, source, target, client='x'):
             intermediate_text=None,
             translated_text=text)
 
-    if source not in VALID_LANGUAGES.keys():
-        raise HTTPException('Invalid source language.', 400)
-    if target not in VALID_LANGUAGES.keys():
-        raise HTTPException('Invalid target language.', 400)
+    cache_key = make_cache_key(text, source, target, mode, client)
+    cached = translation_cache.get(cache_key)
+    if cached is not None:
+        return cached
 
-    user_agent = request.headers.get('User-Agent', 'Unknown')
+    if user_agent is None:
+        user_agent = request.headers.get('User-Agent', 'Unknown')
+
+    def fetch():
+        if len(text) > MAX_TEXT_LENGTH:
+            result = __translate_chunked__(text, mode, source, target, client,
+                                           user_agent)
+        else:
+            result = __translate_mode__(text, mode, source, target, client,
+                                        user_agent)
+        translation_cache.set(cache_key, result)
+        return result
+
+    # Concurrent requests for the same translation share a single upstream
+    # round trip
+    return translation_flight.do(cache_key, fetch)
+
+
+def __translate_chunked__(text, mode, source, target, client, user_agent):
+    """Translates a text longer than MAX_TEXT_LENGTH by splitting it into
+    chunks at sentence or paragraph boundaries, translating the chunks
+    concurrently and putting the results back together. The result has the
+    same shape as the one of `translate()`."""
+
+    if mode not in ('1', '2'):
+        raise HTTPException('Invalid translation mode.', 400)
+
+    chunks = split_chunks(text, source, MAX_CHUNK_LENGTH)
+    separators = [separator for chunk, separator in chunks]
+
+    def translate_chunk(chunk):
+        return __translate_segment__(chunk, mode, source, target, user_agent,
+                                     client)
+
+    # A pool of its own lets chunks in mode '2' use the shared pool for
+    # pipelining without the risk of a deadlock
+    concurrency = min(MAX_CHUNK_CONCURRENCY, len(chunks))
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(bind_flow(translate_chunk),
+                                    [chunk for chunk, separator in chunks]))
+
+    intermediate_text = None
+    if mode == '2':
+        intermediate_text = join_sentences(
+            [r['intermediate_text'] for r in results], separators, 'ja')
+
+    return dict(
+        id=None,
+        request_id=None,
+        intermediate_text=intermediate_text,
+        intermediate_raw=None,
+        translated_text=join_sentences(
+            [r['translated_text'] for r in results], separators, target),
+        translated_raw=None,
+    )
+
+
+def __translate_mode__(text, mode, source, target, client, user_agent):
+    """Translates a text in the given mode, assuming all parameters have
+    been validated."""
 
     translated_raw = None
     translated_text = None
@@ -450,8 +910,8 @@ def translate(text, mode, source, target, client='x'):
                                            user_agent)
             translated_text = ' '.join(map(lambda x: x[0], translated_raw[0]))
         else:
-            translated_text = __translate__(text, source, target, client,
-                                            user_agent)
+            translated_text = __translate_sentences__(
+                text, source, target, client, user_agent)
 
     elif mode == '2':
         if client == 't':
@@ -463,14 +923,18 @@ def translate(text, mode, source, target, client='x'):
                                            client, user_agent)
             translated_text = ' '.join(map(lambda x: x[0], translated_raw[0]))
 
+        elif len(text) > PIPELINE_THRESHOLD:
+            intermediate_text, translated_text = __translate_pipelined__(
+                text, source, 'ja', target, client, user_agent)
+
         else:
-            intermediate_text = __translate__(text, source, 'ja', client,
-                                              user_agent)
-            translated_text = __translate__(intermediate_text, 'ja', target,
-                                            client, user_agent)
+            intermediate_text = __translate_sentences__(
+                text, source, 'ja', client, user_agent)
+            translated_text = __translate_sentences__(
+                intermediate_text, 'ja', target, client, user_agent)
 
     else:
-        return HTTPException('Invalid translation mode.', 400)
+        raise HTTPException('Invalid translation mode.', 400)
 
     return dict(
         id=None,
@@ -482,20 +946,842 @@ def translate(text, mode, source, target, client='x'):
     )
 
 
+def __translate_packed__(texts, source, target, user_agent):
+    """Translates short, single-line texts in as few upstream requests as
+    possible by treating them as lines of a single text.
+
+    :return: a list of results of `translate()`, or of dictionaries of
+             'error' and 'status_code' for texts that failed
+    """
+    try:
+        lines = __translate_sentences__('\n'.join(texts), source, target,
+                                        'x', user_agent).split('\n')
+    except PACK_FAILURES:
+        raise
+    except Exception as e:
+        logger.warning('Packed request failed: {}'.format(e))
+        lines = None
+
+    if lines is None or len(lines) != len(texts):
+        # The request failed (perhaps on account of one of the texts), or
+        # lines have been merged or split; translate the texts one by one
+        return [__outcome__(translate, text, '1', source, target, 'x',
+                            user_agent) for text in texts]
+    return __unpack__(texts, lines, source, target)
+
+
+def __error_result__(error):
+    """Returns the result of an item of a batch that failed with `error`."""
+    if isinstance(error, HTTPException):
+        return {'error': error.message, 'status_code': error.status_code}
+    logger.exception(error)
+    return {'error': str(error), 'status_code': 500}
+
+
+def __outcome__(fn, *args):
+    """Returns `fn(*args)`, or the result of an item that failed (see
+    `__error_result__()`)."""
+    try:
+        return fn(*args)
+    except Exception as e:
+        return __error_result__(e)
+
+
+def __unpack__(texts, lines, source, target, cache=translation_cache):
+    """Returns (and caches, unless `cache` is None) the result of each of
+    packed texts out of the lines of their translation, of which there must
+    be as many as texts."""
+    if len(lines) != len(texts):
+        raise ValueError('{} lines for {} texts'.format(len(lines),
+                                                        len(texts)))
+    results = []
+    for text, line in zip(texts, lines):
+        result = dict(
+            id=None,
+            request_id=None,
+            intermediate_text=None,
+            intermediate_raw=None,
+            translated_text=line,
+            translated_raw=None,
+        )
+        if cache is not None:
+            cache.set(make_cache_key(text, source, target, '1', 'x'), result)
+        results.append(result)
+    return results
+
+
+def __plan_batch__(items):
+    """Validates the items of a batch and works out what to translate.
+
+    :return: a tuple of
+             - the list of results, where items that failed validation
+               already have their errors
+             - indices of items by their cache keys
+             - `(text, mode, source, target)` by cache keys
+             - cache keys to be translated one by one
+             - `(keys, source, target)` of groups of texts to be packed
+    """
+    results = [None] * len(items)
+
+    # Indices of items by their cache keys
+    unique = OrderedDict()
+    pending = {}
+    for i, item in enumerate(items):
+        try:
+            text, source, target = \
+                [item[k].strip() for k in ('text', 'source', 'target')]
+            mode = str(item.get('mode', '1'))
+            __validate__(text, source, target)
+        except KeyError as e:
+            results[i] = {'error': 'Missing field: {}'.format(e),
+                          'status_code': 400}
+            continue
+        except (AttributeError, TypeError):
+            results[i] = {'error': 'Invalid item.', 'status_code': 400}
+            continue
+        except HTTPException as e:
+            results[i] = {'error': e.message, 'status_code': e.status_code}
+            continue
+
+        key = make_cache_key(text, source, target, mode, 'x')
+        unique.setdefault(key, []).append(i)
+        pending[key] = (text, mode, source, target)
+
+    # Packable texts grouped by their language pairs
+    packable = OrderedDict()
+    singles = []
+    for key, (text, mode, source, target) in pending.items():
+        if mode == '1' and source != target and '\n' not in text and \
+                len(text) <= MAX_PACKED_TEXT_LENGTH:
+            cached = translation_cache.get(key)
+            if cached is None:
+                packable.setdefault((source, target), []).append(key)
+                continue
+        singles.append(key)
+
+    packs = []
+    for (source, target), keys in packable.items():
+        texts = [pending[key][0] for key in keys]
+        for batch in pack_sentences(texts, MAX_BATCH_LENGTH):
+            packs.append(([keys[i] for i in batch], source, target))
+
+    return results, unique, pending, singles, packs
+
+
+def translate_batch(items, user_agent, concurrency=MAX_BATCH_CONCURRENCY):
+    """Translates a list of items, each of which is a dictionary of 'text',
+    'source', 'target' and optionally 'mode'. Identical items are translated
+    only once, short texts sharing a language pair are packed together, and
+    upstream requests run concurrently, at most `concurrency` at a time.
+
+    :return: a list of results of `translate()`, or of dictionaries of
+             'error' and 'status_code' for items that failed
+    """
+    results, unique, pending, singles, packs = __plan_batch__(items)
+
+    tasks = [([key], translate, pending[key] + ('x', user_agent))
+             for key in singles]
+    for keys, source, target in packs:
+        tasks.append((keys, __translate_packed__,
+                      ([pending[key][0] for key in keys], source, target,
+                       user_agent)))
+
+    def run(keys, fn, args):
+        outcomes = __outcome__(fn, *args)
+
+        # A single result (or error) applies to all items of the task
+        if isinstance(outcomes, dict):
+            outcomes = [outcomes] * len(keys)
+
+        for key, result in zip(keys, outcomes):
+            for i in unique[key]:
+                results[i] = result
+
+    # A pool of its own bounds the concurrency of each batch, and lets tasks
+    # use the shared pool without the risk of a deadlock
+    with ThreadPoolExecutor(max(1, min(concurrency, len(tasks)))) as executor:
+        for future in [executor.submit(bind_flow(run), *task)
+                       for task in tasks]:
+            future.result()
+
+    return results
+
+
+@api_module.route('/api/v1.3/translate/batch', methods=['post'])
+def translate_batch_v1_3():
+    """
+    Translates a list of texts at once. The request body is a JSON object
+    with a list of items, each of which has 'text', 'source', 'target' and
+    optionally 'mode' ('1' by default).
+
+    **Example Request**:
+
+    .. sourcecode:: http
+
+        POST /api/v1.3/translate/batch HTTP/1.1
+        Content-Type: application/json
+
+        {"items": [{"text": "Hello", "source": "en", "target": "ko"},
+                   {"text": "World", "source": "en", "target": "ko",
+                    "mode": "2"}]}
+
+    **Example Response**
+
+    .. sourcecode:: http
+
+        HTTP/1.0 200 OK
+        Content-Type: application/json
+
+        {"results": [{"translated_text": "...", ...},
+                     {"error": "Text too long.", "status_code": 413}]}
+    """
+    body = request.get_json(force=True, silent=True)
+    items = body.get('items') if isinstance(body, dict) else None
+
+    if not isinstance(items, list):
+        return 'A list of items is required.', 400
+    if len(items) > MAX_BATCH_ITEMS:
+        return 'Too many items.', 413
+
+    user_agent = request.headers.get('User-Agent', 'Unknown')
+    return jsonify({'results': translate_batch(items, user_agent)})
+
+
+def __detect__(text, user_agent=DEFAULT_USER_AGENT):
+    """Returns the language of a text as detected by Google Translate."""
+    cache_key = make_cache_key(text, 'auto', '', 'detect', 'at')
+    cached = translation_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    params = __params__(text, 'auto', 'en', user_agent=user_agent,
+                        fields=('ld',), remote_addr='')
+
+    def fetch():
+        resp_text, resp_status_code = __lambda_translate__(params)
+        if resp_status_code != 200:
+            raise HTTPException(
+                'Google Translate returned HTTP {}'.format(resp_status_code),
+                resp_status_code)
+        if isinstance(resp_text, bytes):
+            resp_text = resp_text.decode('utf-8')
+        source = json.loads(resp_text)['src']
+        translation_cache.set(cache_key, source)
+        return source
+
+    return translation_flight.do(cache_key, fetch)
+
+
+def translate_multi(text, mode, source, targets, user_agent=None,
+                    concurrency=MAX_FANOUT_CONCURRENCY):
+    """Translates a text into several target languages. Work that the
+    targets have in common is done once: the source language is identified
+    (or detected) once when it is 'auto', and in mode '2', the text is
+    translated into the intermediate language once before the hops into the
+    target languages run concurrently.
+
+    :return: a dictionary of results of `translate()`, or of dictionaries
+             of 'error' and 'status_code' for targets that failed, by target
+             languages
+    """
+    if mode not in ('1', '2'):
+        raise HTTPException('Invalid translation mode.', 400)
+    __validate__(text, source, source, MAX_LONG_TEXT_LENGTH)
+    if source not in SOURCE_LANGUAGES and source != 'auto':
+        raise HTTPException('Invalid source language.', 400)
+
+    if user_agent is None:
+        user_agent = request.headers.get('User-Agent', 'Unknown')
+
+    requested_source = source
+    source = source_resolver.resolve(text, source)
+
+    results = OrderedDict()
+    pending = []
+    for target in targets:
+        if target in results:
+            continue
+        if target not in TARGET_LANGUAGES:
+            results[target] = {'error': 'Invalid target language.',
+                               'status_code': 400}
+            continue
+        results[target] = translation_cache.get(
+            make_cache_key(text, source, target, mode, 'x'))
+        if results[target] is None:
+            pending.append(target)
+
+    if not pending:
+        return results
+
+    if source == 'auto':
+        source = __detect__(text, user_agent)
+
+    # As in `translate()`, a text is not translated into its own language,
+    # nor does it go through the intermediate language for it
+    if source in pending:
+        pending.remove(source)
+        results[source] = translate(text, '1', source, source, 'x',
+                                    user_agent)
+        if not pending:
+            return results
+
+    intermediate_text = None
+    if mode == '2':
+        intermediate_text = translate(text, '1', source, 'ja', 'x',
+                                      user_agent)['translated_text']
+
+    def translate_target(target):
+        if mode == '1':
+            return translate(text, '1', source, target, 'x', user_agent)
+
+        result = translate(intermediate_text, '1', 'ja', target, 'x',
+                           user_agent)
+        result = dict(result, intermediate_text=intermediate_text)
+        translation_cache.set(make_cache_key(text, source, target, '2', 'x'),
+                              result)
+        return result
+
+    def run(target):
+        try:
+            results[target] = translate_target(target)
+            if requested_source != source:
+                translation_cache.set(make_cache_key(
+                    text, requested_source, target, mode, 'x'),
+                    results[target])
+        except HTTPException as e:
+            results[target] = {'error': e.message,
+                               'status_code': e.status_code}
+        except Exception as e:
+            logger.exception(e)
+            results[target] = {'error': str(e), 'status_code': 500}
+
+    # A pool of its own, as in `translate_batch()`
+    with ThreadPoolExecutor(max(1, min(concurrency, len(pending)))) \
+            as executor:
+        for future in [executor.submit(bind_flow(run), target)
+                       for target in pending]:
+            future.result()
+
+    return results
+
+
+@api_module.route('/api/v1.3/translate/multi', methods=['post'])
+def translate_multi_v1_3():
+    """
+    Translates a text into several target languages at once. The request
+    body is a JSON object of 'text', 'source', a list of 'targets' and
+    optionally 'mode' ('1' by default). The source language may be 'auto'.
+
+    **Example Request**:
+
+    .. sourcecode:: http
+
+        POST /api/v1.3/translate/multi HTTP/1.1
+        Content-Type: application/json
+
+        {"text": "Hello", "source": "en", "targets": ["ko", "ja", "fr"],
+         "mode": "2"}
+
+    **Example Response**
+
+    .. sourcecode:: http
+
+        HTTP/1.0 200 OK
+        Content-Type: application/json
+
+        {"results": {"ko": {"translated_text": "...", ...},
+                     "ja": {"translated_text": "...", ...},
+                     "fr": {"translated_text": "...", ...}}}
+    """
+    body = request.get_json(force=True, silent=True)
+    if not isinstance(body, dict):
+        return 'A JSON object is required.', 400
+    try:
+        text, source, targets = \
+            [body[k] for k in ('text', 'source', 'targets')]
+    except KeyError as e:
+        return 'Missing field: {}'.format(e), 400
+
+    if not isinstance(targets, list) or not targets:
+        return 'A list of targets is required.', 400
+
+    try:
+        text = text.strip()
+    except AttributeError:
+        return 'Invalid text.', 400
+
+    try:
+        results = translate_multi(text, str(body.get('mode', '1')), source,
+                                  targets)
+    except HTTPException as e:
+        return e.message, e.status_code, e.headers
+
+    return jsonify({'results': results})
+
+
+def iter_translations(text, mode, source, target, user_agent,
+                      window=STREAM_WINDOW):
+    """Translates a text segment by segment and yields a tuple of the index,
+    the result of `translate()` and the separator of each segment, in order.
+    At most `window` segments are translated ahead of the one to be yielded
+    next, which bounds the memory use regardless of the length of the text.
+    """
+    executor = ThreadPoolExecutor(window)
+    futures = deque()
+    try:
+        chunks = iter_chunks(text, source, STREAM_CHUNK_LENGTH)
+        for index, (chunk, separator) in enumerate(chunks):
+            futures.append((index, separator, executor.submit(
+                bind_flow(__translate_segment__), chunk, mode, source, target,
+                user_agent)))
+            if len(futures) >= window:
+                index, separator, future = futures.popleft()
+                yield index, future.result(), separator
+        while futures:
+            index, separator, future = futures.popleft()
+            yield index, future.result(), separator
+    finally:
+        # The client may have gone away
+        for index, separator, future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+def __translate_segment__(text, mode, source, target, user_agent,
+                          client='x'):
+    if not text.strip():
+        return dict(intermediate_text=text if mode == '2' else None,
+                    translated_text=text)
+    return translate(text, mode, source, target, client, user_agent)
+
+
+def __format_event__(event, record, fmt):
+    data = json.dumps(record)
+    if fmt == 'sse':
+        return 'event: {}\ndata: {}\n\n'.format(event, data)
+    else:
+        return data + '\n'
+
+
+@api_module.route('/api/v1.3/translate/stream', methods=['post'])
+def translate_stream():
+    """
+    :param text: text to be translated, up to MAX_STREAM_TEXT_LENGTH
+    :param source: source language
+    :param target: target language
+    :param mode: 1 for normal, 2 for better
+    :param format: 'ndjson' (default) or 'sse'
+
+    Translates a long text segment by segment, sending each translated
+    segment as soon as it is ready. Each record has 'index',
+    'translated_text', 'intermediate_text' and 'separator', the white space
+    that follows the segment in the original text. The stream ends with a
+    'done' record, or an 'error' record if a segment could not be
+    translated.
+    """
+    text = request.form['text']
+    source, target = request.form['source'], request.form['target']
+    mode = request.form.get('mode', '1')
+
+    if 'text/event-stream' in request.headers.get('Accept', ''):
+        fmt = request.form.get('format', 'sse')
+    else:
+        fmt = request.form.get('format', 'ndjson')
+
+    if fmt not in ('ndjson', 'sse'):
+        return 'Invalid format.', 400
+    if mode not in ('1', '2'):
+        return 'Invalid translation mode.', 400
+
+    try:
+        __validate__(text, source, target, MAX_STREAM_TEXT_LENGTH)
+    except HTTPException as e:
+        return e.message, e.status_code
+
+    user_agent = request.headers.get('User-Agent', 'Unknown')
+
+    def generate():
+        count = 0
+        try:
+            for index, result, separator in iter_translations(
+                    text, mode, source, target, user_agent):
+                count += 1
+                yield __format_event__('segment', {
+                    'index': index,
+                    'translated_text': result['translated_text'],
+                    'intermediate_text': result['intermediate_text'],
+                    'separator': separator,
+                }, fmt)
+        except HTTPException as e:
+            yield __format_event__('error', {
+                'index': count, 'error': e.message,
+                'status_code': e.status_code}, fmt)
+            return
+        except Exception as e:
+            logger.exception(e)
+            yield __format_event__('error', {
+                'index': count, 'error': str(e), 'status_code': 500}, fmt)
+            return
+
+        yield __format_event__('done', {'done': True, 'count': count}, fmt)
+
+    mimetype = 'text/event-stream' if fmt == 'sse' else 'application/x-ndjson'
+    return Response(stream_with_context(generate()), mimetype=mimetype,
+                    headers={'Cache-Control': 'no-cache',
+                             # Keeps nginx from buffering the stream
+                             'X-Accel-Buffering': 'no'})
+
+
+def extract_sentences(parsed):
+    """Extracts the translated text out of a parsed result of the
+    'translate_a/single' endpoint."""
+    return ''.join(x['trans'] for x in parsed['sentences'] if 'trans' in x)
+
+
+def __cache_key_v1_3__(text, source, target, fields):
+    return make_cache_key(text, source, target, '1', 'at:' + ','.join(fields))
+
+
+def __cache_entry_v1_3__(resp_text, resp_status_code):
+    """Returns the cache entry of a response of the v1.3 API."""
+    return {'text': resp_text.decode('utf-8')
+            if isinstance(resp_text, bytes) else resp_text,
+            'status_code': resp_status_code}
+
+
+def __cache_v1_3__(cache_key, resp_text, resp_status_code):
+    """Caches a response of the v1.3 API unless it is an error page (e.g.,
+    captcha)."""
+    if resp_status_code == 200:
+        translation_cache.set(cache_key, __cache_entry_v1_3__(
+            resp_text, resp_status_code))
+
+
+def __translate_v1_3__(text, source, target, fields=DT_FIELDS,
+                       remote_addr=None):
+    """Translates a text via AWS Lambda and returns a tuple of the raw
+    response body and the HTTP status code.
+
+    :param remote_addr: address of the client; defaults to the one of the
+                        current request
+    """
+
+    cache_key = __cache_key_v1_3__(text, source, target, fields)
+    cached = translation_cache.get(cache_key)
+    if cached is not None:
+        return cached['text'], cached['status_code']
+
+    params = __params__(text, source, target, fields=fields,
+                        remote_addr=remote_addr)
+
+    def fetch():
+        resp_text, resp_status_code = __lambda_translate__(params)
+        __cache_v1_3__(cache_key, resp_text, resp_status_code)
+
+        return resp_text, resp_status_code
+
+    return translation_flight.do(cache_key, fetch)
+
+
+def __pivot_v1_3__(text, source, intermediate, target, fields,
+                   remote_addr=None):
+    """Translates a text into the target language via the intermediate
+    language, and returns a tuple of the result, to which the result of the
+    first hop is attached, and the HTTP status code. The result is the raw
+    response body if the status code is not 200."""
+
+    # The translated text of the first hop is needed for the second one
+    intermediate_fields = fields if 't' in fields else ('t',) + fields
+    resp_text, resp_status_code = __translate_v1_3__(
+        text, source, intermediate, intermediate_fields, remote_addr)
+    if resp_status_code != 200:
+        return resp_text, resp_status_code
+    intermediate_result = json.loads(resp_text)
+
+    resp_text, resp_status_code = __translate_v1_3__(
+        extract_sentences(intermediate_result), intermediate, target, fields,
+        remote_addr)
+    if resp_status_code != 200:
+        return resp_text, resp_status_code
+    result = json.loads(resp_text)
+    result['intermediate'] = intermediate_result
+
+    return result, resp_status_code
+
+
+def __translate_pivot_v1_3__(text, source, intermediate, target, fields):
+    result, status_code = __pivot_v1_3__(text, source, intermediate, target,
+                                         fields)
+    if status_code != 200:
+        return result, status_code
+    return jsonify(result)
+
+
+def __identity_v1_3__(text, source):
+    """Returns the result of `/api/v1.3/translate` for a text translated
+    into its own language."""
+    return {'sentences': [{'trans': text, 'orig': text}], 'src': source}
+
+
+def __translate_lines_v1_3__(lines, source, intermediate, target,
+                             remote_addr):
+    """Translates lines in a single request (via the intermediate language,
+    if any), and returns a list of tuples of the intermediate translation
+    (or None) and the translation of each line, or None if the result does
+    not have as many lines. The translation of a single line is kept as a
+    whole, even if Google Translate breaks it into several."""
+    text = '\n'.join(lines)
+    if intermediate:
+        result, status_code = __pivot_v1_3__(
+            text, source, intermediate, target, ('t',), remote_addr)
+    else:
+        result, status_code = __translate_v1_3__(
+            text, source, target, ('t',), remote_addr)
+        if status_code == 200:
+            result = json.loads(result)
+    if status_code != 200:
+        raise HTTPException(result, status_code)
+
+    translations = [line.strip()
+                    for line in extract_sentences(result).split('\n')]
+    if intermediate:
+        intermediates = [line.strip() for line in extract_sentences(
+            result['intermediate']).split('\n')]
+    else:
+        intermediates = [None] * len(translations)
+
+    if len(lines) == 1:
+        return [('\n'.join(intermediates) if intermediate else None,
+                 '\n'.join(translations))]
+    if len(lines) != len(translations) or \
+            len(lines) != len(intermediates):
+        return None
+    return list(zip(intermediates, translations))
+
+
+def __translate_session_v1_3__(text, source, intermediate, target, token,
+                               remote_addr=None):
+    """Translates a text in a session, in which only the sentences that have
+    not been translated by the previous request of the session are sent
+    upstream. The result has the shape of the one of `/api/v1.3/translate`
+    with 't' as its fields, and the counts of sentences translated and
+    reused under 'session'."""
+    __validate__(text, source, target)
+
+    if remote_addr is None:
+        remote_addr = request.remote_addr
+    languages = (source, intermediate, target)
+    previous = translation_sessions.get(token, languages)
+
+    segments = split_sentences(text, source)
+    sentences = [sentence for sentence, separator in segments]
+    separators = [separator for sentence, separator in segments]
+
+    translations = {}
+    missing = []
+    for sentence in sentences:
+        if not sentence.strip() or sentence in translations:
+            continue
+        if sentence in previous:
+            translations[sentence] = previous[sentence]
+        else:
+            # Placeholder which keeps a repeated sentence from being sent
+            # twice
+            translations[sentence] = None
+            missing.append(sentence)
+
+    for batch in pack_sentences(missing, MAX_BATCH_LENGTH):
+        lines = [missing[i] for i in batch]
+        results = __translate_lines_v1_3__(lines, source, intermediate,
+                                           target, remote_addr)
+
+        # See `__translate_sentences__()`
+        if results is None:
+            results = [__translate_lines_v1_3__([line], source, intermediate,
+                                                target, remote_addr)[0]
+                       for line in lines]
+        translations.update(zip(lines, results))
+
+    translation_sessions.set(token, languages, translations)
+
+    def make_result(index, language):
+        texts = [translations[sentence][index] if sentence.strip()
+                 else sentence for sentence in sentences]
+        return {'sentences': [{'trans': join_sentences(texts, separators,
+                                                       language),
+                               'orig': text}]}
+
+    result = make_result(1, target)
+    result['session'] = {'token': token,
+                         'translated': len(missing),
+                         'reused': len(translations) - len(missing)}
+    if intermediate:
+        result['intermediate'] = make_result(0, intermediate)
+    return result
+
+
 @api_module.route('/api/v1.3/translate', methods=['get', 'post'])
 def translate_v1_3():
-    # TODO: Use AWS Lambda to make translation requests
+    """
+    :param text: text to be translated
+    :param source: source language
+    :param target: target language
+    :param intermediate: (optional) intermediate language
+    :param fields: (optional) comma-separated response fields to ask for
+                   (see `DT_FIELDS`); e.g., 't' for the translated text only
+    :param session: (optional) session token of a client which retranslates
+                    the text as it is edited; implies 't' as the fields,
+                    and may not be given with any other field
+
+    When an intermediate language is given, the text is translated into the
+    intermediate language and then into the target language in a single
+    request. The result of the first hop is attached to the final result
+    under the 'intermediate' key.
+
+    In a session, only the sentences which have changed since the previous
+    request of the session are translated (see
+    `__translate_session_v1_3__()`).
+    """
+    request_params = request.form if request.method == 'POST' else request.args
+    text, source, target = \
+        [request_params[k] for k in ('text', 'source', 'target')]
+    intermediate = request_params.get('intermediate', '')
+
+    if intermediate not in INTERMEDIATE_LANGUAGES:
+        return 'Invalid intermediate language.', 400
+
+    fields = __fields__(request_params)
+    if fields is None:
+        return 'Invalid fields.', 400
+
+    token = request_params.get('session', '')
+    if len(token) > MAX_TOKEN_LENGTH:
+        return 'Invalid session.', 400
+    if token and request_params.get('fields') and fields != ('t',):
+        return "Sessions only support the 't' field.", 400
+
+    source = source_resolver.resolve(text, source)
+    if source == target:
+        return jsonify(__identity_v1_3__(text, source))
+
+    try:
+        if token:
+            if intermediate in (source, target):
+                intermediate = ''
+            return jsonify(__translate_session_v1_3__(
+                text, source, intermediate, target, token))
+        if not intermediate or intermediate in (source, target):
+            return __translate_v1_3__(text, source, target, fields)
+        return __translate_pivot_v1_3__(text, source, intermediate, target,
+                                        fields)
+    except HTTPException as e:
+        return e.message, e.status_code, e.headers
+
+
+def __translate_path_v1_3__(text, source, intermediate, target, fields,
+                            remote_addr):
+    """Translates a text directly (if `intermediate` is empty) or via the
+    intermediate language, and returns a record of the outcome."""
+    record = {'intermediate': intermediate}
+    try:
+        if intermediate:
+            result, status_code = __pivot_v1_3__(
+                text, source, intermediate, target, fields, remote_addr)
+        else:
+            result, status_code = __translate_v1_3__(
+                text, source, target, fields, remote_addr)
+            if status_code == 200:
+                result = json.loads(result)
+    except HTTPException as e:
+        result, status_code = e.message, e.status_code
+    except Exception as e:
+        logger.exception(e)
+        result, status_code = str(e), 500
+
+    record['status_code'] = status_code
+    if status_code == 200:
+        record['result'] = result
+    else:
+        record['error'] = result.decode('utf-8') \
+            if isinstance(result, bytes) else result
+    return record
+
+
+@api_module.route('/api/v1.3/translate/pivots', methods=['get', 'post'])
+def translate_pivots_v1_3():
+    """
+    :param text: text to be translated
+    :param source: source language
+    :param target: target language
+    :param fields: (optional) comma-separated response fields to ask for
+                   (see `DT_FIELDS`)
+    :param format: 'ndjson' (default), 'sse' or 'json'
+
+    Translates a text directly and via each of the intermediate languages
+    at the same time, so that the whole takes as long as the slowest path.
+    Each record has 'intermediate' ('' for the direct translation),
+    'status_code', and 'result' (as of `/api/v1.3/translate`) or 'error'.
+    Records are streamed as the paths complete and followed by a 'done'
+    record, unless the format is 'json', in which case they are sent
+    together, in the order of the paths, under 'results'.
+    """
     request_params = request.form if request.method == 'POST' else request.args
     text, source, target = \
         [request_params[k] for k in ('text', 'source', 'target')]
-    params = __params__(text, source, target)
-    resp = lambda_get(params['url'], params=params['payload'],
-                      headers=params['headers'])
-    resp_content = json.loads(resp['Payload'].read().decode('utf-8'))
-    resp_text = resp_content['text']
-    resp_status_code = resp_content['status_code']
-
-    return resp_text, resp_status_code
+    fmt = request_params.get('format', 'ndjson')
+
+    if fmt not in ('ndjson', 'sse', 'json'):
+        return 'Invalid format.', 400
+
+    fields = __fields__(request_params)
+    if fields is None:
+        return 'Invalid fields.', 400
+
+    try:
+        __validate__(text, source, target)
+    except HTTPException as e:
+        return e.message, e.status_code
+
+    intermediates = [''] + [language for language in INTERMEDIATE_LANGUAGES
+                            if language and language not in (source, target)]
+    remote_addr = request.remote_addr
+
+    # A pool of its own lets the paths run in full regardless of the load of
+    # the shared pool
+    executor = ThreadPoolExecutor(len(intermediates))
+    translate_path = bind_flow(__translate_path_v1_3__)
+    futures = [executor.submit(translate_path, text, source, intermediate,
+                               target, fields, remote_addr)
+               for intermediate in intermediates]
+    executor.shutdown(wait=False)
+
+    if fmt == 'json':
+        return jsonify({'results': [f.result() for f in futures]})
+
+    def generate():
+        for future in as_completed(futures):
+            yield __format_event__('path', future.result(), fmt)
+        yield __format_event__('done', {'done': True,
+                                        'count': len(futures)}, fmt)
+
+    mimetype = 'text/event-stream' if fmt == 'sse' else 'application/x-ndjson'
+    return Response(stream_with_context(generate()), mimetype=mimetype,
+                    headers={'Cache-Control': 'no-cache',
+                             'X-Accel-Buffering': 'no'})
+
+
+@api_module.route('/api/v1.3/metrics')
+def metrics():
+    """Returns internal counters of this worker."""
+    return jsonify({'admission': upstream_admission.stats(),
+                    'batch': lambda_batcher.stats(),
+                    'cache': translation_cache.stats(),
+                    'governor': upstream_governor.stats(),
+                    'hedge': lambda_hedger.stats(),
+                    'langid': source_resolver.stats(),
+                    'proxies': proxy_registry.stats(),
+                    'sessions': translation_sessions.stats(),
+                    'singleflight': translation_flight.stats()})
 
 
 @api_module.route('/api/v1.3/exception')
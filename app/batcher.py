@@ -0,0 +1,95 @@
+"""Packing of concurrent upstream requests into batch invocations of the
+Lambda proxy functions.
+
+Every invocation has its own overhead (and cost), while a proxy function
+(lambda/lambda_function.py >= 0.2.0) can send a batch of requests
+concurrently. A request waits at most `max_delay` seconds for others to
+join its batch, and a batch is sent as soon as it has `max_size` requests.
+The first request of a batch sends it on behalf of the others."""
+
+import threading
+
+
+class _Batch(object):
+
+    def __init__(self):
+        self.requests = []
+        self.results = None
+        self.error = None
+        self.closed = False
+        self.done = threading.Event()
+
+
+class InvocationBatcher(object):
+    """
+    :param send: a function that takes a list of requests and returns a
+                 list of their results
+    :param max_size: upper bound of the number of requests of a batch
+    :param max_delay: seconds for which a batch waits for more requests
+    """
+
+    def __init__(self, send, enabled=True, max_size=8, max_delay=0.005):
+        self.send = send
+        self.enabled = enabled
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.requests = 0
+        self.batches = 0
+        self._batch = None
+        self._cond = threading.Condition()
+
+    def submit(self, request):
+        """Sends a request as part of a batch and returns its result."""
+        with self._cond:
+            self.requests += 1
+            batch = self._batch
+            leader = batch is None
+            if leader:
+                batch = self._batch = _Batch()
+            index = len(batch.requests)
+            batch.requests.append(request)
+            if len(batch.requests) >= self.max_size:
+                self._close(batch)
+
+            if leader and not batch.closed:
+                self._cond.wait(self.max_delay)
+                self._close(batch)
+
+        if not leader:
+            batch.done.wait()
+        else:
+            try:
+                batch.results = self.send(batch.requests)
+            except Exception as e:
+                batch.error = e
+            finally:
+                batch.done.set()
+
+        if batch.error is not None:
+            raise batch.error
+        return batch.results[index]
+
+    def _close(self, batch):
+        if not batch.closed:
+            batch.closed = True
+            self.batches += 1
+            if self._batch is batch:
+                self._batch = None
+            self._cond.notify_all()
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'requests': self.requests,
+            'batches': self.batches,
+        }
+
+
+def build_batcher(send, batch_config):
+    """Builds a batcher as specified in the `batch` section of the
+    config."""
+    return InvocationBatcher(
+        send,
+        enabled=bool(batch_config.get('enabled', False)),
+        max_size=int(batch_config.get('max_size', 8)),
+        max_delay=float(batch_config.get('max_delay', 0.005)))
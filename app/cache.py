@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""Translation result cache.
+
+Results are kept in an in-process LRU tier bounded by both age and size, and
+optionally in a second on-disk tier shared by all workers on the host."""
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from app import config
+
+
+def _to_unicode(text):
+    if isinstance(text, bytes):
+        return text.decode('utf-8')
+    return text
+
+
+def canonicalize(text):
+    """Normalizes a text so that trivially different inputs (composed vs.
+    decomposed characters, redundant spaces) share the same cache entry. Line
+    breaks are preserved as Google Translate preserves them as well."""
+    text = unicodedata.normalize('NFC', _to_unicode(text))
+    lines = [re.sub(r'\s+', ' ', line).strip() for line in text.split('\n')]
+    return '\n'.join(lines).strip()
+
+
+def make_cache_key(text, source, target, mode, client):
+    """Builds a cache key out of a translation request."""
+    fields = [canonicalize(text), source, target, str(mode), client]
+    return hashlib.sha1(
+        u'\x00'.join(fields).encode('utf-8')).hexdigest()
+
+
+class LRUCache(object):
+    """An in-process, thread-safe LRU cache. Entries expire after `ttl`
+    seconds and the least recently used entries are evicted whenever the
+    total size of the serialized values exceeds `max_bytes`."""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=86400,
+                 clock=time.time):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            try:
+                serialized, expires_at = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+
+            if expires_at <= self.clock():
+                self.size -= len(serialized)
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            # Re-insert to mark the entry as the most recently used one
+            self._entries[key] = (serialized, expires_at)
+            self.hits += 1
+
+        return json.loads(serialized.decode('utf-8'))
+
+    def set(self, key, value, ttl=None):
+        serialized = json.dumps(value).encode('utf-8')
+        if len(serialized) > self.max_bytes:
+            return
+
+        expires_at = self.clock() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if key in self._entries:
+                self.size -= len(self._entries.pop(key)[0])
+            self._entries[key] = (serialized, expires_at)
+            self.size += len(serialized)
+
+            while self.size > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'bytes': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+
+class DiskCache(object):
+    """A file-per-entry cache living in `path`. Writes are atomic renames so
+    that multiple worker processes may share the same directory."""
+
+    def __init__(self, path, ttl=604800, clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.errors = 0
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def _filename(self, key):
+        return os.path.join(self.path, key)
+
+    def get(self, key):
+        filename = self._filename(key)
+        try:
+            with open(filename, 'rb') as fin:
+                entry = json.loads(fin.read().decode('utf-8'))
+        except (IOError, OSError):
+            self.misses += 1
+            return None
+        except ValueError:
+            # Corrupted entry
+            self.errors += 1
+            self.misses += 1
+            return None
+
+        if entry['expires_at'] <= self.clock():
+            self.expirations += 1
+            self.misses += 1
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            return None
+
+        self.hits += 1
+        return entry['value']
+
+    def set(self, key, value, ttl=None):
+        entry = {
+            'expires_at': self.clock() + (self.ttl if ttl is None else ttl),
+            'value': value,
+        }
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self.path)
+            with os.fdopen(fd, 'wb') as fout:
+                fout.write(json.dumps(entry).encode('utf-8'))
+            os.rename(tmp, self._filename(key))
+        except (IOError, OSError):
+            self.errors += 1
+
+    def clear(self):
+        for filename in os.listdir(self.path):
+            os.remove(os.path.join(self.path, filename))
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'expirations': self.expirations,
+            'errors': self.errors,
+        }
+
+
+class TieredCache(object):
+    """Looks up the in-process tier first, then the (optional) disk tier.
+    Entries found on disk are promoted to the memory tier."""
+
+    def __init__(self, memory, disk=None):
+        self.memory = memory
+        self.disk = disk
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.set(key, value)
+        return value
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self):
+        stats = {'memory': self.memory.stats()}
+        if self.disk is not None:
+            stats['disk'] = self.disk.stats()
+        return stats
+
+
+def build_cache(cache_config):
+    """Builds a cache as specified in the `cache` section of the config."""
+    memory = LRUCache(max_bytes=int(cache_config.get('max_bytes',
+                                                     64 * 1024 * 1024)),
+                      ttl=int(cache_config.get('ttl', 86400)))
+
+    disk_path = os.environ.get('CACHE_DISK_PATH',
+                               cache_config.get('disk_path'))
+    disk_ttl = int(cache_config.get('disk_ttl', 604800))
+    disk = DiskCache(disk_path, ttl=disk_ttl) if disk_path else None
+
+    return TieredCache(memory, disk)
+
+
+translation_cache = build_cache(config.get('cache') or {})
@@ -0,0 +1,262 @@
+"""Pacing of requests to Google Translate and circuit breaking on blocks.
+
+Google Translate answers clients that send too many requests with 429 or
+503, or with a captcha page. Each egress, i.e., the direct connection of
+this worker and every Lambda proxy function, has a token bucket that paces
+its requests at `rate` per second with bursts of up to `burst`, and a
+circuit breaker. A blocked response opens the breaker of its egress for
+`base_delay` seconds, which doubles every time the egress is blocked again
+(up to `max_delay`). Once the delay is over, a single probe request is let
+through; the breaker closes if it succeeds and opens again if it does not.
+
+While a breaker is open, requests go through other egresses, and fail
+right away with 503 and Retry-After when there is none left. Translations
+that have been cached are served as usual."""
+
+import math
+import threading
+import time
+
+from app import config, logger
+from app.utils import HTTPException
+
+
+#: Status codes with which Google Translate blocks clients
+BLOCKED_STATUS_CODES = (429, 503)
+
+#: Fragments of the captcha page (see `/captcha`)
+CAPTCHA_MARKERS = ('/sorry/', 'CaptchaRedirect', 'unusual traffic')
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+
+def is_blocked(status_code, body):
+    """Tells whether a response of Google Translate indicates that the
+    egress it came through has been blocked."""
+    if status_code in BLOCKED_STATUS_CODES:
+        return True
+    if isinstance(body, bytes):
+        body = body[:4096].decode('utf-8', 'replace')
+    body = (body or '')[:4096]
+    if not body.lstrip().startswith('<'):
+        # Translations are JSON (or JavaScript) rather than HTML
+        return False
+    return any(marker in body for marker in CAPTCHA_MARKERS)
+
+
+class EgressUnavailable(HTTPException):
+
+    def __init__(self, retry_after):
+        retry_after = max(1, int(math.ceil(retry_after)))
+        super(EgressUnavailable, self).__init__(
+            'Google Translate is temporarily unavailable. Please try again '
+            'in {} seconds.'.format(retry_after), 503,
+            {'Retry-After': str(retry_after)})
+        self.retry_after = retry_after
+
+
+class TokenBucket(object):
+    """Lets requests through at `rate` per second on average, with bursts of
+    up to `burst` requests."""
+
+    def __init__(self, rate, burst, clock=time.time):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.clock = clock
+        self.tokens = self.burst
+        self._updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self):
+        """Seconds until a token is available."""
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def reserve(self):
+        """Takes a token and returns the number of seconds the request has
+        to wait for it. Tokens may be reserved ahead of time."""
+        wait = self.delay()
+        self.tokens -= 1
+        return wait
+
+
+class CircuitBreaker(object):
+
+    def __init__(self, base_delay=30, max_delay=900, clock=time.time):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.clock = clock
+        self.state = CLOSED
+        self.trips = 0
+        self.opened = 0
+        self.open_until = 0
+        self._probing = False
+
+    def retry_after(self):
+        return max(0.0, self.open_until - self.clock())
+
+    def allows(self):
+        """Tells whether a request may go through, without taking the probe
+        of a half-open breaker."""
+        if self.state == OPEN and self.retry_after() <= 0:
+            self.state = HALF_OPEN
+        return self.state == CLOSED or \
+            (self.state == HALF_OPEN and not self._probing)
+
+    def acquire(self):
+        if not self.allows():
+            return False
+        if self.state == HALF_OPEN:
+            self._probing = True
+        return True
+
+    def trip(self):
+        self.trips += 1
+        self.opened += 1
+        delay = min(self.max_delay, self.base_delay * 2 ** (self.trips - 1))
+        self.state = OPEN
+        self.open_until = self.clock() + delay
+        self._probing = False
+        return delay
+
+    def reset(self):
+        self.state = CLOSED
+        self.trips = 0
+        self._probing = False
+
+    def cancel(self):
+        """Gives the probe back when a request did not get a response."""
+        self._probing = False
+
+    def stats(self):
+        self.allows()
+        return {
+            'state': self.state,
+            'trips': self.trips,
+            'opened': self.opened,
+            'retry_after': self.retry_after() if self.state == OPEN else 0,
+        }
+
+
+class RateGovernor(object):
+    """
+    :param rate: requests per second of an egress
+    :param burst: requests an idle egress may send at once
+    :param base_delay: seconds for which a breaker opens the first time
+    :param max_delay: upper bound of the time for which a breaker opens
+    :param max_pace: seconds for which a request may wait for its turn;
+                     requests that would wait longer are rejected
+    """
+
+    def __init__(self, rate=5, burst=10, base_delay=30, max_delay=900,
+                 max_pace=2.0, clock=time.time, sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_pace = max_pace
+        self.clock = clock
+        self.sleep = sleep
+        self.blocked = 0
+        self.rejected = 0
+        self._buckets = {}
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def _egress(self, name):
+        if name not in self._breakers:
+            self._buckets[name] = TokenBucket(self.rate, self.burst,
+                                              self.clock)
+            self._breakers[name] = CircuitBreaker(
+                self.base_delay, self.max_delay, self.clock)
+        return self._buckets[name], self._breakers[name]
+
+    def allows(self, name):
+        """Tells whether the breaker of an egress lets requests through."""
+        with self._lock:
+            return self._egress(name)[1].allows()
+
+    def retry_after(self, names):
+        """Seconds until the first of the given egresses reopens."""
+        with self._lock:
+            return min(self._egress(name)[1].retry_after() for name in names)
+
+    def reserve(self, name):
+        """Reserves the turn of a request to go through an egress and returns
+        the number of seconds to wait for it.
+
+        :raises EgressUnavailable: when the breaker of the egress is open or
+                                   the request would wait too long
+        """
+        with self._lock:
+            bucket, breaker = self._egress(name)
+            if not breaker.allows():
+                self.rejected += 1
+                raise EgressUnavailable(breaker.retry_after())
+            wait = bucket.delay()
+            if wait > self.max_pace:
+                self.rejected += 1
+                raise EgressUnavailable(wait)
+            bucket.reserve()
+            breaker.acquire()
+            return wait
+
+    def acquire(self, name):
+        """Waits for the turn of a request to go through an egress (see
+        `reserve()`)."""
+        wait = self.reserve(name)
+        if wait > 0:
+            self.sleep(wait)
+
+    def record(self, name, status_code, body):
+        """Records the response to a request that went through an egress, and
+        returns whether it has been blocked."""
+        blocked = is_blocked(status_code, body)
+        with self._lock:
+            breaker = self._egress(name)[1]
+            if blocked:
+                self.blocked += 1
+                delay = breaker.trip()
+            elif status_code < 500:
+                breaker.reset()
+            else:
+                breaker.cancel()
+        if blocked:
+            logger.warning('Egress {} has been blocked (HTTP {}); opened its '
+                           'circuit breaker for {} seconds'.format(
+                               name, status_code, delay))
+        return blocked
+
+    def cancel(self, name):
+        """Records a request that went through an egress but did not get a
+        response."""
+        with self._lock:
+            self._egress(name)[1].cancel()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'blocked': self.blocked,
+                'rejected': self.rejected,
+                'egresses': dict((name, breaker.stats()) for name, breaker
+                                 in self._breakers.items()),
+            }
+
+
+def build_governor(governor_config):
+    """Builds a governor as specified in the `governor` section of the
+    config."""
+    return RateGovernor(
+        rate=float(governor_config.get('rate', 5)),
+        burst=int(governor_config.get('burst', 10)),
+        base_delay=float(governor_config.get('base_delay', 30)),
+        max_delay=float(governor_config.get('max_delay', 900)),
+        max_pace=float(governor_config.get('max_pace', 2.0)))
+
+
+upstream_governor = build_governor(config.get('governor') or {})
@@ -0,0 +1,170 @@
+"""Hedged invocations of the Lambda proxy functions.
+
+A cold or slow invocation sets the tail latency of the translations that
+wait for it. When an invocation has not completed within a percentile of the
+recent latencies, a duplicate is sent to another function, and whichever
+completes first is taken. The other one is cancelled if it has not started,
+and ignored otherwise.
+
+Every request earns a fraction (`budget`) of a hedge, up to `burst` hedges,
+so that hedging adds at most that share of load even when the upstream is
+slow across the board."""
+
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from app import config
+from app.governor import EgressUnavailable
+
+
+class Hedger(object):
+    """
+    :param percentile: percentile of the recent latencies after which a
+                       request is hedged
+    :param min_delay: lower bound of the delay (in seconds) of a hedge
+    :param window: number of recent latencies to keep
+    :param min_samples: number of latencies to observe before hedging
+    :param budget: hedges per request
+    :param burst: upper bound of the number of hedges saved up
+    """
+
+    def __init__(self, enabled=True, percentile=0.95, min_delay=0.05,
+                 window=200, min_samples=20, budget=0.05, burst=10,
+                 workers=32, clock=time.time):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.budget = budget
+        self.burst = burst
+        self.workers = workers
+        self.clock = clock
+
+        self.requests = 0
+        self.fired = 0
+        self.won = 0
+        self.skipped = 0
+        self.tokens = float(burst)
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+
+    def observe(self, latency):
+        with self._lock:
+            self._latencies.append(latency)
+
+    def delay(self):
+        """Seconds after which a request is hedged, or `None` until enough
+        latencies have been observed."""
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            latencies = sorted(self._latencies)
+        index = int(self.percentile * (len(latencies) - 1))
+        return max(self.min_delay, latencies[index])
+
+    def _earn(self):
+        with self._lock:
+            self.requests += 1
+            self.tokens = min(self.burst, self.tokens + self.budget)
+
+    def _spend(self):
+        with self._lock:
+            if self.tokens < 1:
+                self.skipped += 1
+                return False
+            self.tokens -= 1
+            self.fired += 1
+            return True
+
+    def get_executor(self):
+        """Returns the thread pool of the current worker process that runs
+        hedged invocations. It is separate from `app.transport.get_executor()`
+        because the tasks of that pool wait for these."""
+        pid = os.getpid()
+        if self._executor is None or self._executor_pid != pid:
+            with self._lock:
+                if self._executor is None or self._executor_pid != pid:
+                    self._executor = ThreadPoolExecutor(self.workers)
+                    self._executor_pid = pid
+        return self._executor
+
+    def invoke(self, registry, client, exclude=(), **kwargs):
+        """Invokes a proxy function of `registry` as `registry.invoke()`
+        does, hedging the invocation on another function when it is slow."""
+        self._earn()
+        executor = self.get_executor()
+        exclude = list(exclude)
+        futures = {}
+
+        def submit(name):
+            start = self.clock()
+
+            def attempt():
+                resp = registry.invoke(client, name=name, **kwargs)
+                self.observe(self.clock() - start)
+                return resp
+
+            futures[executor.submit(attempt)] = name
+
+        primary = registry.choose(exclude).name
+        submit(primary)
+        done, _ = wait(futures, timeout=self.delay())
+        if not done and self._spend():
+            try:
+                submit(registry.choose(exclude + [primary]).name)
+            except (ValueError, EgressUnavailable):
+                # There is no other function to hedge on
+                pass
+
+        def discard(future):
+            # A failed invocation has already been cancelled by the registry
+            if not future.cancelled() and future.exception() is None:
+                registry.discard(futures[future])
+
+        pending = set(futures)
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                if futures[future] != primary:
+                    with self._lock:
+                        self.won += 1
+                for loser in pending:
+                    if not loser.cancel():
+                        loser.add_done_callback(discard)
+                return future.result()
+        raise error
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'delay': self.delay(),
+            'requests': self.requests,
+            'fired': self.fired,
+            'won': self.won,
+            'skipped': self.skipped,
+        }
+
+
+def build_hedger(hedge_config):
+    """Builds a hedger as specified in the `hedge` section of the config."""
+    return Hedger(
+        enabled=bool(hedge_config.get('enabled', False)),
+        percentile=float(hedge_config.get('percentile', 0.95)),
+        min_delay=float(hedge_config.get('min_delay', 0.05)),
+        window=int(hedge_config.get('window', 200)),
+        min_samples=int(hedge_config.get('min_samples', 20)),
+        budget=float(hedge_config.get('budget', 0.05)),
+        burst=int(hedge_config.get('burst', 10)),
+        workers=int(hedge_config.get('workers', 32)))
+
+
+lambda_hedger = build_hedger(config.get('hedge') or {})
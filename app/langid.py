@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""Identification of the language of a text, so that requests of which the
+source language is 'auto' need not wait for Google Translate to detect it.
+
+A text in a script that only one of the supported languages is written in
+(e.g., Hangul) is identified by its script. Texts in Han characters without
+kana may be Chinese as well as Japanese, and are left to Google Translate.
+Other texts are identified by a naive Bayes classifier over character
+n-grams, of which the model is built by bin/build_langid.py. The model also
+has languages that are not supported but are written in the same scripts
+(e.g., Ukrainian), so that a text in one of them is not taken for its
+closest supported language.
+
+The costs (negative log probabilities) of an n-gram in all languages of the
+model are packed into a single integer, a field of `FIELD_BITS` bits per
+language, so that the costs of a text in all languages are added up in one
+go."""
+
+import json
+import math
+import os
+import re
+import zlib
+
+from app import config
+
+
+#: Where the model is read from
+MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'langid.model')
+
+#: Number of leading characters of a text that are looked at
+MAX_SAMPLE_LENGTH = 120
+
+#: Width of the field of a language in a packed cost; large enough for the
+#: sum of the costs of all n-grams of a sample
+FIELD_BITS = 24
+
+#: Number of n-grams beyond which the confidence does not grow
+EVIDENCE_NGRAMS = 24
+
+#: Factor of the cost of an n-gram in the confidence of a classification
+TEMPERATURE = 0.4
+
+#: Languages identified by their scripts: Japanese by kana, which it is
+#: written in along with Han characters
+SCRIPTS = (
+    ('ja', u'\u3040-\u30ff\u31f0-\u31ff'),
+    ('ko', u'\uac00-\ud7af\u1100-\u11ff\u3130-\u318f'),
+    ('th', u'\u0e00-\u0e7f'),
+)
+
+SCRIPT_LANGUAGES = tuple(language for language, ranges in SCRIPTS)
+
+_SCRIPT_PATTERNS = tuple((language, re.compile(u'[{}]'.format(ranges)))
+                         for language, ranges in SCRIPTS)
+
+_HAN = re.compile(u'[\u4e00-\u9fff\u3400-\u4dbf]')
+
+# Anything but a letter separates words
+_NON_LETTERS = re.compile(r'[\W\d_]+', re.UNICODE)
+
+# Vietnamese letters with two diacritics, which langdetect counts as one
+_VI_LETTERS = re.compile(u'[\u1ea0-\u1eff]')
+
+
+def normalize(text):
+    """Lowercases a text and turns every run of non-letters into a single
+    space, as the n-grams of the model are counted. As in the profiles of
+    langdetect, the Farsi yeh is taken for the Arabic one, and Vietnamese
+    letters with two diacritics for one another."""
+    text = text.lower().replace(u'\u06cc', u'\u064a')
+    text = _NON_LETTERS.sub(u' ', _VI_LETTERS.sub(u'\u1ec3', text))
+    return u' {} '.format(text.strip())
+
+
+def iter_ngrams(text, orders):
+    """Yields the n-grams of a normalized text, except those made of spaces
+    only."""
+    for n in orders:
+        for i in range(len(text) - n + 1):
+            ngram = text[i:i + n]
+            if ngram.strip():
+                yield ngram
+
+
+class LanguageIdentifier(object):
+    """
+    :param languages: languages of the n-gram model
+    :param orders: lengths of the n-grams
+    :param scale: units of a cost per nat
+    :param unseen: the cost of an n-gram, which is in the model but not
+                   seen in a language, for each language
+    :param ngrams: a dictionary of n-grams to lists of their costs in each
+                   language
+    :param others: languages of the model that are not supported, which a
+                   text is classified into only to be left to Google
+                   Translate
+    """
+
+    def __init__(self, languages, orders, scale, unseen, ngrams, others=()):
+        self.languages = list(languages)
+        self.others = frozenset(others)
+        self.orders = tuple(orders)
+        self.scale = float(scale)
+        self._mask = (1 << FIELD_BITS) - 1
+        self._ngrams = {}
+        for ngram, costs in ngrams.items():
+            self._ngrams[ngram] = self._pack(
+                [cost if cost is not None else u
+                 for cost, u in zip(costs, unseen)])
+
+    def _pack(self, costs):
+        packed = 0
+        for i, cost in enumerate(costs):
+            packed |= int(cost) << (i * FIELD_BITS)
+        return packed
+
+    def _unpack(self, packed):
+        return [(packed >> (i * FIELD_BITS)) & self._mask
+                for i in range(len(self.languages))]
+
+    def classify(self, text):
+        """Returns a list of tuples of languages of the model and their
+        probabilities, the most probable first, or an empty list if the
+        text has no n-gram of the model."""
+        get = self._ngrams.get
+        text = normalize(text)
+        packed = []
+        for n in self.orders:
+            packed += [p for p in map(get, [text[i:i + n] for i in
+                                            range(len(text) - n + 1)])
+                       if p is not None]
+        if not packed:
+            return []
+
+        # The mean cost of an n-gram is weighed by a bounded number of
+        # n-grams, as a naive Bayes classifier grows overconfident on long
+        # texts, and is tempered as n-grams are far from independent
+        weight = min(len(packed), EVIDENCE_NGRAMS) * TEMPERATURE / \
+            (float(len(packed)) * self.scale)
+        costs = [cost * weight for cost in self._unpack(sum(packed))]
+        best = min(costs)
+        likelihoods = [math.exp(best - cost) for cost in costs]
+        total = sum(likelihoods)
+        return sorted(((language, likelihood / total) for language, likelihood
+                       in zip(self.languages, likelihoods)),
+                      key=lambda x: -x[1])
+
+    def identify(self, text):
+        """Returns a tuple of the most probable language of a text and its
+        probability, or `(None, 0.0)` if the text has no letters or is not
+        in any of the supported languages that it can be told from."""
+        sample = text[:MAX_SAMPLE_LENGTH]
+        letters = len(_NON_LETTERS.sub(u'', sample))
+        if not letters:
+            return None, 0.0
+
+        han = len(_HAN.findall(sample))
+        for language, pattern in _SCRIPT_PATTERNS:
+            count = len(pattern.findall(sample))
+            # Kana along with Han characters make a Japanese text
+            if language == 'ja' and count and (count + han) * 2 >= letters:
+                return language, 1.0
+            if count * 2 >= letters:
+                # Combining marks (e.g., of Thai) are not counted as letters
+                return language, min(1.0, count / float(letters))
+        # Han characters alone may be Chinese as well as Japanese
+        if han * 2 >= letters:
+            return None, 0.0
+
+        result = self.classify(sample)
+        if not result or result[0][0] in self.others:
+            return None, 0.0
+        return result[0]
+
+    def stats(self):
+        return {'languages': len(set(self.languages) - self.others) +
+                len(SCRIPT_LANGUAGES),
+                'ngrams': len(self._ngrams)}
+
+
+def load_model(path):
+    """Reads a model written by bin/build_langid.py."""
+    with open(path, 'rb') as fin:
+        model = json.loads(zlib.decompress(fin.read()).decode('utf-8'))
+    return LanguageIdentifier(model['languages'], model['orders'],
+                              model['scale'], model['unseen'],
+                              model['ngrams'], model.get('others', ()))
+
+
+class SourceResolver(object):
+    """Resolves 'auto' as the source language of a text when the language
+    of the text is identified with enough confidence.
+
+    :param identifier: a :class:`LanguageIdentifier`, or None to leave all
+                       texts to Google Translate
+    :param min_confidence: probability of the language of a text, below
+                           which it is left to Google Translate to detect
+    """
+
+    def __init__(self, identifier, enabled=True, min_confidence=0.9):
+        self.identifier = identifier
+        self.enabled = enabled
+        self.min_confidence = min_confidence
+        self.requests = 0
+        self.resolved = 0
+
+    def resolve(self, text, source):
+        """Returns the identified language of a text if `source` is 'auto',
+        or `source` itself."""
+        if source != 'auto' or not self.enabled or self.identifier is None:
+            return source
+        self.requests += 1
+        language, confidence = self.identifier.identify(text)
+        if language is None or confidence < self.min_confidence:
+            return source
+        self.resolved += 1
+        return language
+
+    def stats(self):
+        stats = {'enabled': self.enabled,
+                 'requests': self.requests,
+                 'resolved': self.resolved}
+        if self.identifier is not None:
+            stats.update(self.identifier.stats())
+        return stats
+
+
+def build_resolver(langid_config):
+    """Builds a resolver as specified in the `langid` section of the
+    config. Texts are left to Google Translate if there is no model (see
+    bin/build_langid.py)."""
+    path = langid_config.get('model_path') or MODEL_PATH
+    return SourceResolver(
+        load_model(path) if os.path.exists(path) else None,
+        enabled=bool(langid_config.get('enabled', True)),
+        min_confidence=float(langid_config.get('min_confidence', 0.9)))
+
+
+source_resolver = build_resolver(config.get('langid') or {})
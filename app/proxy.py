@@ -0,0 +1,281 @@
+"""Routing of upstream requests across the Lambda `web_proxy` functions.
+
+Each function keeps exponentially weighted moving averages of its latency and
+its error rate. A request is routed to the better of two randomly picked
+functions (power of two choices), and functions that are throttled or keep
+failing are ejected for a while. Functions whose circuit breakers (see
+`app.governor`) are open are left out, and requests through the others are
+paced."""
+
+import io
+import json
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from app import config, logger
+from app.governor import EgressUnavailable, upstream_governor
+
+
+def is_throttled(error):
+    """Tells whether an exception raised by `invoke()` indicates
+    throttling."""
+    response = getattr(error, 'response', None) or {}
+    code = response.get('Error', {}).get('Code')
+    return code in ('TooManyRequestsException', 'ThrottlingException')
+
+
+def is_relayed_error(payload):
+    """Tells whether the payload of a function error is a response of Google
+    Translate relayed in the pass-through mode (see `UpstreamError` of
+    lambda/lambda_function.py), rather than a failure of the function."""
+    try:
+        error = json.loads(payload.decode('utf-8'))
+    except ValueError:
+        return False
+    return isinstance(error, dict) and \
+        error.get('errorType') == 'UpstreamError'
+
+
+@contextmanager
+def _admitted(admission):
+    if admission is None:
+        yield
+    else:
+        with admission.admit():
+            yield
+
+
+class ProxyFunction(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.latency = None
+        self.error_rate = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.throttles = 0
+        self.ejections = 0
+        self.ejected_until = 0
+        self.in_flight = 0
+
+    def cost(self, error_penalty):
+        """Expected cost of sending a request to this function. Functions
+        that have never been used cost nothing so that they get explored."""
+        if self.latency is None:
+            return 0.0
+        return self.latency * (self.in_flight + 1) * \
+            (1 + error_penalty * self.error_rate)
+
+    def stats(self, now):
+        return {
+            'latency': self.latency,
+            'error_rate': self.error_rate,
+            'requests': self.requests,
+            'errors': self.errors,
+            'throttles': self.throttles,
+            'ejections': self.ejections,
+            'ejected': self.ejected_until > now,
+            'in_flight': self.in_flight,
+        }
+
+
+class ProxyRegistry(object):
+    """
+    :param names: names of the Lambda functions
+    :param alpha: smoothing factor of the moving averages
+    :param error_threshold: error rate above which a function is ejected
+    :param min_requests: number of requests a function must have served
+                         before it may be ejected because of its error rate
+    :param ejection_time: seconds for which an unhealthy function is ejected
+    :param error_penalty: weight of the error rate in the routing cost
+    :param passthrough: whether the functions support the pass-through mode,
+                        in which the invocation result is the upstream
+                        response body itself
+    :param encoding: encoding with which the functions are asked to compress
+                     response bodies (e.g., 'zlib'), if any
+    :param governor: a `RateGovernor` pacing the requests through each
+                     function
+    """
+
+    def __init__(self, names, alpha=0.2, error_threshold=0.5, min_requests=5,
+                 ejection_time=30, error_penalty=4, passthrough=False,
+                 encoding=None, governor=None, clock=time.time,
+                 rng=random):
+        if not names:
+            raise ValueError('At least one proxy function is required')
+        self.functions = [ProxyFunction(name) for name in names]
+        self.alpha = alpha
+        self.error_threshold = error_threshold
+        self.min_requests = min_requests
+        self.ejection_time = ejection_time
+        self.error_penalty = error_penalty
+        self.passthrough = passthrough
+        self.encoding = encoding
+        self.governor = governor
+        self.clock = clock
+        self.rng = rng
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name):
+        for function in self.functions:
+            if function.name == name:
+                return function
+        raise KeyError(name)
+
+    def available(self, exclude=()):
+        """Returns functions that are not ejected. When every function is
+        ejected, all of them are considered available; sending requests
+        somewhere beats failing all of them.
+
+        :raises EgressUnavailable: when the circuit breakers of all the
+                                   functions are open
+        """
+        now = self.clock()
+        candidates = [f for f in self.functions if f.name not in exclude]
+        if self.governor is not None and candidates:
+            names = [f.name for f in candidates]
+            candidates = [f for f in candidates
+                          if self.governor.allows(f.name)]
+            if not candidates:
+                raise EgressUnavailable(self.governor.retry_after(names))
+        healthy = [f for f in candidates if f.ejected_until <= now]
+        return healthy if healthy else candidates
+
+    def choose(self, exclude=()):
+        with self._lock:
+            candidates = self.available(exclude)
+            if not candidates:
+                raise ValueError('No proxy function is available')
+            if len(candidates) == 1:
+                return candidates[0]
+            a, b = self.rng.sample(candidates, 2)
+            cost_a = a.cost(self.error_penalty)
+            cost_b = b.cost(self.error_penalty)
+            return a if cost_a <= cost_b else b
+
+    def _update(self, function, latency, error):
+        function.requests += 1
+        if function.latency is None:
+            function.latency = latency
+        else:
+            function.latency += self.alpha * (latency - function.latency)
+        function.error_rate += self.alpha * (float(error) -
+                                             function.error_rate)
+
+    def _eject(self, function, reason):
+        logger.warning('Ejecting proxy function {} ({})'.format(
+            function.name, reason))
+        function.ejections += 1
+        function.ejected_until = self.clock() + self.ejection_time
+        # Give the function a clean slate once it comes back
+        function.error_rate = 0.0
+
+    def record_success(self, name, latency):
+        with self._lock:
+            self._update(self[name], latency, False)
+
+    def record_failure(self, name, latency, throttled=False):
+        with self._lock:
+            function = self[name]
+            self._update(function, latency, True)
+            function.errors += 1
+            if throttled:
+                function.throttles += 1
+                self._eject(function, 'throttled')
+            elif function.requests >= self.min_requests and \
+                    function.error_rate > self.error_threshold:
+                self._eject(function, 'error rate {:.2f}'.format(
+                    function.error_rate))
+
+    def acquire(self, exclude=(), name=None):
+        """Chooses a function for a request (unless `name` is given), which
+        must be followed by `release()` once the request is over."""
+        function = self.choose(exclude) if name is None else self[name]
+        with self._lock:
+            function.in_flight += 1
+        return function
+
+    def release(self, function):
+        with self._lock:
+            function.in_flight -= 1
+
+    def invoke(self, client, exclude=(), name=None, admission=None,
+               **kwargs):
+        """Invokes the chosen proxy function (or the one named `name`)
+        through `client`, which is anything that provides the `invoke()`
+        method of the boto3 Lambda client, and records the outcome. The name
+        of the function is set to the 'ProxyFunction' key of the result so
+        that the response can be passed to `record_response()` or
+        `discard()`.
+
+        :param admission: an `AdmissionController` (see `app.admission`) of
+                          which the invocation takes a slot, once the
+                          governor has let it through so that requests being
+                          paced do not hold slots
+        """
+        function = self.acquire(exclude, name)
+        try:
+            if self.governor is not None:
+                self.governor.acquire(function.name)
+            start = None
+            try:
+                with _admitted(admission):
+                    start = self.clock()
+                    resp = client.invoke(FunctionName=function.name,
+                                         **kwargs)
+            except Exception as e:
+                # A request rejected by admission control never reached the
+                # function
+                if start is not None:
+                    self.record_failure(function.name, self.clock() - start,
+                                        throttled=is_throttled(e))
+                if self.governor is not None:
+                    self.governor.cancel(function.name)
+                raise
+            failed = resp.get('StatusCode', 200) >= 300
+            if resp.get('FunctionError'):
+                # The payload is put back once it has been looked at
+                payload = resp['Payload'].read()
+                resp['Payload'] = io.BytesIO(payload)
+                failed = not is_relayed_error(payload)
+            if failed:
+                self.record_failure(function.name, self.clock() - start)
+            else:
+                self.record_success(function.name, self.clock() - start)
+            resp['ProxyFunction'] = function.name
+            return resp
+        finally:
+            self.release(function)
+
+    def record_response(self, name, status_code, body):
+        """Passes a response of Google Translate relayed by a function to the
+        governor and returns whether the function has been blocked."""
+        if self.governor is None or name is None:
+            return False
+        return self.governor.record(name, status_code, body)
+
+    def discard(self, name):
+        """Gives up on the response to a request through a function without
+        passing it to the governor (e.g., the loser of a hedged request)."""
+        if self.governor is not None:
+            self.governor.cancel(name)
+
+    def stats(self):
+        now = self.clock()
+        return {f.name: f.stats(now) for f in self.functions}
+
+
+def build_registry(aws_config):
+    """Builds a registry as specified in the `aws` section of the config."""
+    names = aws_config.get('proxy_functions') or ['web_proxy', 'web_proxy2']
+    return ProxyRegistry(
+        names,
+        ejection_time=float(aws_config.get('proxy_ejection_time', 30)),
+        passthrough=bool(aws_config.get('proxy_passthrough', False)),
+        encoding=aws_config.get('proxy_encoding') or None,
+        governor=upstream_governor)
+
+
+proxy_registry = build_registry(config.get('aws') or {})
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""Splits texts into sentences so that they can be translated (and cached)
+one by one, and puts translated sentences back together."""
+
+import re
+
+
+#: Languages that do not put spaces between sentences
+NO_SPACE_LANGUAGES = ('ja', 'zh-CN')
+
+#: Common abbreviations which must not be taken as the end of a sentence
+ABBREVIATIONS = ('mr', 'mrs', 'ms', 'dr', 'prof', 'sr', 'jr', 'st', 'vs',
+                 'etc', 'e.g', 'i.e', 'fig')
+
+#: Abbreviations which are taken as such only when a number follows them
+#: (e.g., 'No. 5' but not 'The answer is no.')
+NUMBER_ABBREVIATIONS = ('no',)
+
+# A Latin terminator ends a sentence only when followed by a white space, so
+# that '3.14' or 'google.com' are kept intact. CJK terminators always end a
+# sentence.
+_BOUNDARY = re.compile(
+    u'(?:[.!?…]+[\'"’”)\\]]*(?=\\s|$)'
+    u'|[。！？]+[」』）”"]*)'
+    u'([ \t　]*)')
+
+# Thai does not have sentence terminators. A single space separates
+# clauses, which need one another to be translated well, so only a double
+# space marks the end of a sentence.
+_THAI_BOUNDARY = re.compile(u'([ \t]{2,})')
+
+
+def _is_abbreviation(line, end):
+    match = re.search(r'([\w.]+)\.$', line[:end])
+    if match is None:
+        return False
+    word = match.group(1).lower()
+    if word in NUMBER_ABBREVIATIONS:
+        return re.match(r'\s*\d', line[end:]) is not None
+    return word in ABBREVIATIONS
+
+
+def _split_line(line, language):
+    pattern = _THAI_BOUNDARY if language == 'th' else _BOUNDARY
+    segments = []
+    start = 0
+    for match in pattern.finditer(line):
+        end = match.start(1)
+        if end == start or end == len(line):
+            continue
+        if language != 'th' and _is_abbreviation(line, end):
+            continue
+        segments.append((line[start:end], match.group(1)))
+        start = match.end()
+
+    if start < len(line) or not segments:
+        segments.append((line[start:], ''))
+    return segments
+
+
+def _iter_lines(text):
+    """Yields `(line, has_line_break)` tuples without splitting the whole
+    text at once."""
+    start = 0
+    while True:
+        end = text.find('\n', start)
+        if end == -1:
+            yield text[start:], False
+            return
+        yield text[start:end], True
+        start = end + 1
+
+
+def iter_sentences(text, language):
+    """Yields `(sentence, separator)` tuples, where `separator` is the white
+    space that follows the sentence. Joining all sentences and separators
+    yields the original text.
+
+    :param language: source language, which may be 'auto'
+    """
+    # The last segment is held back, as a line break may follow it
+    pending = None
+    for line, has_line_break in _iter_lines(text):
+        segments = []
+
+        # Leading white spaces are kept as a separator of an empty sentence
+        stripped = line.lstrip(u' \t　')
+        if len(stripped) < len(line):
+            segments.append(('', line[:len(line) - len(stripped)]))
+
+        if stripped:
+            segments += _split_line(stripped, language)
+
+        if has_line_break:
+            if segments:
+                sentence, separator = segments[-1]
+                segments[-1] = (sentence, separator + '\n')
+            elif pending is not None:
+                pending = (pending[0], pending[1] + '\n')
+            else:
+                segments.append(('', '\n'))
+
+        for segment in segments:
+            if pending is not None:
+                yield pending
+            pending = segment
+
+    if pending is not None:
+        yield pending
+
+
+def split_sentences(text, language):
+    """Splits a text into a list of `(sentence, separator)` tuples. See
+    :func:`iter_sentences`."""
+    return list(iter_sentences(text, language))
+
+
+def join_sentences(sentences, separators, language):
+    """Joins translated sentences with the original separators, adjusting
+    inter-sentence spaces to the conventions of the target language."""
+    buf = []
+    for i, (sentence, separator) in enumerate(zip(sentences, separators)):
+        if '\n' not in separator and i < len(sentences) - 1 and sentence:
+            if language in NO_SPACE_LANGUAGES:
+                separator = ''
+            elif not separator:
+                separator = ' '
+        buf.append(sentence)
+        buf.append(separator)
+    return ''.join(buf)
+
+
+def pack_sentences(sentences, max_length):
+    """Packs sentences into as few batches as possible, each of which is
+    shorter than `max_length` once joined with line breaks. A sentence
+    longer than `max_length` makes a batch of its own.
+
+    :return: a list of lists of indices of `sentences`
+    """
+    batches = []
+    batch, length = [], 0
+    for i, sentence in enumerate(sentences):
+        if batch and length + 1 + len(sentence) > max_length:
+            batches.append(batch)
+            batch, length = [], 0
+        length += len(sentence) + (1 if batch else 0)
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _make_chunk(parts):
+    chunk = ''.join(parts)
+    stripped = chunk.rstrip()
+    return stripped, chunk[len(stripped):]
+
+
+def _split_long_sentence(sentence, separator, max_length):
+    """Cuts a sentence longer than `max_length` at white spaces, or anywhere
+    if there are none."""
+    while len(sentence) > max_length:
+        end = sentence.rfind(' ', 0, max_length + 1)
+        if end <= 0:
+            yield sentence[:max_length], ''
+            sentence = sentence[max_length:]
+        else:
+            yield sentence[:end], sentence[end]
+            sentence = sentence[end + 1:]
+    yield sentence, separator
+
+
+def iter_chunks(text, language, max_length):
+    """Yields chunks of whole sentences, each of which is no longer than
+    `max_length`. Sentences longer than that are cut into pieces. A chunk
+    that is at least half full is closed at the end of a paragraph, so that
+    paragraphs are kept together where possible.
+
+    :return: an iterator of `(chunk, separator)` tuples
+    """
+    parts, length = [], 0
+    for sentence, separator in iter_sentences(text, language):
+        if len(sentence) > max_length:
+            if parts:
+                yield _make_chunk(parts)
+                parts, length = [], 0
+            for piece in _split_long_sentence(sentence, separator,
+                                              max_length):
+                yield piece
+            continue
+        if parts and length + len(sentence) > max_length:
+            yield _make_chunk(parts)
+            parts, length = [], 0
+        parts.append(sentence + separator)
+        length += len(sentence) + len(separator)
+        if '\n\n' in separator and length >= max_length // 2:
+            yield _make_chunk(parts)
+            parts, length = [], 0
+    if parts:
+        yield _make_chunk(parts)
+
+
+def split_chunks(text, language, max_length):
+    """Splits a text into a list of `(chunk, separator)` tuples. See
+    :func:`iter_chunks`."""
+    return list(iter_chunks(text, language, max_length))
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""Translation sessions of the web UI.
+
+A session remembers the sentences of the last text a client translated and
+their translations, so that a text which has only been edited in part is
+retranslated in part as well. Sessions are kept in memory, bounded in number
+and in the total length of their texts, and evicted in the least recently
+used order, or once they have been idle for `ttl` seconds."""
+
+import threading
+import time
+from collections import OrderedDict
+
+from app import config
+
+
+#: Upper bound of the length of a session token
+MAX_TOKEN_LENGTH = 128
+
+
+class TranslationSession(object):
+    """
+    :param languages: a tuple of the source, intermediate and target
+                      languages of which the translations are
+    :param translations: a dictionary of sentences to tuples of their
+                         intermediate translation (or None) and translation
+    """
+
+    def __init__(self, languages, translations):
+        self.languages = languages
+        self.translations = translations
+        self.size = sum(len(sentence) + len(intermediate or '') +
+                        len(translation)
+                        for sentence, (intermediate, translation)
+                        in translations.items())
+
+
+class SessionStore(object):
+    """
+    :param max_sessions: upper bound of the number of sessions kept
+    :param max_chars: upper bound of the total length of the sentences and
+                      translations kept in all sessions; a session larger
+                      than this is not kept at all
+    :param ttl: seconds for which an idle session is kept
+    """
+
+    def __init__(self, max_sessions=1000, max_chars=4000000, ttl=1800,
+                 clock=time.time):
+        self.max_sessions = max_sessions
+        self.max_chars = max_chars
+        self.size = 0
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token, languages):
+        """Returns the translations of a session as a dictionary (see
+        :class:`TranslationSession`), which is empty if the session does not
+        exist, has expired or was about other languages."""
+        with self._lock:
+            entry = self._sessions.pop(token, None)
+            if entry is not None:
+                expires_at, session = entry
+                self.size -= session.size
+                if expires_at > self.clock():
+                    self._sessions[token] = entry
+                    self.size += session.size
+                    if session.languages == languages:
+                        self.hits += 1
+                        return dict(session.translations)
+            self.misses += 1
+            return {}
+
+    def set(self, token, languages, translations):
+        session = TranslationSession(languages, translations)
+        with self._lock:
+            entry = self._sessions.pop(token, None)
+            if entry is not None:
+                self.size -= entry[1].size
+            if session.size > self.max_chars:
+                return
+            self._sessions[token] = (self.clock() + self.ttl, session)
+            self.size += session.size
+            while len(self._sessions) > self.max_sessions or \
+                    self.size > self.max_chars:
+                expires_at, evicted = self._sessions.popitem(last=False)[1]
+                self.size -= evicted.size
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'chars': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+def build_session_store(session_config):
+    """Builds a session store as specified in the `session` section of the
+    config."""
+    return SessionStore(
+        max_sessions=int(session_config.get('max_sessions', 1000)),
+        max_chars=int(session_config.get('max_chars', 4000000)),
+        ttl=int(session_config.get('ttl', 1800)))
+
+
+translation_sessions = build_session_store(config.get('session') or {})
@@ -75,6 +75,11 @@ var examples = {
 // URL encoded length, exclusively less than
 var LONG_TRANSLATION_THRESHOLD = 1200;
 
+// Lets the server retranslate only the sentences edited since the previous
+// request of this page
+var SESSION_TOKEN = Math.random().toString(36).substring(2) +
+    new Date().getTime().toString(36);
+
 var TAGS_TO_REPLACE = {
     '&': '&amp;',
     '<': '&lt;',
@@ -359,7 +364,27 @@ function performTranslation() {
                 showCaptcha(response);
             }
             else {
-                var raw = JSON.parse(response);
+                var raw = typeof response === 'string' ?
+                    JSON.parse(response) : response;
+
+                // As every request carries the session token, every result
+                // comes with 'session'. A result is uploaded as a corpus only
+                // when all of its sentences were translated upstream for this
+                // request (none reused from a previous one); otherwise it
+                // mixes in translations made for other texts. The token
+                // itself is never uploaded.
+                var isCorpus = !raw.session || raw.session.reused == 0;
+                delete raw.session;
+
+                // Pivot translations carry the result of the first hop
+                if (raw.intermediate) {
+                    if (isCorpus) {
+                        uploadRawCorpora(sourceLang, intermediateLang,
+                            JSON.stringify(raw.intermediate));
+                    }
+                    delete raw.intermediate;
+                }
+
                 var targetText = extractSentences(raw);
 
                 model.set('raw', raw);
@@ -368,7 +393,9 @@ function performTranslation() {
                 // detected source language
                 var source = raw[2];
 
-                uploadRawCorpora(sourceLang, target, JSON.stringify(raw));
+                if (isCorpus) {
+                    uploadRawCorpora(sourceLang, target, JSON.stringify(raw));
+                }
             }
         };
     };
@@ -408,32 +435,10 @@ function performTranslation() {
 
         state.pending = true;
 
-        if (intermediateLang) {
-
-            sendTranslationRequest(sourceLang, intermediateLang, sourceText, function(response) {
-
-                onSuccess(intermediateLang)(response);
-
-                // Delay for a random interval (0.5-1.5 sec)
-                var delay = 500 + Math.random() * 1000;
-
-                setTimeout(function() {
-                    state.pending = true;
-                    sendTranslationRequest(intermediateLang, targetLang,
-                        extractSentences(model.get('raw')),
-                        onSuccess(targetLang),
-                        onAlways
-                    );
-                }, delay);
-
-            }, function() {
-                $("#progress-message").show();
-            });
-        }
-        else {
-            sendTranslationRequest(sourceLang, targetLang, sourceText,
-                onSuccess(targetLang), onAlways);
-        }
+        // The server takes care of both hops when an intermediate language
+        // is given
+        sendTranslationRequest(sourceLang, intermediateLang, targetLang,
+            sourceText, onSuccess(targetLang), onAlways);
 
         ga('send', 'event', 'api', 'translate',
            sprintf('sl=%s&il=%s&tl=%s', sourceLang, intermediateLang, targetLang));
@@ -468,7 +473,8 @@ function sendXDomainRequest(url, method, data, onSuccess, onAlways) {
 /**
  * Sends a translation request to a remote server
  */
-function sendTranslationRequest(source, target, text, onSuccess, onAlways) {
+function sendTranslationRequest(source, intermediate, target, text,
+                                onSuccess, onAlways) {
 
     // Use GET for short requests and POST for long requests
     var textLength = encodeURIComponent(text).length;
@@ -503,7 +509,12 @@ function sendTranslationRequest(source, target, text, onSuccess, onAlways) {
         sendXDomainRequest(url, requestMethod, {q: text}, onSuccess, onAlways);
     }
     else {
-        requestFunction(url, {text: text, source: source, target: target}, onSuccess).fail(function(response) {
+        var data = {text: text, source: source, target: target,
+                    session: SESSION_TOKEN};
+        if (intermediate) {
+            data.intermediate = intermediate;
+        }
+        requestFunction(url, data, onSuccess).fail(function(response) {
             displayError(response.responseText, null);
 
         }).always(onAlways);
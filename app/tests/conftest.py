@@ -1,6 +1,32 @@
+import sys
+
 import pytest
 
 
+# The asynchronous serving path requires Python 3.5+
+if sys.version_info < (3, 5):
+    collect_ignore = ['test_aio.py']
+
+
+class FakeClock(object):
+    """A clock which only moves when it is told to, or when it is slept
+    on."""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
 @pytest.fixture
 def testapp():
     from app import create_app
@@ -0,0 +1,282 @@
+import threading
+import time
+
+import pytest
+import requests
+
+import app.api
+from app.admission import AdmissionController, Overloaded, bind_flow, \
+    current_flow, is_overload, set_flow
+from app.governor import EgressUnavailable, RateGovernor
+from app.proxy import ProxyRegistry
+from app.utils import HTTPException
+from app.cache import make_cache_key, translation_cache
+
+
+def test_queue_full():
+    admission = AdmissionController(limit=1, min_limit=1, queue_size=0)
+    start = admission.acquire()
+
+    with pytest.raises(Overloaded) as e:
+        admission.acquire()
+    assert e.value.status_code == 503
+    assert int(e.value.headers['Retry-After']) >= 1
+
+    admission.release(start)
+    admission.release(admission.acquire())
+    assert admission.stats()['rejected'] == 1
+
+
+def test_deadline():
+    """Requests are rejected right away when they are expected to wait
+    longer than their deadline, and after the deadline otherwise."""
+    admission = AdmissionController(limit=1, min_limit=1, max_wait=0.05)
+    admission.latency = 10
+    admission.acquire()
+
+    begin = time.time()
+    with pytest.raises(Overloaded) as e:
+        admission.acquire()
+    assert time.time() - begin < 0.05
+    assert e.value.retry_after == 10
+
+    admission.latency = 0.01
+    with pytest.raises(Overloaded):
+        admission.acquire()
+    assert time.time() - begin >= 0.05
+
+
+def test_waiting():
+    admission = AdmissionController(limit=1, min_limit=1, max_wait=5)
+    start = admission.acquire()
+    admitted = []
+
+    def acquire():
+        admitted.append(admission.acquire())
+
+    thread = threading.Thread(target=acquire)
+    thread.start()
+    while admission.stats()['waiting'] == 0:
+        time.sleep(0.001)
+    assert admitted == []
+
+    admission.release(start)
+    thread.join()
+    assert len(admitted) == 1
+    assert admission.stats()['in_flight'] == 1
+
+
+def test_adaptive_limit(clock):
+    admission = AdmissionController(limit=4, min_limit=2, max_limit=5,
+                                    latency_target=1.0, clock=clock)
+
+    # Additive increase: +1 after `limit` fast requests
+    for _ in range(4):
+        start = admission.acquire()
+        clock.now += 0.1
+        admission.release(start)
+    assert 4.9 < admission.limit <= 5
+
+    # Multiplicative decrease, once for requests in flight at the same time
+    starts = [admission.acquire() for _ in range(3)]
+    clock.now += 2
+    for start in starts:
+        admission.release(start)
+    assert admission.limit == pytest.approx(4.9 * 0.9, rel=0.02)
+
+    start = admission.acquire()
+    clock.now += 0.1
+    admission.release(start, overloaded=True)
+    assert admission.limit < 4.9 * 0.9 * 0.95
+
+    for _ in range(50):
+        admission.release(admission.acquire(), overloaded=True)
+    assert admission.limit == 2
+
+
+@pytest.mark.parametrize('error, overloaded', [
+    (HTTPException('Too many requests', 429), True),
+    (HTTPException('Bad gateway', 502), True),
+    (HTTPException('Bad request', 400), False),
+    (EgressUnavailable(30), False),
+    (Overloaded(1), False),
+    (requests.ConnectionError(), True),
+    (requests.Timeout(), True),
+    (ValueError('No JSON object could be decoded'), False),
+    (KeyError('sentences'), False),
+])
+def test_is_overload(error, overloaded):
+    assert is_overload(error) == overloaded
+
+
+def test_pacing_outside_admission(clock):
+    """Requests wait for their turn at the egress before they take a slot,
+    and local rejections do not shrink the limit."""
+    class FakeClient(object):
+        def invoke(self, FunctionName, **kwargs):
+            assert admission.in_flight == 1
+            clock.now += 0.1
+            return {'StatusCode': 200}
+
+    admission = AdmissionController(limit=4, min_limit=2,
+                                    latency_target=1.0, clock=clock)
+    governor = RateGovernor(rate=1, burst=1, max_pace=5, clock=clock,
+                            sleep=clock.sleep)
+    registry = ProxyRegistry(['a'], governor=governor, clock=clock)
+    for _ in range(3):
+        registry.invoke(FakeClient(), admission=admission)
+    # Pacing waits of about a second are not part of the latency
+    assert admission.latency == pytest.approx(0.1)
+
+    limit = admission.limit
+    with pytest.raises(EgressUnavailable):
+        with admission.admit():
+            raise EgressUnavailable(30)
+    assert admission.limit >= limit
+
+
+def test_load_shedding(testapp, monkeypatch):
+    """Translations that need upstream requests are shed under overload,
+    while cached ones are still served."""
+    admission = AdmissionController(limit=1, min_limit=1, queue_size=0)
+    admission.acquire()
+    monkeypatch.setattr(app.api, 'upstream_admission', admission)
+
+    params = dict(t='Hello', m='1', sl='en', tl='ko')
+    resp = testapp.post('/v1.2/translate', data=params)
+    assert resp.status_code == 503
+    assert resp.headers['Retry-After']
+
+    translation_cache.set(make_cache_key('Hello', 'en', 'ko', '1', 'x'),
+                          {'translated_text': 'Annyeong'})
+    try:
+        resp = testapp.post('/v1.2/translate', data=params)
+    finally:
+        translation_cache.clear()
+    assert resp.status_code == 200
+
+
+def enqueue(admission, flows):
+    """Starts a thread waiting for a slot for each flow, one after another,
+    and returns the threads and the list to which flows are appended as they
+    get slots."""
+    admitted = []
+    threads = []
+    for flow in flows:
+        thread = threading.Thread(target=lambda flow=flow: admitted.append(
+            (flow, admission.acquire(flow=flow))))
+        thread.start()
+        threads.append(thread)
+        deadline = time.time() + 5
+        while admission.stats()['waiting'] < len(threads):
+            assert time.time() < deadline
+            time.sleep(0.001)
+    return threads, admitted
+
+
+def drain(admission, threads, admitted):
+    """Releases slots one at a time and returns flows in the order in which
+    they got them."""
+    order = []
+    while len(order) < len(threads):
+        while len(admitted) <= len(order):
+            time.sleep(0.001)
+        flow, ticket = admitted[len(order)]
+        order.append(flow)
+        admission.release(ticket)
+    for thread in threads:
+        thread.join()
+    return order
+
+
+def test_weighted_fair_queuing():
+    admission = AdmissionController(limit=1, min_limit=1, max_limit=1,
+                                    max_wait=5)
+    admission.latency = 0.01
+    ticket = admission.acquire()
+
+    # Interactive requests go ahead of bulk ones, and a client with many
+    # requests does not hold the others back
+    flows = [('bulk', 'a'), ('bulk', 'a'), ('bulk', 'a'), ('bulk', 'b'),
+             ('interactive', 'c')]
+    threads, admitted = enqueue(admission, flows)
+    admission.release(ticket)
+    order = drain(admission, threads, admitted)
+
+    assert order[0] == ('interactive', 'c')
+    assert order.index(('bulk', 'b')) <= 2
+
+
+def test_class_quota():
+    admission = AdmissionController(limit=4, min_limit=4, max_limit=4,
+                                    max_wait=5)
+    admission.latency = 0.01
+    tickets = [admission.acquire(flow=('bulk', str(i))) for i in range(2)]
+
+    # Bulk jobs may only take up half of the slots
+    threads, admitted = enqueue(admission, [('bulk', '2')])
+    assert admitted == []
+    tickets.append(admission.acquire(flow=('interactive', 'a')))
+    assert admission.stats()['classes']['bulk'] == {'in_flight': 2,
+                                                    'waiting': 1}
+
+    admission.release(tickets[0])
+    threads[0].join()
+    assert admitted[0][0] == ('bulk', '2')
+
+
+def test_configured_classes():
+    classes = {'api': {'weight': 2, 'quota': 0.75},
+               'bulk': {'weight': 1, 'quota': 0.5}}
+    admission = AdmissionController(limit=4, classes=classes)
+    assert admission.default_class == 'api'
+
+    # Requests of unknown classes fall into a configured class
+    ticket = admission.acquire(flow=('interactive', 'a'))
+    assert admission.stats()['classes']['api']['in_flight'] == 1
+    admission.release(ticket)
+
+    with pytest.raises(ValueError):
+        AdmissionController(classes={})
+    with pytest.raises(ValueError):
+        AdmissionController(classes={'bulk': {'weight': 1, 'quota': 0}})
+
+
+def test_bind_flow():
+    flows = []
+    set_flow(('bulk', '127.0.0.1'))
+    try:
+        fn = bind_flow(lambda: flows.append(current_flow()))
+    finally:
+        set_flow(None)
+
+    thread = threading.Thread(target=fn)
+    thread.start()
+    thread.join()
+    assert flows == [('bulk', '127.0.0.1')]
+    assert current_flow() == ('interactive', '')
+
+
+def test_classify_request(testapp, monkeypatch):
+    flows = []
+
+    class FakeResponse(object):
+        status_code = 200
+        text = '{"sentences": [{"trans": "Annyeong"}]}'
+
+    class FakeTransport(object):
+        def post(self, url, **kwargs):
+            flows.append(current_flow())
+            return FakeResponse()
+
+    monkeypatch.setattr(app.api, 'get_transport', lambda: FakeTransport())
+    params = dict(t='Hello', m='1', sl='en', tl='ko')
+    try:
+        resp = testapp.post('/v1.2/translate', data=params,
+                            headers={'X-Forwarded-For': '10.0.0.1'})
+    finally:
+        translation_cache.clear()
+
+    assert resp.status_code == 200
+    assert flows == [('api', '10.0.0.1')]
+    assert current_flow() == ('interactive', '')
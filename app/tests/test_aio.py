@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import io
+import json
+import threading
+
+import pytest
+
+aiohttp = pytest.importorskip('aiohttp')
+
+from aiohttp.test_utils import TestClient, TestServer  # noqa: E402
+
+from app.aio import AsyncSingleFlight, AsyncTranslator, create_app  # noqa
+from app.api import HTTPException  # noqa: E402
+from app.cache import LRUCache, TieredCache, translation_cache  # noqa
+from app.proxy import ProxyRegistry  # noqa: E402
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def request(translator, method, path, **kwargs):
+    """Sends a request to the application and returns a tuple of the status
+    code and the body of the response."""
+
+    async def send():
+        async with TestClient(TestServer(create_app(translator))) as client:
+            resp = await client.request(method, path, **kwargs)
+            return resp.status, await resp.read()
+
+    try:
+        return run(send())
+    finally:
+        translation_cache.clear()
+
+
+def fake_translator(upstream):
+    """Returns a translator which 'translates' a text by tagging each of its
+    lines with the target language."""
+    translator = AsyncTranslator()
+
+    async def translate_text(text, source, target, user_agent):
+        upstream.append((text, source, target))
+        await asyncio.sleep(0.01)
+        if 'fail' in text.split('\n'):
+            raise HTTPException('Google Translate returned HTTP 503', 503)
+        return u'\n'.join(u'{}:{}'.format(target, line)
+                          for line in text.split('\n'))
+
+    translator.translate_text = translate_text
+    return translator
+
+
+def test_singleflight():
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 'value'
+
+    async def main():
+        return await asyncio.gather(*[flight.do('key', fetch)
+                                      for _ in range(10)])
+
+    assert run(main()) == ['value'] * 10
+    assert calls == [1]
+    assert flight.stats() == {'calls': 1, 'coalesced': 9, 'in_flight': 0}
+
+
+def test_translate_batch():
+    upstream = []
+    items = [
+        {'text': 'Hello', 'source': 'en', 'target': 'ko'},
+        {'text': 'World', 'source': 'en', 'target': 'ko'},
+        {'text': 'Hello', 'source': 'en', 'target': 'ko'},
+        {'text': 'Pivot', 'source': 'en', 'target': 'ko', 'mode': '2'},
+        {'text': 'fail', 'source': 'en', 'target': 'ko', 'mode': '2'},
+        {'text': '', 'source': 'en', 'target': 'ko'},
+        {'source': 'en', 'target': 'ko'},
+    ]
+    status, body = request(fake_translator(upstream), 'POST',
+                           '/api/v1.3/translate/batch',
+                           data=json.dumps({'items': items}))
+    assert status == 200
+
+    results = json.loads(body.decode('utf-8'))['results']
+    assert [r.get('translated_text') for r in results[:4]] == \
+        ['ko:Hello', 'ko:World', 'ko:Hello', 'ko:ja:Pivot']
+    assert results[3]['intermediate_text'] == 'ja:Pivot'
+    assert results[4] == {'error': 'Google Translate returned HTTP 503',
+                          'status_code': 503}
+    assert results[5]['status_code'] == 400
+    assert results[6]['status_code'] == 400
+
+    # Short texts are packed into a single request
+    assert ('Hello\nWorld', 'en', 'ko') in upstream
+    assert len(upstream) == 4
+
+
+def test_translate_batch_pack_failure():
+    """Only the item which fails a packed request gets an error."""
+    upstream = []
+    items = [{'text': text, 'source': 'en', 'target': 'ko'}
+             for text in ('Hello', 'fail', 'World')]
+    status, body = request(fake_translator(upstream), 'POST',
+                           '/api/v1.3/translate/batch',
+                           data=json.dumps({'items': items}))
+    assert status == 200
+
+    results = json.loads(body.decode('utf-8'))['results']
+    assert results[0]['translated_text'] == 'ko:Hello'
+    assert results[1]['status_code'] == 503
+    assert results[2]['translated_text'] == 'ko:World'
+    assert len(upstream) == 4
+
+
+def test_disk_cache_off_the_loop():
+    """The disk tier of the cache is accessed from other threads than the
+    one running the event loop."""
+    threads = []
+
+    class FakeDiskCache(object):
+        def __init__(self):
+            self.entries = {}
+
+        def get(self, key):
+            threads.append(threading.current_thread())
+            return self.entries.get(key)
+
+        def set(self, key, value):
+            threads.append(threading.current_thread())
+            self.entries[key] = value
+
+    upstream = []
+    translator = fake_translator(upstream)
+    disk = FakeDiskCache()
+    translator.cache = TieredCache(LRUCache(), disk)
+
+    async def main():
+        first = await translator.translate('Hello', '1', 'en', 'ko', '')
+        translator.cache.memory.clear()
+        second = await translator.translate('Hello', '1', 'en', 'ko', '')
+        return first, second
+
+    first, second = run(main())
+    assert first == second
+    assert len(upstream) == 1
+    assert len(disk.entries) == 1
+    assert len(threads) == 3
+    assert threading.current_thread() not in threads
+
+
+def test_translate_batch_invalid():
+    status, _ = request(fake_translator([]), 'POST',
+                        '/api/v1.3/translate/batch', data='{"items": 1}')
+    assert status == 400
+
+
+def test_translate_v1_3():
+    calls = []
+    translator = AsyncTranslator()
+
+    async def lambda_get(url, params={}, data={}, headers={},
+                         passthrough=False, exclude=(), method='get',
+                         encoding=None):
+        calls.append((params['sl'], params['tl'], params['dt']))
+        body = {'sentences': [{'trans': u'[{}] {}'.format(params['tl'],
+                                                          params['q'])}]}
+        payload = {'text': json.dumps(body), 'status_code': 200}
+        return {'Payload': io.BytesIO(json.dumps(payload).encode('utf-8'))}
+
+    translator.lambda_get = lambda_get
+
+    status, body = request(translator, 'GET', '/api/v1.3/translate', params={
+        'text': 'Hello', 'source': 'en', 'target': 'ko', 'fields': 't'})
+    assert status == 200
+    assert json.loads(body.decode('utf-8'))['sentences'][0]['trans'] == \
+        '[ko] Hello'
+    assert calls == [('en', 'ko', ['t'])]
+
+    status, body = request(translator, 'POST', '/api/v1.3/translate', data={
+        'text': 'Hello', 'source': 'en', 'target': 'ko',
+        'intermediate': 'ja'})
+    assert status == 200
+    result = json.loads(body.decode('utf-8'))
+    assert result['sentences'][0]['trans'] == '[ko] [ja] Hello'
+    assert result['intermediate']['sentences'][0]['trans'] == '[ja] Hello'
+
+    status, _ = request(translator, 'GET', '/api/v1.3/translate', params={
+        'text': 'Hello', 'source': 'en', 'target': 'ko',
+        'intermediate': 'xx'})
+    assert status == 400
+
+    # Sessions are not supported, rather than silently ignored
+    calls.clear()
+    status, body = request(translator, 'POST', '/api/v1.3/translate', data={
+        'text': 'Hello', 'source': 'en', 'target': 'ko', 'session': 'abc'})
+    assert status == 400
+    assert body == b'Unsupported parameter: session'
+    assert calls == []
+
+
+def test_lambda_get(monkeypatch):
+    """Throttled invocations are retried on another function."""
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'AKID')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'secret')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-west-2')
+
+    registry = ProxyRegistry(['a', 'b'])
+    translator = AsyncTranslator(registry=registry)
+    invoked = []
+
+    async def fake_request(method, url, headers, data):
+        assert headers['Authorization'].startswith('AWS4-HMAC-SHA256')
+        invoked.append(url.split('/')[-2])
+        if len(invoked) == 1:
+            return 429, {'X-Amzn-ErrorType': 'TooManyRequestsException'}, b''
+        return 200, {}, b'{"text": "ok", "status_code": 200}'
+
+    translator._request = fake_request
+    resp = run(translator.lambda_get('https://translate.google.com'))
+
+    assert resp['Payload'].read() == b'{"text": "ok", "status_code": 200}'
+    assert sorted(invoked) == ['a', 'b']
+    assert registry[invoked[0]].throttles == 1
+    assert registry[invoked[1]].requests == 1
@@ -0,0 +1,117 @@
+import io
+import json
+import threading
+
+import pytest
+
+import app.api
+from app import create_app
+from app.api import __lambda_translate__, __params__
+from app.batcher import InvocationBatcher
+
+
+def run_concurrently(fn, args):
+    results = [None] * len(args)
+
+    def run(i):
+        results[i] = fn(args[i])
+
+    threads = [threading.Thread(target=run, args=(i,))
+               for i in range(len(args))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    return results
+
+
+def test_batching():
+    batches = []
+    lock = threading.Lock()
+
+    def send(requests):
+        with lock:
+            batches.append(list(requests))
+        return [r * 10 for r in requests]
+
+    batcher = InvocationBatcher(send, max_size=4, max_delay=0.2)
+    results = run_concurrently(batcher.submit, list(range(10)))
+
+    assert results == [i * 10 for i in range(10)]
+    assert sorted(sum(batches, [])) == list(range(10))
+    assert all(len(batch) <= 4 for batch in batches)
+    assert len(batches) < 10
+    assert batcher.stats()['requests'] == 10
+    assert batcher.stats()['batches'] == len(batches)
+
+
+def test_batch_error():
+    def send(requests):
+        raise RuntimeError('boom')
+
+    batcher = InvocationBatcher(send, max_size=2, max_delay=0.2)
+    errors = []
+
+    def submit(request):
+        try:
+            batcher.submit(request)
+        except RuntimeError as e:
+            errors.append(e)
+
+    run_concurrently(submit, [1, 2])
+    assert len(errors) == 2
+
+
+def test_params_post():
+    """Texts too long to be sent in a query string go in the form data."""
+    with create_app(config={'DEBUG': True}).test_request_context():
+        params = __params__(u'long text ' * 200, 'en', 'ko', remote_addr='')
+        assert params['method'] == 'post'
+        assert 'q' not in params['payload']
+        assert params['data'] == {'q': u'long text ' * 200}
+
+        params = __params__(u'short text', 'en', 'ko', remote_addr='')
+        assert params['method'] == 'get'
+        assert params['data'] == {}
+
+
+def test_lambda_translate_batched(monkeypatch):
+    events = []
+
+    def lambda_invoke(event, exclude=()):
+        events.append(event)
+        responses = [{'text': json.dumps({'sentences': [
+            {'trans': r['params'].get('q', r['data'].get('q')).upper()}]}),
+            'status_code': 200} for r in event['requests']]
+        return {'Payload': io.BytesIO(
+            json.dumps({'responses': responses}).encode('utf-8')),
+            'ProxyFunction': 'web_proxy'}
+
+    monkeypatch.setattr(app.api, 'lambda_invoke', lambda_invoke)
+    monkeypatch.setattr(app.api.lambda_batcher, 'enabled', True)
+    monkeypatch.setattr(app.api.lambda_batcher, 'max_delay', 0.2)
+
+    texts = [u'one', u'two', u'three ' * 200]
+    with create_app(config={'DEBUG': True}).test_request_context():
+        params = [__params__(text, 'en', 'ko', remote_addr='')
+                  for text in texts]
+    results = run_concurrently(__lambda_translate__, params)
+
+    for text, (resp_text, resp_status_code) in zip(texts, results):
+        assert resp_status_code == 200
+        assert json.loads(resp_text)['sentences'][0]['trans'] == text.upper()
+    assert sum(len(e['requests']) for e in events) == 3
+    assert len(events) < 3
+    assert sorted(r['method'] for e in events for r in e['requests']) == \
+        ['get', 'get', 'post']
+
+
+def test_lambda_batch_error(monkeypatch):
+    def lambda_invoke(event, exclude=()):
+        return {'FunctionError': 'Unhandled', 'Payload': io.BytesIO(
+            json.dumps({'errorMessage': 'Task timed out'}).encode('utf-8'))}
+
+    monkeypatch.setattr(app.api, 'lambda_invoke', lambda_invoke)
+    with pytest.raises(app.api.HTTPException) as e:
+        app.api.lambda_get_batch([{'url': 'https://translate.google.com'}])
+    assert e.value.status_code == 502
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+from app.api import translate
+from app.cache import DiskCache, LRUCache, TieredCache, make_cache_key, \
+    translation_cache
+
+
+def test_make_cache_key():
+    key = make_cache_key(u'Hello,  world ', 'en', 'ko', '1', 'x')
+
+    assert key == make_cache_key(u'Hello, world', 'en', 'ko', 1, 'x')
+    assert key != make_cache_key(u'Hello, world', 'en', 'ja', 1, 'x')
+    assert key != make_cache_key(u'Hello,\nworld', 'en', 'ko', 1, 'x')
+
+    # Decomposed and composed forms of the same text
+    assert make_cache_key(u'\u1100\u1161', 'ko', 'en', 1, 'x') == \
+        make_cache_key(u'\uac00', 'ko', 'en', 1, 'x')
+
+
+def test_lru_cache_eviction():
+    cache = LRUCache(max_bytes=20)
+    cache.set('a', 'aaaaaa')
+    cache.set('b', 'bbbbbb')
+    assert cache.get('a') == 'aaaaaa'
+
+    # 'b' is now the least recently used entry
+    cache.set('c', 'cccccc')
+    assert cache.get('b') is None
+    assert cache.get('a') == 'aaaaaa'
+    assert cache.get('c') == 'cccccc'
+
+    stats = cache.stats()
+    assert stats['evictions'] == 1
+    assert stats['hits'] == 3
+    assert stats['misses'] == 1
+    assert stats['bytes'] <= 20
+
+
+def test_lru_cache_expiration(clock):
+    cache = LRUCache(ttl=60, clock=clock)
+    cache.set('key', {'translated_text': 'value'})
+    assert cache.get('key') == {'translated_text': 'value'}
+
+    clock.now += 61
+    assert cache.get('key') is None
+    assert cache.stats()['expirations'] == 1
+    assert len(cache) == 0
+
+
+def test_tiered_cache(tmpdir):
+    disk = DiskCache(str(tmpdir))
+    TieredCache(LRUCache(), disk).set('key', 'value')
+
+    # A fresh memory tier falls back to the disk tier
+    memory = LRUCache()
+    cache = TieredCache(memory, disk)
+    assert cache.get('key') == 'value'
+    assert memory.get('key') == 'value'
+    assert cache.get('unknown') is None
+    assert cache.stats()['disk']['hits'] == 1
+
+
+def test_translate_cached():
+    """Cached results are served without reaching Google Translate."""
+    result = dict(id=None, request_id=None, intermediate_text=None,
+                  intermediate_raw=None, translated_text=u'안녕하세요',
+                  translated_raw=None)
+    key = make_cache_key('Hello', 'en', 'ko', '1', 'x')
+    translation_cache.set(key, result)
+    try:
+        assert translate('Hello', '1', 'en', 'ko') == result
+    finally:
+        translation_cache.clear()
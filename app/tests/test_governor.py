@@ -0,0 +1,183 @@
+import io
+import json
+import random
+
+import pytest
+
+import app.api
+from app import create_app
+from app.api import DIRECT_EGRESS, __translate__
+from app.governor import CircuitBreaker, EgressUnavailable, RateGovernor, \
+    TokenBucket, is_blocked
+from app.proxy import ProxyRegistry
+
+
+CAPTCHA = u'<html><body>Our systems have detected unusual traffic from ' \
+    u'your computer network. <img src="/sorry/image?id=1"></body></html>'
+
+
+def make_governor(clock, **kwargs):
+    return RateGovernor(clock=clock, sleep=clock.sleep, **kwargs)
+
+
+@pytest.mark.parametrize('status_code, body, expected', [
+    (200, u'{"sentences": []}', False),
+    (200, u'[[["<html>","<html>"]]]', False),
+    (429, u'', True),
+    (503, u'Service Unavailable', True),
+    (200, CAPTCHA, True),
+    (302, CAPTCHA.encode('utf-8'), True),
+    (400, u'<html><body>Bad Request</body></html>', False),
+])
+def test_is_blocked(status_code, body, expected):
+    assert is_blocked(status_code, body) == expected
+
+
+def test_token_bucket(clock):
+    bucket = TokenBucket(rate=2, burst=2, clock=clock)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.5)
+    assert bucket.reserve() == pytest.approx(1.0)
+
+    clock.now += 10
+    assert bucket.delay() == 0
+    assert bucket.tokens == 2
+
+
+def test_pacing(clock):
+    governor = make_governor(clock, rate=10, burst=1, max_pace=0.25)
+    start = clock.now
+    for _ in range(3):
+        governor.acquire('a')
+    assert clock.now - start == pytest.approx(0.2)
+
+    # Egresses are paced independently
+    governor.acquire('b')
+    assert clock.now - start == pytest.approx(0.2)
+
+    # Requests that would wait longer than `max_pace` are rejected
+    governor.reserve('a')
+    governor.reserve('a')
+    with pytest.raises(EgressUnavailable):
+        governor.reserve('a')
+    assert governor.stats()['rejected'] == 1
+
+
+def test_circuit_breaker_backoff(clock):
+    breaker = CircuitBreaker(base_delay=10, max_delay=35, clock=clock)
+    assert breaker.trip() == 10
+    assert not breaker.allows()
+
+    clock.now += 10
+    # A single probe is let through once the delay is over
+    assert breaker.acquire()
+    assert breaker.stats()['state'] == 'half-open'
+    assert not breaker.acquire()
+    assert breaker.trip() == 20
+    clock.now += 20
+    assert breaker.acquire()
+    assert breaker.trip() == 35
+
+    clock.now += 35
+    assert breaker.acquire()
+    breaker.reset()
+    assert breaker.stats() == {'state': 'closed', 'trips': 0, 'opened': 3,
+                               'retry_after': 0}
+    assert breaker.trip() == 10
+
+
+def test_governor_breaker(clock):
+    governor = make_governor(clock, base_delay=30)
+    governor.acquire('a')
+    assert not governor.record('a', 200, u'{}')
+    governor.acquire('a')
+    assert governor.record('a', 200, CAPTCHA)
+
+    with pytest.raises(EgressUnavailable) as e:
+        governor.acquire('a')
+    assert e.value.status_code == 503
+    assert e.value.headers['Retry-After'] == '30'
+    assert governor.allows('b')
+
+    stats = governor.stats()
+    assert stats['blocked'] == 1
+    assert stats['egresses']['a']['state'] == 'open'
+    assert stats['egresses']['a']['retry_after'] == 30
+
+    clock.now += 30
+    governor.acquire('a')
+    assert not governor.record('a', 200, u'{}')
+    assert governor.stats()['egresses']['a']['state'] == 'closed'
+
+
+def test_registry_skips_blocked_functions(clock):
+    governor = make_governor(clock, base_delay=30)
+    registry = ProxyRegistry(['a', 'b'], governor=governor, clock=clock,
+                             rng=random.Random(0))
+
+    class FakeLambdaClient(object):
+        def invoke(self, FunctionName, **kwargs):
+            return {'StatusCode': 200, 'Payload': io.BytesIO(b'{}')}
+
+    resp = registry.invoke(FakeLambdaClient())
+    blocked = resp['ProxyFunction']
+    assert registry.record_response(resp['ProxyFunction'], 429, u'')
+
+    for _ in range(5):
+        resp = registry.invoke(FakeLambdaClient())
+        assert resp['ProxyFunction'] != blocked
+        assert not registry.record_response(resp['ProxyFunction'], 200, u'{}')
+
+    assert registry.record_response(resp['ProxyFunction'], 200, CAPTCHA)
+    with pytest.raises(EgressUnavailable) as e:
+        registry.invoke(FakeLambdaClient())
+    assert e.value.headers['Retry-After'] == '30'
+
+
+def test_blocked_direct_egress(monkeypatch, clock):
+    """Requests shift to the proxy functions once the direct egress gets
+    blocked, and stay there while its breaker is open."""
+    governor = make_governor(clock, base_delay=30)
+    monkeypatch.setattr(app.api, 'upstream_governor', governor)
+
+    posts = []
+
+    class FakeResponse(object):
+        status_code = 200
+        text = CAPTCHA
+
+    class FakeTransport(object):
+        def post(self, url, headers, data):
+            posts.append(data['text'])
+            return FakeResponse()
+
+    monkeypatch.setattr(app.api, 'get_transport', lambda: FakeTransport())
+
+    proxied = []
+
+    def lambda_get(url, params={}, data={}, headers={}, passthrough=False,
+                   exclude=(), method='get', encoding=None):
+        # Long texts are posted as form data
+        q = params.get('q', data.get('q'))
+        proxied.append(q if method == 'get' else (method, q))
+        body = {'sentences': [{'trans': q.upper()}]}
+        payload = {'text': json.dumps(body), 'status_code': 200}
+        return {'Payload': io.BytesIO(json.dumps(payload).encode('utf-8'))}
+
+    monkeypatch.setattr(app.api, 'lambda_get', lambda_get)
+
+    with create_app(config={'DEBUG': True}).test_request_context():
+        assert __translate__(u'hello', 'en', 'ko') == u'HELLO'
+        assert __translate__(u'world', 'en', 'ko') == u'WORLD'
+        assert posts == [u'hello']
+        assert proxied == [u'hello', u'world']
+        assert governor.stats()['egresses'][DIRECT_EGRESS]['state'] == 'open'
+
+        long_text = u'long text ' * 200
+        assert __translate__(long_text, 'en', 'ko') == long_text.upper()
+        assert proxied[-1] == ('post', long_text)
+
+        # Other clients cannot be served by the proxy functions
+        with pytest.raises(EgressUnavailable):
+            __translate__(u'hello', 'en', 'ko', client='t')
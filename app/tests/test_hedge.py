@@ -0,0 +1,169 @@
+import io
+import random
+import threading
+
+import pytest
+
+from app.hedge import Hedger
+from app.proxy import ProxyRegistry
+
+
+class FakeLambdaClient(object):
+    """Invocations block until `release` is set, unless they are fast."""
+
+    def __init__(self, slow=1):
+        self.slow = slow
+        self.invocations = []
+        self.release = threading.Event()
+        self._lock = threading.Lock()
+
+    def invoke(self, FunctionName, **kwargs):
+        with self._lock:
+            self.invocations.append(FunctionName)
+            slow = len(self.invocations) <= self.slow
+        if slow:
+            self.release.wait(5)
+        return {'StatusCode': 200, 'Payload': io.BytesIO(b'{}')}
+
+
+def make_hedger(**kwargs):
+    hedger = Hedger(min_samples=1, min_delay=0.01, **kwargs)
+    hedger.observe(0.01)
+    return hedger
+
+
+def make_registry():
+    return ProxyRegistry(['a', 'b'], rng=random.Random(0))
+
+
+def test_delay():
+    hedger = Hedger(percentile=0.9, min_delay=0.05, window=10,
+                    min_samples=10)
+    for i in range(9):
+        hedger.observe(i / 10.0)
+    assert hedger.delay() is None
+
+    hedger.observe(0.9)
+    assert hedger.delay() == pytest.approx(0.8)
+
+    for _ in range(10):
+        hedger.observe(0.0)
+    assert hedger.delay() == 0.05
+
+
+def test_hedge_wins():
+    hedger = make_hedger()
+    registry = make_registry()
+    client = FakeLambdaClient()
+    try:
+        resp = hedger.invoke(registry, client, Payload='{}')
+    finally:
+        client.release.set()
+
+    primary, hedge = client.invocations
+    assert primary != hedge
+    assert resp['ProxyFunction'] == hedge
+    stats = hedger.stats()
+    assert (stats['fired'], stats['won'], stats['skipped']) == (1, 1, 0)
+
+
+def test_no_hedge_for_fast_requests():
+    hedger = make_hedger()
+    hedger.min_delay = 1
+    registry = make_registry()
+    client = FakeLambdaClient(slow=0)
+    for _ in range(3):
+        hedger.invoke(registry, client, Payload='{}')
+
+    assert len(client.invocations) == 3
+    assert hedger.stats()['fired'] == 0
+
+
+def test_budget():
+    """Hedges are skipped once the budget is used up."""
+    hedger = make_hedger(budget=0, burst=1)
+    registry = make_registry()
+    client = FakeLambdaClient(slow=1)
+    try:
+        hedger.invoke(registry, client, Payload='{}')
+    finally:
+        client.release.set()
+
+    client.slow = 3
+    client.release.clear()
+    timer = threading.Timer(0.1, client.release.set)
+    timer.start()
+    hedger.invoke(registry, client, Payload='{}')
+    timer.join()
+
+    assert len(client.invocations) == 3
+    stats = hedger.stats()
+    assert (stats['requests'], stats['fired'], stats['skipped']) == (2, 1, 1)
+
+
+def test_hedge_on_failure():
+    """The hedge is taken when the primary invocation fails after it has
+    been hedged, and the error is raised when an invocation fails before."""
+    hedger = make_hedger()
+    registry = make_registry()
+
+    class FailingClient(FakeLambdaClient):
+        def invoke(self, FunctionName, **kwargs):
+            resp = super(FailingClient, self).invoke(FunctionName, **kwargs)
+            if FunctionName == self.invocations[0]:
+                raise RuntimeError('boom')
+            return resp
+
+    client = FailingClient(slow=2)
+    timer = threading.Timer(0.1, client.release.set)
+    timer.start()
+    resp = hedger.invoke(registry, client, Payload='{}')
+    timer.join()
+    assert resp['ProxyFunction'] == client.invocations[1]
+    assert hedger.stats()['won'] == 1
+
+    client = FailingClient(slow=0)
+    with pytest.raises(RuntimeError):
+        hedger.invoke(registry, client, Payload='{}')
+    assert len(client.invocations) == 1
+
+
+def test_failed_loser_is_cancelled_once():
+    """A losing invocation which fails is given back to the governor by the
+    registry alone, and one which succeeds by the hedger."""
+
+    class FakeGovernor(object):
+        def __init__(self):
+            self.cancelled = []
+
+        def allows(self, name):
+            return True
+
+        def acquire(self, name):
+            pass
+
+        def cancel(self, name):
+            self.cancelled.append(name)
+
+    class FailingClient(FakeLambdaClient):
+        def invoke(self, FunctionName, **kwargs):
+            resp = super(FailingClient, self).invoke(FunctionName, **kwargs)
+            if self.fail and FunctionName == self.invocations[0]:
+                raise RuntimeError('boom')
+            return resp
+
+    for fail in (True, False):
+        hedger = make_hedger()
+        registry = make_registry()
+        registry.governor = FakeGovernor()
+        client = FailingClient()
+        client.fail = fail
+        try:
+            resp = hedger.invoke(registry, client, Payload='{}')
+        finally:
+            client.release.set()
+        hedger.get_executor().shutdown(wait=True)
+
+        primary, hedge = client.invocations
+        assert resp['ProxyFunction'] == hedge
+        assert registry.governor.cancelled == [primary]
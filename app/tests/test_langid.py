@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+import pytest
+
+import app.api
+from app.api import translate
+from app.cache import translation_cache
+from app.langid import LanguageIdentifier, SourceResolver, source_resolver
+
+
+identifier = source_resolver.identifier
+
+
+@pytest.mark.parametrize('text, language', [
+    (u'The weather is nice today, so we are going to the park.', 'en'),
+    (u'Me gustaría saber dónde está la estación de tren.', 'es'),
+    (u'Je voudrais réserver une table pour deux personnes ce soir.', 'fr'),
+    (u'Ich möchte gerne einen Tisch für zwei Personen reservieren.', 'de'),
+    (u'Oggi il tempo è bello, quindi andiamo al parco.', 'it'),
+    (u'Saya ingin memesan meja untuk dua orang malam ini.', 'id'),
+    (u'Hôm nay thời tiết đẹp, vì vậy chúng tôi sẽ đi công viên.', 'vi'),
+    (u'Dzisiaj jest ładna pogoda, więc idziemy do parku.', 'pl'),
+    (u'Jag vill gärna boka ett rum för två nätter.', 'sv'),
+    (u'Szeretnék asztalt foglalni két személyre ma estére.', 'hu'),
+    (u'Bugün hava çok güzel, bu yüzden parka gidiyoruz.', 'tr'),
+    (u'오늘 날씨가 좋아서 공원에 갑니다.', 'ko'),
+    (u'今日は天気がいいので公園に行きます。', 'ja'),
+    (u'東京都千代田区丸の内一丁目', 'ja'),
+    (u'Сегодня хорошая погода, поэтому мы идём в парк.', 'ru'),
+    (u'วันนี้อากาศดี เราจึงไปสวนสาธารณะ', 'th'),
+    (u'الطقس جميل اليوم، لذلك سنذهب إلى الحديقة.', 'ar'),
+    (u'מזג האוויר נעים היום, אז אנחנו הולכים לפארק.', 'iw'),
+])
+def test_identify(text, language):
+    assert identifier.identify(text)[0] == language
+    assert source_resolver.resolve(text, 'auto') == language
+
+
+@pytest.mark.parametrize('text', [u'Hello', u'東京', u'12345', u''])
+def test_identify_unsure(text):
+    """Texts too short to tell are left to Google Translate."""
+    assert source_resolver.resolve(text, 'auto') == 'auto'
+
+
+@pytest.mark.parametrize('text', [
+    # Ukrainian, Persian, Danish, Norwegian and Slovak
+    u'Сьогодні гарна погода, тому ми йдемо до парку.',
+    u'امروز هوا خوب است، بنابراین به پارک می‌رویم.',
+    u'Jeg vil gerne bestille et bord til to personer i aften.',
+    u'Jeg vil gjerne bestille et bord for to personer i kveld.',
+    u'Chcel by som si rezervovať stôl pre dve osoby na dnes večer.',
+    # Japanese and Chinese in Han characters alone
+    u'東京都千代田区',
+    u'今天天气很好，所以我们去公园散步。',
+])
+def test_identify_unsupported(text):
+    """Texts in languages that are not supported, or that cannot be told
+    from one another, are not taken for the closest supported language."""
+    assert identifier.identify(text)[0] is None
+    assert source_resolver.resolve(text, 'auto') == 'auto'
+
+
+def test_classify():
+    identifier = LanguageIdentifier(
+        ['xa', 'xb'], (1, 2), 1, [5, 5],
+        {u'a': [1, None], u'b': [None, 1], u'ab': [1, 3]})
+    assert identifier.classify(u'zzz') == []
+
+    (first, p), (second, q) = identifier.classify(u'aab')
+    assert (first, second) == ('xa', 'xb')
+    assert p > q
+    assert p + q == pytest.approx(1.0)
+
+    identifier.others = frozenset(['xa'])
+    assert identifier.identify(u'aab') == (None, 0.0)
+    assert identifier.identify(u'bba')[0] == 'xb'
+
+
+def test_resolver():
+    resolver = SourceResolver(identifier, min_confidence=0.9)
+    text = u'Ich möchte gerne einen Tisch für zwei Personen reservieren.'
+    assert resolver.resolve(text, 'en') == 'en'
+    assert resolver.resolve(text, 'auto') == 'de'
+    assert resolver.stats()['resolved'] == 1
+
+    assert SourceResolver(None).resolve(text, 'auto') == 'auto'
+    assert SourceResolver(identifier, enabled=False).resolve(
+        text, 'auto') == 'auto'
+
+
+def test_translate_auto_same_language(testapp, monkeypatch):
+    """A text identified to be in the target language is not sent
+    upstream."""
+    def fail(*args, **kwargs):
+        raise AssertionError('Unexpected upstream request')
+
+    monkeypatch.setattr(app.api, '__translate__', fail)
+    monkeypatch.setattr(app.api, 'lambda_get', fail)
+
+    text = u'오늘 날씨가 좋아서 공원에 갑니다.'
+    with testapp.application.test_request_context():
+        assert translate(text, '1', 'auto', 'ko')['translated_text'] == text
+
+    resp = testapp.get('/api/v1.3/translate', query_string={
+        'text': text, 'source': 'auto', 'target': 'ko'})
+    assert resp.status_code == 200
+    result = json.loads(resp.get_data(as_text=True))
+    assert result['src'] == 'ko'
+    assert result['sentences'][0]['trans'] == text
+
+
+def test_translate_auto(testapp, monkeypatch):
+    """A text identified locally shares the cache entries of requests of its
+    source language."""
+    calls = []
+
+    def fake_translate(text, source, target, client, user_agent):
+        calls.append((source, target))
+        return u'[{}] {}'.format(target, text)
+
+    monkeypatch.setattr(app.api, '__translate__', fake_translate)
+
+    text = u'Ich möchte gerne einen Tisch für zwei Personen reservieren.'
+    try:
+        with testapp.application.test_request_context():
+            assert translate(text, '1', 'auto', 'en')['translated_text'] == \
+                u'[en] ' + text
+            assert translate(text, '1', 'de', 'en')['translated_text'] == \
+                u'[en] ' + text
+        assert calls == [('de', 'en')]
+    finally:
+        translation_cache.clear()
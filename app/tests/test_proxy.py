@@ -0,0 +1,141 @@
+import io
+import json
+import random
+
+import pytest
+
+from app.proxy import ProxyRegistry
+
+
+class ThrottlingError(Exception):
+    response = {'Error': {'Code': 'TooManyRequestsException'}}
+
+
+class FakeLambdaClient(object):
+    """A local stand-in for the `invoke()` API of the boto3 Lambda client.
+
+    :param latencies: simulated latency of each function
+    :param failing: names of functions which return a function error
+    :param throttled: names of functions which raise a throttling error
+    :param relaying: names of functions which relay an error response of
+                     Google Translate in the pass-through mode
+    """
+
+    def __init__(self, clock, latencies, failing=(), throttled=(),
+                 relaying=()):
+        self.clock = clock
+        self.latencies = latencies
+        self.failing = set(failing)
+        self.throttled = set(throttled)
+        self.relaying = set(relaying)
+        self.invocations = []
+
+    def invoke(self, FunctionName, **kwargs):
+        self.invocations.append(FunctionName)
+        self.clock.now += self.latencies[FunctionName]
+
+        if FunctionName in self.throttled:
+            raise ThrottlingError('Rate exceeded')
+
+        resp = {
+            'StatusCode': 200,
+            'Payload': io.BytesIO(json.dumps(
+                {'text': '{}', 'status_code': 200}).encode('utf-8')),
+        }
+        if FunctionName in self.failing:
+            resp['FunctionError'] = 'Unhandled'
+        if FunctionName in self.relaying:
+            resp['FunctionError'] = 'Unhandled'
+            resp['Payload'] = io.BytesIO(json.dumps({
+                'errorMessage': json.dumps({'text': 'Bad Request',
+                                            'status_code': 400}),
+                'errorType': 'UpstreamError'}).encode('utf-8'))
+        return resp
+
+
+def make_registry(clock, names=('web_proxy', 'web_proxy2')):
+    return ProxyRegistry(list(names), ejection_time=30, clock=clock,
+                         rng=random.Random(0))
+
+
+def test_prefers_faster_function(clock):
+    registry = make_registry(clock)
+    client = FakeLambdaClient(clock, {'web_proxy': 2.0, 'web_proxy2': 0.1})
+
+    for _ in range(50):
+        registry.invoke(client, Payload='{}')
+
+    assert client.invocations.count('web_proxy2') > 45
+    assert registry['web_proxy2'].latency == pytest.approx(0.1)
+
+
+def test_ejects_throttled_function(clock):
+    registry = make_registry(clock)
+    client = FakeLambdaClient(clock, {'web_proxy': 0.1, 'web_proxy2': 0.1},
+                              throttled=['web_proxy'])
+
+    with pytest.raises(ThrottlingError):
+        registry.invoke(client, exclude=['web_proxy2'], Payload='{}')
+
+    stats = registry.stats()
+    assert stats['web_proxy']['throttles'] == 1
+    assert stats['web_proxy']['ejected']
+
+    client.invocations = []
+    for _ in range(10):
+        registry.invoke(client, Payload='{}')
+    assert client.invocations == ['web_proxy2'] * 10
+
+    # The function is back in rotation after the ejection time
+    clock.now += 30
+    assert not registry.stats()['web_proxy']['ejected']
+
+
+def test_ejects_failing_function(clock):
+    registry = make_registry(clock, names=['web_proxy', 'web_proxy2',
+                                           'web_proxy3'])
+    client = FakeLambdaClient(
+        clock, {'web_proxy': 0.1, 'web_proxy2': 0.1, 'web_proxy3': 0.1},
+        failing=['web_proxy3'])
+
+    for _ in range(100):
+        registry.invoke(client, Payload='{}')
+
+    # Errors make the function expensive, so it is rarely chosen
+    assert registry.stats()['web_proxy3']['requests'] < 10
+
+    for _ in range(5):
+        registry.invoke(client, exclude=['web_proxy', 'web_proxy2'],
+                        Payload='{}')
+
+    stats = registry.stats()
+    assert stats['web_proxy3']['ejections'] >= 1
+    assert stats['web_proxy3']['ejected']
+
+
+def test_relayed_error_is_not_a_failure(clock):
+    registry = make_registry(clock)
+    client = FakeLambdaClient(clock, {'web_proxy': 0.1, 'web_proxy2': 0.1},
+                              relaying=['web_proxy'])
+
+    for _ in range(20):
+        resp = registry.invoke(client, exclude=['web_proxy2'], Payload='{}')
+    # The relayed response is still there for the caller
+    assert json.loads(resp['Payload'].read().decode('utf-8'))['errorType'] \
+        == 'UpstreamError'
+
+    stats = registry.stats()
+    assert stats['web_proxy']['errors'] == 0
+    assert not stats['web_proxy']['ejected']
+
+
+def test_all_functions_ejected(clock):
+    registry = make_registry(clock, names=['web_proxy'])
+    client = FakeLambdaClient(clock, {'web_proxy': 0.1},
+                              throttled=['web_proxy'])
+
+    with pytest.raises(ThrottlingError):
+        registry.invoke(client, Payload='{}')
+
+    # Rather than failing every request, the ejected function is still used
+    assert registry.choose().name == 'web_proxy'
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+import app.api
+from app import create_app
+from app.api import translate
+from app.cache import translation_cache
+from app.segment import join_sentences, pack_sentences, split_chunks, \
+    split_sentences
+
+
+@pytest.mark.parametrize('text, language, expected', [
+    (u'Hello world. How are you? Fine!', 'en',
+     [(u'Hello world.', u' '), (u'How are you?', u' '), (u'Fine!', u'')]),
+    (u'Mr. Kim visited google.com at 3.14 pm.', 'en',
+     [(u'Mr. Kim visited google.com at 3.14 pm.', u'')]),
+    (u'今日は晴れ。明日は雨です！', 'ja',
+     [(u'今日は晴れ。', u''), (u'明日は雨です！', u'')]),
+    (u'我很好。你呢？', 'zh-CN', [(u'我很好。', u''), (u'你呢？', u'')]),
+    (u'The answer is no. We left. See No. 5 below.', 'en',
+     [(u'The answer is no.', u' '), (u'We left.', u' '),
+      (u'See No. 5 below.', u'')]),
+    (u'สวัสดีครับ ผมชื่อสมชาย', 'th', [(u'สวัสดีครับ ผมชื่อสมชาย', u'')]),
+    (u'สวัสดีครับ  ผมชื่อสมชาย\nขอบคุณ', 'th',
+     [(u'สวัสดีครับ', u'  '), (u'ผมชื่อสมชาย', u'\n'), (u'ขอบคุณ', u'')]),
+    (u'  First.\n\nSecond.', 'auto',
+     [(u'', u'  '), (u'First.', u'\n\n'), (u'Second.', u'')]),
+])
+def test_split_sentences(text, language, expected):
+    segments = split_sentences(text, language)
+    assert segments == expected
+    assert ''.join(s + t for s, t in segments) == text
+
+
+def test_join_sentences():
+    assert join_sentences([u'A.', u'B.'], [u'', u''], 'en') == u'A. B.'
+    assert join_sentences([u'A。', u'B。'], [u' ', u''], 'ja') == u'A。B。'
+    assert join_sentences([u'A.', u'B.'], [u'\n', u''], 'ja') == u'A.\nB.'
+
+
+def test_pack_sentences():
+    sentences = ['a' * 4, 'b' * 4, 'c' * 10, 'd' * 2]
+    assert pack_sentences(sentences, 9) == [[0, 1], [2], [3]]
+    assert pack_sentences(sentences, 100) == [[0, 1, 2, 3]]
+    assert pack_sentences([], 100) == []
+
+
+def test_translate_sentences(monkeypatch):
+    """Only sentences that have not been translated before go upstream, all
+    in a single request."""
+    upstream = []
+
+    def fake_translate(text, source, target, client, user_agent):
+        upstream.append(text)
+        return text.upper()
+
+    monkeypatch.setattr(app.api, '__translate__', fake_translate)
+
+    with create_app(config={'DEBUG': True}).test_request_context():
+        try:
+            result = translate(u'One. Two. Three.', '1', 'en', 'ko')
+            assert result['translated_text'] == u'ONE. TWO. THREE.'
+            assert upstream == [u'One.\nTwo.\nThree.']
+
+            result = translate(u'One. Two. Four. Five.', '1', 'en', 'ko')
+            assert result['translated_text'] == u'ONE. TWO. FOUR. FIVE.'
+            assert upstream[1:] == [u'Four.\nFive.']
+        finally:
+            translation_cache.clear()
+
+
+def test_split_chunks():
+    text = u'One two. Three four. Five six.\n\nSeven eight.'
+    chunks = split_chunks(text, 'en', 20)
+    assert chunks == [(u'One two. Three four.', u' '),
+                      (u'Five six.', u'\n\n'),
+                      (u'Seven eight.', u'')]
+    assert ''.join(c + s for c, s in chunks) == text
+
+    assert split_chunks(text, 'en', 1000) == [(text, u'')]
+
+
+def test_split_chunks_long_sentence():
+    text = u'A very long sentence without any terminator ' * 3
+    chunks = split_chunks(text.strip(), 'en', 30)
+    assert all(len(c) <= 30 for c, s in chunks)
+    assert ''.join(c + s for c, s in chunks) == text.strip()
+
+    assert split_chunks(u'x' * 25, 'en', 10) == \
+        [(u'x' * 10, u''), (u'x' * 10, u''), (u'x' * 5, u'')]
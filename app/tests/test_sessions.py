@@ -0,0 +1,58 @@
+from app.sessions import SessionStore
+
+
+def test_session_store():
+    store = SessionStore(max_sessions=10, ttl=60)
+    languages = ('en', '', 'ko')
+    assert store.get('a', languages) == {}
+
+    store.set('a', languages, {u'One.': (None, u'하나.')})
+    assert store.get('a', languages) == {u'One.': (None, u'하나.')}
+    assert store.get('a', ('en', 'ja', 'ko')) == {}
+    assert (store.stats()['hits'], store.stats()['misses']) == (1, 2)
+
+
+def test_session_lru():
+    store = SessionStore(max_sessions=2, ttl=60)
+    languages = ('en', '', 'ko')
+    store.set('a', languages, {'a': (None, 'a')})
+    store.set('b', languages, {'b': (None, 'b')})
+    store.get('a', languages)
+    store.set('c', languages, {'c': (None, 'c')})
+
+    assert store.get('b', languages) == {}
+    assert store.get('a', languages) != {}
+    assert store.get('c', languages) != {}
+    assert store.stats()['sessions'] == 2
+    assert store.stats()['evictions'] == 1
+
+
+def test_session_size():
+    store = SessionStore(max_chars=10, ttl=60)
+    languages = ('en', '', 'ko')
+    store.set('a', languages, {'aa': (None, 'aa')})
+    store.set('b', languages, {'bb': (None, 'bb')})
+    assert store.stats()['chars'] == 8
+
+    # The least recently used session makes room for a new one
+    store.set('c', languages, {'c': ('c', 'c')})
+    assert store.get('a', languages) == {}
+    assert store.stats()['chars'] == 7
+
+    # A session too large to keep replaces nothing but itself
+    store.set('b', languages, {'b' * 10: (None, 'b')})
+    assert store.get('b', languages) == {}
+    assert store.get('c', languages) != {}
+    assert store.stats()['chars'] == 3
+
+
+def test_session_ttl(clock):
+    store = SessionStore(ttl=60, clock=clock)
+    languages = ('en', '', 'ko')
+    store.set('a', languages, {'a': (None, 'a')})
+
+    clock.now += 59
+    assert store.get('a', languages) != {}
+    clock.now += 2
+    assert store.get('a', languages) == {}
+    assert store.stats()['sessions'] == 0
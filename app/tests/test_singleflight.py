@@ -0,0 +1,53 @@
+import threading
+import time
+
+import pytest
+
+from app.singleflight import SingleFlight
+
+
+def run_concurrently(flight, key, fn, count):
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+        flight.do(key, fn))) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def test_coalescing():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return {'translated_text': 'value'}
+
+    threads, results = run_concurrently(flight, 'key', fetch, 10)
+    # Wait until all followers are waiting on the leader
+    while flight.stats()['coalesced'] < 9:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [{'translated_text': 'value'}] * 10
+    assert flight.stats() == {'calls': 1, 'coalesced': 9, 'in_flight': 0}
+
+    # Calls made after completion are not coalesced
+    assert flight.do('key', fetch) == {'translated_text': 'value'}
+    assert len(calls) == 2
+
+
+def test_error_propagation():
+    flight = SingleFlight()
+
+    def fail():
+        raise ValueError('Upstream failure')
+
+    with pytest.raises(ValueError):
+        flight.do('key', fail)
+    assert flight.stats()['in_flight'] == 0
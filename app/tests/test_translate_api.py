@@ -1,9 +1,18 @@
 # -*- coding: utf-8 -*-
 
+import app.api
+from app import MAX_TEXT_LENGTH, create_app
+from app.admission import current_flow
 from app.api import translate, HTTPException
+from app.cache import make_cache_key, translation_cache
 
+import base64
+import io
 import pytest
 import json
+import threading
+import time
+import zlib
 
 
 def test_translate_1():
@@ -101,3 +110,641 @@ def test_translate_v1_3_1(testapp):
     assert 'programador' in sentences
     assert 'experiencia' in sentences
     assert 'lenguajes' in sentences
+
+
+def fake_lambda_get(calls, fields=None):
+    """Returns a stand-in for `lambda_get()` which 'translates' a text by
+    tagging it with the target language."""
+
+    def lambda_get(url, params={}, data={}, headers={}, passthrough=False,
+                   exclude=(), method='get', encoding=None):
+        calls.append((params['sl'], params['tl']))
+        if fields is not None:
+            fields.append(params['dt'])
+        body = {'sentences': [{'trans': u'[{}] {}'.format(params['tl'],
+                                                          params['q'])}]}
+        payload = {'text': json.dumps(body), 'status_code': 200}
+        return {'Payload': io.BytesIO(json.dumps(payload).encode('utf-8'))}
+
+    return lambda_get
+
+
+def test_translate_v1_3_intermediate(testapp, monkeypatch):
+    calls = []
+    monkeypatch.setattr(app.api, 'lambda_get', fake_lambda_get(calls))
+
+    params = {
+        'text': 'Pivot translation',
+        'source': 'en',
+        'intermediate': 'ja',
+        'target': 'ko',
+    }
+    try:
+        resp = testapp.post('/api/v1.3/translate', data=params)
+    finally:
+        translation_cache.clear()
+    assert resp.status_code == 200
+    assert calls == [('en', 'ja'), ('ja', 'ko')]
+
+    resp_data = json.loads(resp.get_data(as_text=True))
+    assert resp_data['sentences'][0]['trans'] == \
+        '[ko] [ja] Pivot translation'
+    assert resp_data['intermediate']['sentences'][0]['trans'] == \
+        '[ja] Pivot translation'
+
+
+def test_translate_v1_3_fields(testapp, monkeypatch):
+    calls, fields = [], []
+    monkeypatch.setattr(app.api, 'lambda_get', fake_lambda_get(calls, fields))
+
+    params = {
+        'text': 'Field projection',
+        'source': 'en',
+        'target': 'ko',
+    }
+    try:
+        resp = testapp.post('/api/v1.3/translate', data=params)
+        assert resp.status_code == 200
+
+        params['fields'] = 'rm,t'
+        resp = testapp.post('/api/v1.3/translate', data=params)
+        assert resp.status_code == 200
+
+        # The first hop always asks for the translated text
+        params.update(fields='rm', intermediate='ja')
+        resp = testapp.post('/api/v1.3/translate', data=params)
+        assert resp.status_code == 200
+    finally:
+        translation_cache.clear()
+
+    assert fields == [['t', 'ld', 'qc', 'rm', 'bd'], ['t', 'rm'],
+                      ['t', 'rm'], ['rm']]
+
+    params['fields'] = 't,xx'
+    resp = testapp.post('/api/v1.3/translate', data=params)
+    assert resp.status_code == 400
+
+
+def test_translate_v1_3_passthrough(testapp, monkeypatch):
+    body = b'{"sentences": [{"trans": "\\uc548\\ub155"}]}'
+    responses = [
+        {'Payload': io.BytesIO(body)},
+        {'FunctionError': 'Unhandled', 'Payload': io.BytesIO(json.dumps({
+            'errorMessage': json.dumps({'text': 'Captcha',
+                                        'status_code': 503}),
+            'errorType': 'UpstreamError'}).encode('utf-8'))},
+        {'FunctionError': 'Unhandled', 'Payload': io.BytesIO(json.dumps({
+            'errorMessage': 'Task timed out'}).encode('utf-8'))},
+    ]
+
+    def lambda_get(url, params={}, data={}, headers={}, passthrough=False,
+                   exclude=(), method='get', encoding=None):
+        assert passthrough
+        return responses.pop(0)
+
+    monkeypatch.setattr(app.api, 'lambda_get', lambda_get)
+    monkeypatch.setattr(app.api.proxy_registry, 'passthrough', True)
+
+    params = {'text': 'Hello', 'source': 'en', 'target': 'ko'}
+    try:
+        resp = testapp.post('/api/v1.3/translate', data=params)
+        assert resp.status_code == 200
+        assert resp.get_data() == body
+
+        # Served from the cache
+        resp = testapp.post('/api/v1.3/translate', data=params)
+        assert resp.status_code == 200
+        assert json.loads(resp.get_data(as_text=True)) == json.loads(body)
+
+        params['text'] = 'Captcha'
+        resp = testapp.post('/api/v1.3/translate', data=params)
+        assert resp.status_code == 503
+        assert resp.get_data(as_text=True) == 'Captcha'
+
+        params['text'] = 'Timeout'
+        resp = testapp.post('/api/v1.3/translate', data=params)
+        assert resp.status_code == 502
+    finally:
+        translation_cache.clear()
+
+
+def test_translate_v1_3_compressed(testapp, monkeypatch):
+    body = b'{"sentences": [{"trans": "\\uc548\\ub155"}]}'
+    events = []
+
+    def lambda_get(url, params={}, data={}, headers={}, passthrough=False,
+                   exclude=(), method='get', encoding=None):
+        events.append((passthrough, encoding))
+        content = {'status_code': 200,
+                   'headers': {'Content-Type': 'application/json'},
+                   'encoding': 'zlib',
+                   'body': base64.b64encode(zlib.compress(body)).decode()}
+        return {'Payload': io.BytesIO(json.dumps(content).encode('utf-8'))}
+
+    monkeypatch.setattr(app.api, 'lambda_get', lambda_get)
+    monkeypatch.setattr(app.api.proxy_registry, 'passthrough', True)
+    monkeypatch.setattr(app.api.proxy_registry, 'encoding', 'zlib')
+
+    params = {'text': 'Hello', 'source': 'en', 'target': 'ko'}
+    try:
+        resp = testapp.post('/api/v1.3/translate', data=params)
+    finally:
+        translation_cache.clear()
+    assert resp.status_code == 200
+    assert resp.get_data() == body
+    assert events == [(False, 'zlib')]
+
+
+def test_read_lambda_body():
+    """Proxy functions that do not support compression answer with text."""
+    assert app.api.read_lambda_body({'text': u'Captcha',
+                                     'status_code': 503}) == (u'Captcha', 503)
+    with pytest.raises(HTTPException):
+        app.api.read_lambda_body({'status_code': 200, 'encoding': 'br',
+                                  'body': ''})
+
+
+def test_translate_v1_3_pivots(testapp, monkeypatch):
+    """The direct translation and the pivot translations run concurrently,
+    and each is streamed as soon as it completes."""
+    calls = []
+    spans = {}
+    classes = set()
+    fake = fake_lambda_get(calls)
+
+    def lambda_get(url, params={}, **kwargs):
+        start = time.time()
+        # Paths via Russian are slower than the others
+        time.sleep(0.3 if 'ru' in (params['sl'], params['tl']) else 0.1)
+        spans[(params['sl'], params['tl'])] = (start, time.time())
+        classes.add(current_flow()[0])
+        return fake(url, params, **kwargs)
+
+    monkeypatch.setattr(app.api, 'lambda_get', lambda_get)
+
+    params = {'text': 'Hello', 'source': 'en', 'target': 'ko'}
+    try:
+        resp = testapp.post('/api/v1.3/translate/pivots', data=params)
+        records = [json.loads(line) for line in
+                   resp.get_data(as_text=True).splitlines()]
+    finally:
+        translation_cache.clear()
+
+    assert resp.status_code == 200
+    assert resp.mimetype == 'application/x-ndjson'
+    assert len(calls) == 5
+    # The first hops of all paths overlap
+    first_hops = [spans[('en', target)] for target in ('ko', 'ja', 'ru')]
+    assert max(start for start, end in first_hops) < \
+        min(end for start, end in first_hops)
+    assert classes == {'api'}
+
+    assert [r.get('intermediate') for r in records] == ['', 'ja', 'ru', None]
+    assert records[-1] == {'done': True, 'count': 3}
+    direct, ja, ru = records[:3]
+    assert direct['result']['sentences'][0]['trans'] == u'[ko] Hello'
+    assert ja['result']['sentences'][0]['trans'] == u'[ko] [ja] Hello'
+    assert ja['result']['intermediate']['sentences'][0]['trans'] == \
+        u'[ja] Hello'
+    assert ru['status_code'] == 200
+
+
+def test_translate_v1_3_pivots_json(testapp, monkeypatch):
+    calls = []
+    monkeypatch.setattr(app.api, 'lambda_get', fake_lambda_get(calls))
+
+    params = {'text': 'Hello', 'source': 'ja', 'target': 'ko',
+              'format': 'json', 'fields': 't'}
+    try:
+        resp = testapp.get('/api/v1.3/translate/pivots', query_string=params)
+    finally:
+        translation_cache.clear()
+    assert resp.status_code == 200
+    results = json.loads(resp.get_data(as_text=True))['results']
+    assert [r['intermediate'] for r in results] == ['', 'ru']
+    assert [r['status_code'] for r in results] == [200, 200]
+
+    params['format'] = 'xml'
+    resp = testapp.get('/api/v1.3/translate/pivots', query_string=params)
+    assert resp.status_code == 400
+
+
+def test_translate_v1_3_session(testapp, monkeypatch):
+    """Only the sentences edited since the previous request of a session
+    are translated."""
+    texts = []
+
+    def lambda_get(url, params={}, **kwargs):
+        texts.append((params['tl'], params['q']))
+        trans = '\n'.join(u'[{}] {}'.format(params['tl'], line)
+                          for line in params['q'].split('\n'))
+        body = {'sentences': [{'trans': trans}]}
+        payload = {'text': json.dumps(body), 'status_code': 200}
+        return {'Payload': io.BytesIO(json.dumps(payload).encode('utf-8'))}
+
+    monkeypatch.setattr(app.api, 'lambda_get', lambda_get)
+
+    def post(text, **kwargs):
+        params = dict(text=text, source='en', target='ko', session='s1',
+                      **kwargs)
+        resp = testapp.post('/api/v1.3/translate', data=params)
+        assert resp.status_code == 200
+        return json.loads(resp.get_data(as_text=True))
+
+    try:
+        result = post(u'One. Two.\nThree.')
+        assert result['sentences'][0]['trans'] == \
+            u'[ko] One. [ko] Two.\n[ko] Three.'
+        assert result['session'] == {'token': 's1', 'translated': 3,
+                                     'reused': 0}
+        assert texts == [('ko', u'One.\nTwo.\nThree.')]
+
+        result = post(u'One. Two more.\nThree.')
+        assert result['sentences'][0]['trans'] == \
+            u'[ko] One. [ko] Two more.\n[ko] Three.'
+        assert result['session']['translated'] == 1
+        assert result['session']['reused'] == 2
+        assert texts[1:] == [('ko', u'Two more.')]
+
+        # Translations via an intermediate language are not reused
+        del texts[:]
+        result = post(u'One. Two more.', intermediate='ja')
+        assert result['sentences'][0]['trans'] == \
+            u'[ko] [ja] One. [ko] [ja] Two more.'
+        assert result['intermediate']['sentences'][0]['trans'] == \
+            u'[ja] One.[ja] Two more.'
+        assert result['session']['translated'] == 2
+        assert texts == [('ja', u'One.\nTwo more.'),
+                         ('ko', u'[ja] One.\n[ja] Two more.')]
+    finally:
+        translation_cache.clear()
+
+    resp = testapp.post('/api/v1.3/translate', data={
+        'text': 'One.', 'source': 'en', 'target': 'ko', 'session': 'x' * 129})
+    assert resp.status_code == 400
+
+    resp = testapp.post('/api/v1.3/translate', data={
+        'text': 'x' * (MAX_TEXT_LENGTH + 1), 'source': 'en', 'target': 'ko',
+        'session': 's1'})
+    assert resp.status_code == 413
+
+
+def test_translate_v1_3_session_unaligned(testapp, monkeypatch):
+    """Sentences are translated one by one when the lines of a batch do not
+    align, and the translation of a sentence is kept whole even if it is
+    broken into lines."""
+    texts = []
+
+    def lambda_get(url, params={}, **kwargs):
+        texts.append(params['q'])
+        # Lines are joined, and a single line is broken in two
+        trans = u' '.join(params['q'].split('\n')) \
+            if '\n' in params['q'] else params['q'].replace(u' ', u'\n', 1)
+        body = {'sentences': [{'trans': trans}]}
+        payload = {'text': json.dumps(body), 'status_code': 200}
+        return {'Payload': io.BytesIO(json.dumps(payload).encode('utf-8'))}
+
+    monkeypatch.setattr(app.api, 'lambda_get', lambda_get)
+
+    params = {'text': u'Number one. Number two.', 'source': 'en',
+              'target': 'ko', 'session': 's2'}
+    try:
+        resp = testapp.post('/api/v1.3/translate', data=params)
+    finally:
+        translation_cache.clear()
+    assert resp.status_code == 200
+    result = json.loads(resp.get_data(as_text=True))
+    assert result['sentences'][0]['trans'] == \
+        u'Number\none. Number\ntwo.'
+    assert texts == [u'Number one.\nNumber two.', u'Number one.',
+                     u'Number two.']
+
+    params['fields'] = 't,ld'
+    resp = testapp.post('/api/v1.3/translate', data=params)
+    assert resp.status_code == 400
+
+
+def test_translate_v1_3_invalid_intermediate(testapp):
+    params = {
+        'text': 'Pivot translation',
+        'source': 'en',
+        'intermediate': 'xx',
+        'target': 'ko',
+    }
+    resp = testapp.post('/api/v1.3/translate', data=params)
+    assert resp.status_code == 400
+
+
+def test_translate_pipelined(monkeypatch):
+    """Long pivot translations are pipelined, with hops of different chunks
+    running concurrently."""
+    lock = threading.Lock()
+    in_flight = [0]
+    concurrency = []
+
+    def fake_translate(text, source, target, client, user_agent):
+        with lock:
+            in_flight[0] += 1
+            concurrency.append(in_flight[0])
+        time.sleep(0.01)
+        with lock:
+            in_flight[0] -= 1
+        # Japanese sentences end with a full-width period
+        if target == 'ja':
+            text = text.replace(u'.', u'\u3002')
+        else:
+            text = text.replace(u'\u3002', u'.')
+        return u'\n'.join(u'{}:{}'.format(target, line)
+                          for line in text.split('\n'))
+
+    monkeypatch.setattr(app.api, '__translate__', fake_translate)
+
+    sentences = [u'Sentence number {}.'.format(i) for i in range(200)]
+    text = u' '.join(sentences)
+    assert len(text) > app.api.PIPELINE_THRESHOLD
+
+    with create_app(config={'DEBUG': True}).test_request_context():
+        try:
+            result = translate(text, '2', 'en', 'ko')
+        finally:
+            translation_cache.clear()
+
+    assert result['intermediate_text'] == \
+        u''.join(u'ja:' + s.replace(u'.', u'\u3002') for s in sentences)
+    assert result['translated_text'] == \
+        u' '.join(u'ko:ja:' + s for s in sentences)
+    assert max(concurrency) > 1
+
+
+def test_translate_batch(testapp, monkeypatch):
+    upstream = []
+
+    def fake_translate(text, source, target, client, user_agent):
+        upstream.append((text, source, target))
+        return u'\n'.join(u'{}:{}'.format(target, line)
+                          for line in text.split('\n'))
+
+    monkeypatch.setattr(app.api, '__translate__', fake_translate)
+
+    items = [
+        {'text': 'Hello.', 'source': 'en', 'target': 'ko'},
+        {'text': 'World.', 'source': 'en', 'target': 'ko', 'mode': 1},
+        {'text': 'Hello.', 'source': 'en', 'target': 'ko'},
+        {'text': 'Hello.', 'source': 'en', 'target': 'xx'},
+        {'text': 'Hello.', 'source': 'en'},
+        {'text': 'Line one.\nLine two.', 'source': 'en', 'target': 'es'},
+    ]
+    try:
+        resp = testapp.post('/api/v1.3/translate/batch',
+                            data=json.dumps({'items': items}),
+                            content_type='application/json')
+    finally:
+        translation_cache.clear()
+    assert resp.status_code == 200
+
+    results = json.loads(resp.get_data(as_text=True))['results']
+    assert [r.get('translated_text') for r in results] == \
+        ['ko:Hello.', 'ko:World.', 'ko:Hello.', None, None,
+         'es:Line one.\nes:Line two.']
+    assert results[3]['status_code'] == 400
+    assert results[4]['status_code'] == 400
+
+    # Short texts sharing a language pair are packed into a single request
+    assert sorted(upstream) == [(u'Hello.\nWorld.', 'en', 'ko'),
+                                (u'Line one.\nLine two.', 'en', 'es')]
+
+
+def test_translate_batch_unaligned(testapp, monkeypatch):
+    """Packed texts are translated one by one when a translation has more
+    lines than its text, rather than shifting translations to other
+    texts."""
+    def fake_translate(text, source, target, client, user_agent):
+        return u'\n'.join(u'{}:{}'.format(target, line.replace('.', '.\n'))
+                          if line.startswith('Hello') else
+                          u'{}:{}'.format(target, line)
+                          for line in text.split('\n'))
+
+    monkeypatch.setattr(app.api, '__translate__', fake_translate)
+
+    items = [{'text': 'Hello.', 'source': 'en', 'target': 'ko'},
+             {'text': 'World', 'source': 'en', 'target': 'ko'}]
+    try:
+        resp = testapp.post('/api/v1.3/translate/batch',
+                            data=json.dumps({'items': items}),
+                            content_type='application/json')
+        assert resp.status_code == 200
+        results = json.loads(resp.get_data(as_text=True))['results']
+        assert [r['translated_text'] for r in results] == \
+            [u'ko:Hello.\n', u'ko:World']
+
+        with testapp.application.test_request_context():
+            assert translate('World', '1', 'en', 'ko')['translated_text'] == \
+                u'ko:World'
+    finally:
+        translation_cache.clear()
+
+
+def test_translate_batch_pack_failure(testapp, monkeypatch):
+    """Packed texts are translated one by one when their request fails, so
+    that only the item which fails it gets an error."""
+    def fake_translate(text, source, target, client, user_agent):
+        if 'fail' in text.split('\n'):
+            raise HTTPException('Google Translate returned HTTP 500', 500)
+        return u'\n'.join(u'{}:{}'.format(target, line)
+                          for line in text.split('\n'))
+
+    monkeypatch.setattr(app.api, '__translate__', fake_translate)
+
+    items = [{'text': text, 'source': 'en', 'target': 'ko'}
+             for text in ('Hello.', 'fail', 'World.')]
+    try:
+        resp = testapp.post('/api/v1.3/translate/batch',
+                            data=json.dumps({'items': items}),
+                            content_type='application/json')
+    finally:
+        translation_cache.clear()
+    assert resp.status_code == 200
+
+    results = json.loads(resp.get_data(as_text=True))['results']
+    assert results[0]['translated_text'] == u'ko:Hello.'
+    assert results[1]['status_code'] == 500
+    assert results[2]['translated_text'] == u'ko:World.'
+
+
+def test_translate_batch_invalid(testapp):
+    resp = testapp.post('/api/v1.3/translate/batch', data='{"items": 1}',
+                        content_type='application/json')
+    assert resp.status_code == 400
+
+
+def test_translate_multi(testapp, monkeypatch):
+    """The hop into the intermediate language is shared by all targets."""
+    upstream = []
+    lock = threading.Lock()
+
+    def fake_translate(text, source, target, client, user_agent):
+        with lock:
+            upstream.append((source, target))
+        return u'{}:{}'.format(target, text)
+
+    monkeypatch.setattr(app.api, '__translate__', fake_translate)
+
+    targets = ['ko', 'es', 'fr', 'ru', 'zh-CN', 'id', 'vi', 'th', 'it', 'de']
+    params = {'text': 'Hello.', 'source': 'en', 'mode': '2',
+              'targets': targets + ['ko', 'ja', 'en', 'xx']}
+    try:
+        resp = testapp.post('/api/v1.3/translate/multi',
+                            data=json.dumps(params),
+                            content_type='application/json')
+        assert resp.status_code == 200
+        results = json.loads(resp.get_data(as_text=True))['results']
+        assert len(upstream) == 11
+        assert upstream.count(('en', 'ja')) == 1
+
+        for target in targets:
+            assert results[target]['intermediate_text'] == u'ja:Hello.'
+            assert results[target]['translated_text'] == \
+                u'{}:ja:Hello.'.format(target)
+        assert results['ja']['translated_text'] == u'ja:Hello.'
+        assert results['xx']['status_code'] == 400
+
+        # No round trip into the source language
+        assert results['en']['translated_text'] == u'Hello.'
+        assert results['en']['intermediate_text'] is None
+        assert translation_cache.get(
+            make_cache_key('Hello.', 'en', 'en', '2', 'x')) is None
+
+        # Single-target requests are served from the cache
+        result = translate('Hello.', '2', 'en', 'de')
+        assert result['translated_text'] == u'de:ja:Hello.'
+        assert len(upstream) == 11
+    finally:
+        translation_cache.clear()
+
+
+def test_translate_multi_auto(testapp, monkeypatch):
+    """The source language is detected once."""
+    detections = []
+    calls = []
+
+    def lambda_get(url, params={}, data={}, headers={}, passthrough=False,
+                   exclude=(), method='get', encoding=None):
+        detections.append(params['dt'])
+        payload = {'text': json.dumps({'src': 'en'}), 'status_code': 200}
+        return {'Payload': io.BytesIO(json.dumps(payload).encode('utf-8'))}
+
+    def fake_translate(text, source, target, client, user_agent):
+        calls.append((source, target))
+        return u'{}:{}'.format(target, text)
+
+    monkeypatch.setattr(app.api, 'lambda_get', lambda_get)
+    monkeypatch.setattr(app.api, '__translate__', fake_translate)
+
+    params = {'text': 'Hello.', 'source': 'auto',
+              'targets': ['ko', 'en', 'ja']}
+    try:
+        resp = testapp.post('/api/v1.3/translate/multi',
+                            data=json.dumps(params),
+                            content_type='application/json')
+        assert resp.status_code == 200
+        results = json.loads(resp.get_data(as_text=True))['results']
+        assert results['en']['translated_text'] == u'Hello.'
+        assert results['ko']['translated_text'] == u'ko:Hello.'
+        assert detections == [['ld']]
+        assert sorted(calls) == [('en', 'ja'), ('en', 'ko')]
+
+        resp = testapp.post('/api/v1.3/translate/multi',
+                            data=json.dumps(params),
+                            content_type='application/json')
+        assert resp.status_code == 200
+        assert len(detections) == 1
+        assert len(calls) == 2
+    finally:
+        translation_cache.clear()
+
+
+@pytest.mark.parametrize('body, status_code', [
+    ({'text': 'Hello.', 'source': 'en'}, 400),
+    ({'text': 'Hello.', 'source': 'en', 'targets': 'ko'}, 400),
+    ({'text': 1, 'source': 'en', 'targets': ['ko']}, 400),
+    ({'text': 'Hello.', 'source': 'xx', 'targets': ['ko']}, 400),
+    ({'text': 'Hello.', 'source': 'en', 'targets': ['ko'], 'mode': 3}, 400),
+])
+def test_translate_multi_invalid(testapp, body, status_code):
+    resp = testapp.post('/api/v1.3/translate/multi', data=json.dumps(body),
+                        content_type='application/json')
+    assert resp.status_code == status_code
+
+
+def test_translate_stream(testapp, monkeypatch):
+    def fake_translate(text, source, target, client, user_agent):
+        return u'\n'.join(u'{}:{}'.format(target, line)
+                          for line in text.split('\n'))
+
+    monkeypatch.setattr(app.api, '__translate__', fake_translate)
+    monkeypatch.setattr(app.api, 'STREAM_CHUNK_LENGTH', 30)
+
+    paragraphs = [u'Paragraph {}. It has two sentences.'.format(i)
+                  for i in range(10)]
+    text = u'\n\n'.join(paragraphs)
+    params = {'text': text, 'source': 'en', 'target': 'es'}
+    try:
+        resp = testapp.post('/api/v1.3/translate/stream', data=params)
+        assert resp.status_code == 200
+        assert resp.mimetype == 'application/x-ndjson'
+        records = [json.loads(line) for line in
+                   resp.get_data(as_text=True).splitlines()]
+
+        resp = testapp.post('/api/v1.3/translate/stream', data=params,
+                            headers={'Accept': 'text/event-stream'})
+        assert resp.mimetype == 'text/event-stream'
+        events = resp.get_data(as_text=True).split('\n\n')
+        assert events[0].startswith('event: segment\ndata: {')
+    finally:
+        translation_cache.clear()
+
+    assert records[-1] == {'done': True, 'count': len(records) - 1}
+    segments = records[:-1]
+    assert [r['index'] for r in segments] == list(range(len(segments)))
+    assert ''.join(r['translated_text'] + r['separator']
+                   for r in segments) == \
+        u'\n\n'.join(u'es:Paragraph {}. es:It has two sentences.'.format(i)
+                     for i in range(10))
+
+
+def test_translate_stream_invalid(testapp):
+    params = {'text': '', 'source': 'en', 'target': 'es'}
+    resp = testapp.post('/api/v1.3/translate/stream', data=params)
+    assert resp.status_code == 400
+
+
+def test_translate_chunked(monkeypatch):
+    """Texts longer than MAX_TEXT_LENGTH are translated in chunks."""
+    upstream = []
+
+    def fake_translate(text, source, target, client, user_agent):
+        upstream.append(text)
+        return u'\n'.join(u'{}:{}'.format(target, line)
+                          for line in text.split('\n'))
+
+    monkeypatch.setattr(app.api, '__translate__', fake_translate)
+    monkeypatch.setattr(app.api, 'MAX_TEXT_LENGTH', 100)
+    monkeypatch.setattr(app.api, 'MAX_CHUNK_LENGTH', 50)
+
+    sentences = [u'Sentence number {}.'.format(i) for i in range(20)]
+    text = u' '.join(sentences)
+
+    with create_app(config={'DEBUG': True}).test_request_context():
+        try:
+            result = translate(text, '1', 'en', 'ko')
+        finally:
+            translation_cache.clear()
+
+        with pytest.raises(HTTPException):
+            translate(text, '1', 'en', 'ko', client='t')
+
+    assert result['translated_text'] == \
+        u' '.join(u'ko:' + s for s in sentences)
+    assert result['intermediate_text'] is None
+    assert len(upstream) > 1
+    assert all(len(t) <= 50 for t in upstream)
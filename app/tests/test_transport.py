@@ -0,0 +1,79 @@
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+
+from app.transport import UpstreamTransport, get_transport
+
+
+class FlakyAdapter(BaseAdapter):
+    """Fails with `error` for the first `failures` requests."""
+
+    def __init__(self, failures, error=requests.ConnectionError):
+        super(FlakyAdapter, self).__init__()
+        self.failures = failures
+        self.error = error
+        self.requests = []
+
+    def send(self, request, **kwargs):
+        self.requests.append((request, kwargs))
+        if len(self.requests) <= self.failures:
+            raise self.error('Connection refused')
+
+        resp = requests.Response()
+        resp.status_code = 200
+        resp._content = b'{}'
+        return resp
+
+    def close(self):
+        pass
+
+
+def make_transport(failures, max_retries, error=requests.ConnectionError):
+    delays = []
+    transport = UpstreamTransport(max_retries=max_retries, backoff=0.5,
+                                  sleep=delays.append)
+    adapter = FlakyAdapter(failures, error)
+    transport.session.mount('http://', adapter)
+    return transport, adapter, delays
+
+
+def test_transport_retry():
+    transport, adapter, delays = make_transport(failures=2, max_retries=2)
+
+    resp = transport.post('http://translate.google.com/translate_a/t')
+    assert resp.status_code == 200
+    assert len(adapter.requests) == 3
+    assert len(delays) == 2
+    assert 0 <= delays[0] <= 0.5
+    assert 0 <= delays[1] <= 1.0
+
+    # Default timeouts are applied to every request
+    _, kwargs = adapter.requests[0]
+    assert kwargs['timeout'] == (transport.connect_timeout,
+                                 transport.read_timeout)
+
+
+def test_transport_retry_exhausted():
+    transport, adapter, delays = make_transport(failures=3, max_retries=1)
+
+    with pytest.raises(requests.ConnectionError):
+        transport.get('http://translate.google.com/translate_a/t')
+    assert len(adapter.requests) == 2
+
+
+def test_transport_retry_timeouts():
+    transport, adapter, delays = make_transport(
+        failures=1, max_retries=2, error=requests.ConnectTimeout)
+    assert transport.get('http://translate.google.com/').status_code == 200
+    assert len(adapter.requests) == 2
+
+    # A read timeout is not retried, lest it be waited for again
+    transport, adapter, delays = make_transport(
+        failures=1, max_retries=2, error=requests.ReadTimeout)
+    with pytest.raises(requests.ReadTimeout):
+        transport.get('http://translate.google.com/')
+    assert len(adapter.requests) == 1
+
+
+def test_get_transport():
+    assert get_transport() is get_transport()
@@ -1,4 +1,6 @@
-from app.utils import HTTPException
+import pytest
+
+from app.utils import HTTPException, parse_javascript
 
 
 def test_http_exception():
@@ -8,3 +10,38 @@ def test_http_exception():
     except HTTPException as e:
         assert 'An HTTP exception' == e.message
         assert 500 == e.status_code
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('[1,,2]', [1, None, 2]),
+    ('[,1]', [None, 1]),
+    ('[1,,]', [1, None]),
+    ('[,]', [None]),
+    ('[]', []),
+    (' [ 1 , [ ] ] ', [1, []]),
+    ('[[1,,,4],,"en",{"k":[,2]}]', [[1, None, None, 4], None, 'en',
+                                    {'k': [None, 2]}]),
+    # Commas inside string literals are not elisions
+    ('[["a,,b","[,c"],,"d\\",,e"]', [['a,,b', '[,c'], None, 'd",,e']),
+])
+def test_parse_javascript(text, expected):
+    assert parse_javascript(text) == expected
+
+
+def test_parse_javascript_path():
+    raw = '[[["Hallo","Hello",,,1],["Welt,,","Wo\\"rld",,,1]],,"en"]'
+    assert parse_javascript(raw, (0, None, 0)) == ['Hallo', 'Welt,,']
+    assert parse_javascript(raw, (0, 1, 1)) == 'Wo"rld'
+    assert parse_javascript(raw, (1,)) is None
+    assert parse_javascript(raw, (2,)) == 'en'
+
+    with pytest.raises(IndexError):
+        parse_javascript(raw, (3,))
+
+
+@pytest.mark.parametrize('text', [
+    '', '[1', '[1 2]', '["a]', '[1,x]', '[1]x',
+])
+def test_parse_javascript_invalid(text):
+    with pytest.raises(ValueError):
+        parse_javascript(text)
@@ -0,0 +1,160 @@
+"""Upstream transport shared by all requests handled by a worker process.
+
+Keeping a single :class:`requests.Session` and a single Lambda client per
+process lets us reuse keep-alive connections to Google Translate and to AWS
+rather than paying for a TCP/TLS handshake and a boto3 client construction
+on every request."""
+
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app import config, logger
+
+
+def create_aws_session():
+    """First attempt to get AWS configuration from the environment variables;
+    then try to access the config object if environment variables are not
+    available."""
+    from boto3.session import Session
+    access_key = os.environ.get('AWS_ACCESS_KEY_ID',
+                                config['aws']['access_key'])
+    secret_key = os.environ.get('AWS_SECRET_ACCESS_KEY',
+                                config['aws']['secret_key'])
+    region = os.environ.get('AWS_DEFAULT_REGION',
+                            config['aws']['region'])
+
+    return Session(aws_access_key_id=access_key,
+                   aws_secret_access_key=secret_key,
+                   region_name=region)
+
+
+def create_lambda_client(pool_size, connect_timeout, read_timeout,
+                         max_retries):
+    from botocore.config import Config
+    return create_aws_session().client('lambda', config=Config(
+        max_pool_connections=pool_size,
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+        retries={'max_attempts': max_retries}))
+
+
+class UpstreamTransport(object):
+    """Pooled, keep-alive HTTP transport with bounded retries.
+
+    Only connection errors (including connect timeouts) are retried, as the
+    request has not reached the server then. Read timeouts are not: each
+    would take another `read_timeout`, and a few of them would outlast the
+    worker timeout of gunicorn. HTTP error responses are returned as they
+    are, because retrying on a captcha page would only make things worse."""
+
+    def __init__(self, pool_size=10, connect_timeout=3.05, read_timeout=10,
+                 max_retries=2, backoff=0.1, sleep=time.sleep):
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.sleep = sleep
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._lambda_client = None
+        self._lock = threading.Lock()
+
+    def backoff_delay(self, attempt):
+        """Exponential backoff with full jitter."""
+        return random.uniform(0, self.backoff * (2 ** attempt))
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', (self.connect_timeout, self.read_timeout))
+        attempt = 0
+        while True:
+            try:
+                return self.session.request(method, url, **kwargs)
+            # `ConnectTimeout` is a `ConnectionError` as well
+            except requests.ConnectionError as e:
+                if attempt >= self.max_retries:
+                    raise
+                logger.warning('Retrying {} {}: {}'.format(method, url, e))
+                self.sleep(self.backoff_delay(attempt))
+                attempt += 1
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    @property
+    def lambda_client(self):
+        """boto3 clients are thread-safe, so a single instance is shared by
+        all threads of the process. botocore takes care of retrying (with
+        jitter) on throttling and connection errors."""
+        if self._lambda_client is None:
+            with self._lock:
+                if self._lambda_client is None:
+                    self._lambda_client = create_lambda_client(
+                        self.pool_size, self.connect_timeout,
+                        self.read_timeout, self.max_retries + 1)
+        return self._lambda_client
+
+
+_transport = None
+_transport_pid = None
+_transport_lock = threading.Lock()
+
+
+def get_transport():
+    """Returns the transport of the current worker process. A new one is
+    created after a fork, as connection pools must not be shared between
+    processes."""
+    global _transport, _transport_pid
+
+    pid = os.getpid()
+    if _transport is None or _transport_pid != pid:
+        with _transport_lock:
+            if _transport is None or _transport_pid != pid:
+                upstream_config = config.get('upstream') or {}
+                _transport = UpstreamTransport(
+                    pool_size=int(upstream_config.get('pool_size', 10)),
+                    connect_timeout=float(
+                        upstream_config.get('connect_timeout', 3.05)),
+                    read_timeout=float(
+                        upstream_config.get('read_timeout', 10)),
+                    max_retries=int(upstream_config.get('max_retries', 2)),
+                    backoff=float(upstream_config.get('backoff', 0.1)))
+                _transport_pid = pid
+    return _transport
+
+
+_executor = None
+_executor_pid = None
+
+
+def get_executor():
+    """Returns the thread pool of the current worker process that runs
+    upstream requests concurrently.
+
+    Tasks submitted to this pool must not wait on other tasks of the same
+    pool; otherwise, the pool may run out of threads and deadlock."""
+    global _executor, _executor_pid
+
+    pid = os.getpid()
+    if _executor is None or _executor_pid != pid:
+        with _transport_lock:
+            if _executor is None or _executor_pid != pid:
+                upstream_config = config.get('upstream') or {}
+                _executor = ThreadPoolExecutor(
+                    int(upstream_config.get('workers', 8)))
+                _executor_pid = pid
+    return _executor
@@ -4,18 +4,21 @@ from flask import g, request, redirect, url_for, jsonify
 
 from app import VALID_LANGUAGES
 
+import json
+import re
 import uuid
 import base62
-import json
+from json.decoder import scanstring
 
 
 class HTTPException(RuntimeError):
     """HTTPError does not take keyword arguments, so we are defining a custom
     exception class.
     """
-    def __init__(self, message, status_code):
+    def __init__(self, message, status_code, headers=None):
         self.message = message
         self.status_code = status_code
+        self.headers = headers or {}
         super(HTTPException, self).__init__()
 
 
@@ -81,10 +84,194 @@ def language_options_html():
     return '\n'.join(['<option value="%s">%s</option>' % (k, v) for k, v in sorted_tuples])
 
 
-def parse_javascript(text):
-    # NOTE: This may not work in some cases...
-    text = text.replace(',,,', ',null,null,')
-    text = text.replace(',,', ',null,')
-    text = text.replace('[,', '[null,')
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_STRING_END = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*"')
+_SPECIAL = re.compile(r'[\[\]{}"]')
+
+# The (C-accelerated) scanner of the json module decodes a single JSON value
+# at a given position. It is used for every value that has no elisions in it.
+_scan_once = json.JSONDecoder().scan_once
+
+
+def _skip_whitespace(text, pos):
+    return _WHITESPACE.match(text, pos).end()
+
+
+def _scan_value(text, pos):
+    """Decodes the value starting at `pos`, which may be an array or an
+    object with elisions somewhere in it."""
+    try:
+        return _scan_once(text, pos)
+    except (StopIteration, ValueError):
+        char = text[pos:pos + 1]
+        if char == '[':
+            return _parse_array(text, pos + 1)
+        if char == '{':
+            return _parse_object(text, pos + 1)
+        raise ValueError('Invalid value at {}'.format(pos))
+
+
+def _parse_array(text, pos):
+    """Decodes an array, starting right after its opening bracket, where
+    consecutive commas denote elided (null) elements as in JavaScript."""
+    items = []
+    append = items.append
+    expect_value = True
+    while True:
+        char = text[pos:pos + 1]
+        if char == ',':
+            if expect_value:
+                append(None)
+            expect_value = True
+            pos += 1
+        elif char == ']':
+            return items, pos + 1
+        elif char in ' \t\n\r' and char:
+            pos = _skip_whitespace(text, pos)
+        elif not char:
+            raise ValueError('Unterminated array')
+        elif not expect_value:
+            raise ValueError('Expected a comma at {}'.format(pos))
+        else:
+            value, pos = _scan_value(text, pos)
+            append(value)
+            expect_value = False
+
+
+def _parse_object(text, pos):
+    obj = {}
+    pos = _skip_whitespace(text, pos)
+    if text[pos:pos + 1] == '}':
+        return obj, pos + 1
+
+    while True:
+        pos = _skip_whitespace(text, pos)
+        if text[pos:pos + 1] != '"':
+            raise ValueError('Expected a key at {}'.format(pos))
+        key, pos = scanstring(text, pos + 1)
+
+        pos = _skip_whitespace(text, pos)
+        if text[pos:pos + 1] != ':':
+            raise ValueError('Expected a colon at {}'.format(pos))
+        obj[key], pos = _scan_value(text, _skip_whitespace(text, pos + 1))
+
+        pos = _skip_whitespace(text, pos)
+        char = text[pos:pos + 1]
+        if char == '}':
+            return obj, pos + 1
+        if char != ',':
+            raise ValueError('Expected a comma at {}'.format(pos))
+        pos += 1
+
+
+def _skip_value(text, pos):
+    """Returns the position next to the end of the value starting at `pos`,
+    without decoding it."""
+    char = text[pos]
+    if char == '"':
+        match = _STRING_END.match(text, pos + 1)
+        if match is None:
+            raise ValueError('Unterminated string at {}'.format(pos))
+        return match.end()
+    if char in '[{':
+        return _skip_nested(text, pos + 1)
+    return _scan_value(text, pos)[1]
+
+
+def _skip_nested(text, pos):
+    """Returns the position next to the end of the array or object that
+    `pos` is in."""
+    depth = 1
+    while True:
+        match = _SPECIAL.search(text, pos)
+        if match is None:
+            raise ValueError('Unterminated array or object')
+        char, pos = match.group(), match.end()
+        if char == '"':
+            pos = _skip_value(text, pos - 1)
+        elif char in '[{':
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return pos
+
+
+def _select(text, pos, path, need_end):
+    """Decodes the elements of the array starting at `pos` selected by
+    `path`, skipping the others.
+
+    :param need_end: when false, the rest of the array is left unread once
+                     a single selected element has been decoded
+    """
+    pos = _skip_whitespace(text, pos)
+    if text[pos:pos + 1] != '[':
+        raise ValueError('Expected an array at {}'.format(pos))
+    pos += 1
+
+    index, path = path[0], path[1:]
+    items = []
+    length = 0
+    expect_value = True
+    while True:
+        pos = _skip_whitespace(text, pos)
+        char = text[pos:pos + 1]
+        if char == ']':
+            if index is not None:
+                raise IndexError('Array index out of range: {}'.format(index))
+            return items, pos + 1
+        elif not char:
+            raise ValueError('Unterminated array')
+        elif char == ',':
+            if expect_value:
+                # Elided element
+                if index == length:
+                    return None, \
+                        _skip_nested(text, pos) if need_end else pos
+                elif index is None:
+                    items.append(None)
+                length += 1
+            expect_value = True
+            pos += 1
+        elif not expect_value:
+            raise ValueError('Expected a comma at {}'.format(pos))
+        else:
+            if index is None or index == length:
+                if path:
+                    value, pos = _select(text, pos, path,
+                                         index is None or need_end)
+                else:
+                    value, pos = _scan_value(text, pos)
+                if index is not None:
+                    return value, \
+                        _skip_nested(text, pos) if need_end else pos
+                items.append(value)
+            else:
+                pos = _skip_value(text, pos)
+            length += 1
+            expect_value = False
+
+
+def parse_javascript(text, path=None):
+    """Decodes a JavaScript array literal as returned by Google Translate,
+    where consecutive commas denote elided elements (e.g., `[1,,2]`).
+
+    Unlike rewriting elisions into `null` before calling `json.loads()`,
+    this is not fooled by commas inside string literals. Values without
+    elisions are decoded by the C scanner of the json module; only arrays
+    with elisions are walked element by element.
+
+    :param path: a sequence of array indices, or `None` meaning 'every
+                 element', to decode only part of the structure. For
+                 example, `(0, None, 0)` yields the first element of each
+                 element of the first element, i.e., `[x[0] for x in
+                 parsed[0]]`. Everything else is skipped without being
+                 decoded.
+    """
+    if path:
+        return _select(text, 0, tuple(path), need_end=False)[0]
 
-    return json.loads(text)
+    value, pos = _scan_value(text, _skip_whitespace(text, 0))
+    if _skip_whitespace(text, pos) != len(text):
+        raise ValueError('Extra data at {}'.format(pos))
+    return value
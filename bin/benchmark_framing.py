@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks the compressed framing of responses relayed by the Lambda proxy
+functions against the JSON envelope, on synthetic responses shaped like
+those of the 'translate_a/single' endpoint (dj=1).
+
+The time of a round trip is estimated as the time it takes the function to
+encode the response, plus the time to transfer the invocation payload at the
+given bandwidth, plus the time it takes the app to decode it."""
+
+import json
+import os
+import random
+import sys
+import timeit
+
+import click
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'lambda'))
+
+from app.api import read_lambda_body  # noqa: E402
+from lambda_function import encode, negotiate  # noqa: E402
+
+
+class FakeResponse(object):
+
+    def __init__(self, content):
+        self.content = content
+        self.text = content.decode('utf-8')
+        self.status_code = 200
+        self.headers = {'Content-Type': 'application/json; charset=UTF-8'}
+
+
+def make_body(sentences, rng):
+    words = ['translation', 'Google', 'better', 'language', 'sentence',
+             u'번역', u'문장', u'翻訳', u'言語']
+
+    def sentence():
+        return ' '.join(rng.choice(words) for _ in range(12)) + '.'
+
+    entries = [{'trans': sentence(), 'orig': sentence(), 'backend': 3}
+               for _ in range(sentences)]
+    entries.append({'translit': sentence(), 'src_translit': sentence()})
+    return json.dumps({
+        'sentences': entries,
+        'src': 'en',
+        'confidence': 0.87,
+        'ld_result': {'srclangs': ['en'], 'srclangs_confidences': [0.87]},
+    }, ensure_ascii=False).encode('utf-8')
+
+
+def bench(fn, repeat):
+    return min(timeit.repeat(fn, number=1, repeat=repeat))
+
+
+def measure(resp, encoding, repeat):
+    """Returns the size of the invocation payload, and the times to encode
+    and decode it."""
+    # The Lambda runtime serializes the result of the handler with json
+    payload = json.dumps(encode(resp, encoding)).encode('utf-8')
+    encode_time = bench(lambda: json.dumps(encode(resp, encoding)), repeat)
+    decode_time = bench(
+        lambda: read_lambda_body(json.loads(payload.decode('utf-8'))), repeat)
+    return len(payload), encode_time, decode_time
+
+
+@click.command()
+@click.option('--sentences', default=200, help='Sentences per response')
+@click.option('--repeat', default=20, help='Number of runs per framing')
+@click.option('--bandwidth', default=100.0,
+              help='Bandwidth between AWS Lambda and the app, in Mbit/s')
+def main(sentences, repeat, bandwidth):
+    resp = FakeResponse(make_body(sentences, random.Random(0)))
+    assert read_lambda_body(json.loads(json.dumps(encode(
+        resp, negotiate(['zlib'])))))[0] == resp.content
+
+    click.echo('Response size: {:,} bytes'.format(len(resp.content)))
+    click.echo('{:12} {:>10} {:>10} {:>10} {:>10}'.format(
+        'framing', 'payload', 'encode', 'decode', 'total'))
+    for name, encoding in (('json', None), ('zlib', 'zlib')):
+        size, encode_time, decode_time = measure(resp, encoding, repeat)
+        transfer_time = size * 8 / (bandwidth * 1e6)
+        click.echo('{:12} {:>10,} {:>8.2f}ms {:>8.2f}ms {:>8.2f}ms'.format(
+            name, size, encode_time * 1000, decode_time * 1000,
+            (encode_time + transfer_time + decode_time) * 1000))
+
+
+if __name__ == '__main__':
+    main()
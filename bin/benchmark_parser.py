@@ -0,0 +1,85 @@
+"""Benchmarks `parse_javascript()` against the former implementation, which
+rewrote elisions with `str.replace()` before calling `json.loads()`, on
+synthetic responses shaped like those of the 'translate_a/single' endpoint
+(client 't')."""
+
+import json
+import random
+import timeit
+
+import click
+
+from app.utils import parse_javascript
+
+
+def legacy_parse_javascript(text):
+    text = text.replace(',,,', ',null,null,')
+    text = text.replace(',,', ',null,')
+    text = text.replace('[,', '[null,')
+
+    return json.loads(text)
+
+
+def to_javascript(value):
+    """Serializes a value the way Google Translate does, eliding `None`
+    elements of arrays."""
+    if isinstance(value, list):
+        return '[' + ','.join('' if x is None else to_javascript(x)
+                              for x in value) + ']'
+    return json.dumps(value, ensure_ascii=False)
+
+
+def make_response(sentences, rng, tricky=False):
+    words = ['translation', 'Google', 'better', 'language', 'sentence',
+             u'번역', u'翻訳', 'naive', 'quote"d']
+    if tricky:
+        # Consecutive commas inside string literals break the legacy parser
+        words.append('a,,b')
+
+    def sentence():
+        return ' '.join(rng.choice(words) for _ in range(12)) + '.'
+
+    return to_javascript([
+        [[sentence(), sentence(), None, None, 3] for _ in range(sentences)] +
+        [[None, None, 'beonyeog']],
+        None, 'en', None, None,
+        [[sentence(), None, [[sentence(), 1000, True, False]], [[0, 10]],
+          sentence(), 0, 10] for _ in range(sentences)],
+        0.87, None, [['en'], None, [0.87], ['en']],
+    ])
+
+
+def bench(fn, text, repeat):
+    return min(timeit.repeat(lambda: fn(text), number=1, repeat=repeat))
+
+
+@click.command()
+@click.option('--sentences', default=1000, help='Sentences per response')
+@click.option('--repeat', default=10, help='Number of runs per parser')
+def main(sentences, repeat):
+    rng = random.Random(0)
+    text = make_response(sentences, rng)
+    assert parse_javascript(text) == legacy_parse_javascript(text)
+
+    legacy = bench(legacy_parse_javascript, text, repeat)
+    full = bench(parse_javascript, text, repeat)
+    projected = bench(lambda t: parse_javascript(t, (0, None, 0)), text,
+                      repeat)
+
+    click.echo('Response size: {:,} bytes'.format(len(text.encode('utf-8'))))
+    click.echo('legacy parser:           {:8.2f} ms'.format(legacy * 1000))
+    click.echo('single-pass parser:      {:8.2f} ms'.format(full * 1000))
+    click.echo('single-pass (sentences): {:8.2f} ms'.format(projected * 1000))
+
+    tricky = make_response(10, rng, tricky=True)
+    try:
+        legacy_ok = legacy_parse_javascript(tricky) == \
+            parse_javascript(tricky)
+    except ValueError:
+        legacy_ok = False
+    click.echo('legacy parser correct on ",," in strings: {}'.format(
+        legacy_ok))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""Builds the character n-gram model of app/langid.py.
+
+N-gram counts are read either from plain texts, one file per language named
+after its code (e.g., 'en.txt'), or from the language profiles of langdetect
+(https://github.com/Mimino666/langdetect, under the Apache License 2.0), of
+which the shipped model is built:
+
+    pip download langdetect==1.0.9 --no-deps --no-binary :all:
+    tar xzf langdetect-1.0.9.tar.gz
+    PYTHONPATH=. python bin/build_langid.py \
+        --profiles langdetect-1.0.9/langdetect/profiles
+
+Languages that are not supported are kept in the model as others, so that a
+text in one of them (e.g., Ukrainian) is left to Google Translate rather than
+taken for the closest supported language (e.g., Russian). Only the most
+frequent n-grams of each language are kept, and their costs are quantized to
+a byte each, which keeps the model small."""
+
+import io
+import json
+import math
+import os
+import zlib
+from collections import Counter
+
+import click
+
+from app import SOURCE_LANGUAGES
+from app.langid import MODEL_PATH, SCRIPT_LANGUAGES, iter_ngrams, normalize
+
+
+#: Lengths of the n-grams
+ORDERS = (1, 2, 3)
+
+#: Units of a cost per nat; a cost of a byte goes up to 255 / SCALE nats
+SCALE = 16
+
+
+#: Languages of langdetect under other codes
+PROFILE_CODES = {'he': 'iw', 'zh-cn': 'zh-CN', 'zh-tw': 'zh-TW'}
+
+#: Languages written in Han characters, which are not identified by the
+#: model; profiles of langdetect lump these characters into classes anyway
+HAN_LANGUAGES = ('ja', 'zh-CN', 'zh-TW')
+
+#: Share of the letters of a language that supported languages are also
+#: written in, below which it is left out of the model, as its texts have no
+#: n-grams of the model anyway
+MIN_SHARED_LETTERS = 0.5
+
+
+def is_modeled(language):
+    """Returns whether a language is identified by the model rather than by
+    its script, or not at all."""
+    return language not in SCRIPT_LANGUAGES and language not in HAN_LANGUAGES
+
+
+def read_profile(path):
+    """Returns the n-gram counts of a langdetect profile."""
+    with io.open(path, encoding='utf-8') as fin:
+        profile = json.load(fin)
+    counts = Counter()
+    for ngram, count in profile['freq'].items():
+        # Profiles count n-grams of texts which are not lowercased
+        counts[ngram.lower()] += count
+    return counts
+
+
+def read_text(path):
+    """Returns the n-gram counts of a text."""
+    with io.open(path, encoding='utf-8') as fin:
+        return Counter(iter_ngrams(normalize(fin.read()), ORDERS))
+
+
+def quantize(probability):
+    return min(255, int(round(-math.log(probability) * SCALE)))
+
+
+def build(counts, top):
+    """Builds a model out of the n-gram counts of each language, keeping the
+    `top` most frequent n-grams of each order in each language. Languages
+    that are not supported are marked as others."""
+    languages = sorted(counts)
+    kept = {}
+    unseen = []
+    for language in languages:
+        costs = {}
+        worst = 0
+        for n in ORDERS:
+            grams = Counter({g: c for g, c in counts[language].items()
+                             if len(g) == n and g.strip()})
+            total = float(sum(grams.values()))
+            for ngram, count in grams.most_common(top[n]):
+                costs[ngram] = quantize(count / total)
+                worst = max(worst, costs[ngram])
+        kept[language] = costs
+        # An n-gram not seen in a language is taken to be half as likely as
+        # the rarest one kept
+        unseen.append(min(255, worst + int(round(math.log(2) * SCALE))))
+
+    ngrams = sorted(set().union(*kept.values()))
+    return {
+        'languages': languages,
+        'others': [language for language in languages
+                   if language not in SOURCE_LANGUAGES],
+        'orders': ORDERS,
+        'scale': SCALE,
+        'unseen': unseen,
+        'ngrams': {g: [kept[language].get(g) for language in languages]
+                   for g in ngrams},
+    }
+
+
+@click.command()
+@click.option('--profiles', type=click.Path(exists=True, file_okay=False),
+              help='Directory of langdetect profiles')
+@click.option('--corpus', type=click.Path(exists=True, file_okay=False),
+              help="Directory of texts named '<language>.txt'")
+@click.option('--output', default=MODEL_PATH, show_default=True)
+@click.option('--top', default=(40, 250, 400), nargs=3, type=int,
+              show_default=True,
+              help='N-grams kept per language, of each order')
+def main(profiles, corpus, output, top):
+    if bool(profiles) == bool(corpus):
+        raise click.UsageError('Give either --profiles or --corpus.')
+
+    counts = {}
+    for name in sorted(os.listdir(profiles or corpus)):
+        path = os.path.join(profiles or corpus, name)
+        if profiles:
+            language = PROFILE_CODES.get(name, name)
+        elif name.endswith('.txt'):
+            language = name[:-len('.txt')]
+        else:
+            continue
+        if is_modeled(language):
+            counts[language] = read_profile(path) if profiles \
+                else read_text(path)
+
+    letters = set(letter for language in counts
+                  if language in SOURCE_LANGUAGES
+                  for letter in counts[language] if len(letter) == 1)
+    for language in list(counts):
+        total = sum(c for g, c in counts[language].items() if len(g) == 1)
+        shared = sum(c for g, c in counts[language].items() if g in letters)
+        if shared < total * MIN_SHARED_LETTERS:
+            del counts[language]
+
+    for language in SOURCE_LANGUAGES:
+        if is_modeled(language) and language not in counts:
+            click.echo('No n-grams of {}'.format(language), err=True)
+
+    model = build(counts, dict(zip(ORDERS, top)))
+    payload = zlib.compress(json.dumps(
+        model, ensure_ascii=False, sort_keys=True,
+        separators=(',', ':')).encode('utf-8'), 9)
+    with open(output, 'wb') as fout:
+        fout.write(payload)
+
+    click.echo('{} languages ({} others), {:,} n-grams, {:,} bytes'.format(
+        len(model['languages']), len(model['others']), len(model['ngrams']),
+        len(payload)))
+
+
+if __name__ == '__main__':
+    main()
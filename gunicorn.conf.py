@@ -0,0 +1,46 @@
+"""Gunicorn configuration for serving `application.py` with cooperative
+(green-thread) workers.
+
+With the gevent worker class, every request runs in a greenlet and blocking
+I/O (sockets of requests, boto3 and pynamodb, threads and locks of the
+standard library) is monkey-patched to yield to other greenlets, so a single
+worker multiplexes many upstream-bound requests. psycopg2 talks to PostgreSQL
+in C, out of reach of the monkey patching, and is made cooperative with
+psycogreen.
+
+This module must not import the application, as monkey patching has to
+happen before modules such as ssl are imported. Settings come from the
+environment:
+
+- `GUNICORN_WORKER_CLASS`: `gevent` (default) or `sync`
+- `WEB_CONCURRENCY`: number of worker processes (default: 1)
+- `GUNICORN_WORKER_CONNECTIONS`: maximum number of concurrent requests per
+  worker (default: 200)
+- `GUNICORN_TIMEOUT`: seconds after which a silent worker is restarted
+  (default: 30)
+
+Usage: gunicorn --config gunicorn.conf.py application:application
+"""
+
+import os
+
+
+bind = '0.0.0.0:{}'.format(os.environ.get('PORT', 8000))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 200))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+
+# Loading the application in the master process would import (and create
+# connections with) unpatched modules
+preload_app = False
+
+
+def post_fork(server, worker):
+    if worker_class != 'gevent':
+        return
+    try:
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+    except ImportError as e:
+        server.log.warning('Database access is blocking: %s', e)
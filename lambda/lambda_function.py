@@ -1,17 +1,118 @@
-__version__ = '0.1.1'
+__version__ = '0.3.0'
 
+import base64
+import json
 import socket
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
+from requests.adapters import HTTPAdapter
+
+
+#: Upper bound of the number of requests of a batch sent concurrently
+MAX_WORKERS = 8
+
+#: Seconds to wait for Google Translate
+TIMEOUT = 10
+
+#: Encodings of response bodies, in order of preference
+ENCODINGS = ('zlib',)
+
+#: Level of zlib compression, from 1 (fastest) to 9 (smallest)
+COMPRESSION_LEVEL = 6
+
+# Warm invocations of a container reuse the connections of this session
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=1,
+                                      pool_maxsize=MAX_WORKERS))
+session.mount('http://', HTTPAdapter(pool_connections=1,
+                                     pool_maxsize=MAX_WORKERS))
+
+
+class UpstreamError(Exception):
+    """Raised in the pass-through mode to return a non-200 response. Its
+    message is the JSON-encoded response, which the caller finds in the
+    `errorMessage` field of the invocation result."""
+
+
+def send(request):
+    """Sends a request described by a dictionary of 'url', and optionally
+    'method' ('get' by default), 'params', 'data' and 'headers'."""
+    return session.request(request.get('method', 'get').upper(),
+                           request['url'],
+                           params=request.get('params', {}),
+                           data=request.get('data', {}),
+                           headers=request.get('headers', {}),
+                           timeout=TIMEOUT)
+
+
+def negotiate(accept_encoding):
+    """Returns the first of `ENCODINGS` that the caller accepts, if any."""
+    for encoding in ENCODINGS:
+        if encoding in accept_encoding:
+            return encoding
+    return None
+
+
+def encode(resp, encoding=None):
+    """Returns a response as a dictionary of its text and status code or,
+    given an encoding (see `negotiate()`), of its status code, content type
+    and raw body compressed with the encoding and encoded in base64."""
+    if encoding == 'zlib':
+        body = zlib.compress(resp.content, COMPRESSION_LEVEL)
+        return {
+            'status_code': resp.status_code,
+            'headers': {
+                'Content-Type': resp.headers.get('Content-Type', ''),
+            },
+            'encoding': encoding,
+            'body': base64.b64encode(body).decode('ascii'),
+        }
+    return {'text': resp.text, 'status_code': resp.status_code}
+
+
+def send_batch(requests_, encoding=None):
+    """Sends requests concurrently and returns the response to each of them
+    (see `encode()`)."""
+
+    def respond(request):
+        try:
+            resp = send(request)
+        except requests.RequestException as e:
+            return {'text': str(e), 'status_code': 502}
+        return encode(resp, encoding)
+
+    if not requests_:
+        return []
+    with ThreadPoolExecutor(min(MAX_WORKERS, len(requests_))) as executor:
+        return list(executor.map(respond, requests_))
 
 
 def lambda_handler(event, context):
     hostname = socket.gethostbyname(socket.gethostname())
     print('{}: {}'.format(hostname, event))
 
-    url = event['url']
-    params = event.get('params', {})
-    data = event.get('data', {})
-    headers = event.get('headers', {})
-    resp = requests.get(url, params=params, data=data, headers=headers)
-    return {'text': resp.text, 'status_code': resp.status_code}
+    # Callers that do not know about encodings (or proxies that do not
+    # support them) keep exchanging text
+    encoding = negotiate(event.get('accept_encoding', ()))
+
+    # A batch of requests, of which the responses come back in order
+    if 'requests' in event:
+        return {'responses': send_batch(event['requests'], encoding)}
+
+    resp = send(event)
+
+    # In the pass-through mode, a JSON response body becomes the invocation
+    # result itself, so that the caller can relay it as it is rather than
+    # unwrapping it from another JSON document
+    if event.get('passthrough') and encoding is None:
+        if resp.status_code == 200:
+            try:
+                return resp.json()
+            except ValueError:
+                pass
+        raise UpstreamError(json.dumps({'text': resp.text,
+                                        'status_code': resp.status_code}))
+
+    return encode(resp, encoding)